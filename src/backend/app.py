@@ -5,7 +5,7 @@ import sys
 
 sys.path.append('common')
 
-import traceback
+import asyncio, hmac, json, traceback
 from datetime import datetime
 
 from aiohttp import web
@@ -20,7 +20,10 @@ from botbuilder.core.integration import aiohttp_error_middleware
 from botbuilder.schema import Activity, ActivityTypes
 
 from bot import MyBot
-from common.config import BotConfig
+from common.config import BotConfig, EligibilityEndpointConfig, HttpClientConfig
+import local_eligibility, code_index, session_history
+from http_client import close_async_client, connection_metrics
+from eligibility_stream import stream_customers
 
 BOT_CONFIG = BotConfig()
 
@@ -80,8 +83,81 @@ async def messages(req: Request) -> Response:
     return Response(status=201)
 
 
+# Key check of the batch and metrics endpoints (the x-functions-key header, as for the Azure Function), in constant
+# time; nothing is authorized without a key
+def _authorized(req: Request) -> bool:
+    if not EligibilityEndpointConfig.BATCH_KEY:
+        return False
+    key = req.headers.get("x-functions-key", "")
+    return hmac.compare_digest(key.encode("utf-8"), EligibilityEndpointConfig.BATCH_KEY.encode("utf-8"))
+
+
+# Batch eligibility: the request body is NDJSON, one {"id": ..., "codes": [...]} customer per line, and the response
+# is NDJSON too, a {"rules": [...], "version": ...} header line then one {"id": ..., "eligibility": "0110..."} line per
+# customer, written a chunk of customers at a time as the request is read. A new header line is written if the rules
+# change while the batch is streamed.
+# An invalid customer line is answered with HTTP 400 if it is in the first chunk; once results are streamed the status
+# is sent already, so the customers read before it get their results, then the response ends with a {"error": ...}
+# line and the following customers are not evaluated: clients must check the last line (see
+# common/eligibility_stream.py).
+async def eligibility_batch(req: Request) -> web.StreamResponse:
+    if not EligibilityEndpointConfig.BATCH_KEY:
+        return Response(status=404)
+    if not _authorized(req):
+        return Response(status=401)
+
+    loop = asyncio.get_running_loop()
+    cache = local_eligibility.get_cache()
+
+    # prepared with the first chunk of results, so the first chunk can still be rejected with a 400
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+
+    header = None
+    async def write_chunk(ids, code_sets):
+        nonlocal header
+        version, names, lines = await loop.run_in_executor(None, local_eligibility.evaluate_lines, cache, ids, code_sets)
+        if not response.prepared:
+            await response.prepare(req)
+        if (version, names) != header:
+            header = (version, names)
+            await response.write((json.dumps({"rules": names, "version": version}) + "\n").encode("utf-8"))
+        await response.write(lines)
+
+    error = await stream_customers(req.content, write_chunk, response.write, EligibilityEndpointConfig.BATCH_CHUNK_SIZE)
+    if error is not None:
+        return json_response({"error": error}, status=400)
+    await response.write_eof()
+    return response
+
+
+# Request counts and pool state of the HTTP clients shared by the agent tools, see common/http_client.py; protected by
+# the batch endpoint key
+async def http_metrics(req: Request) -> Response:
+    if not HttpClientConfig.METRICS_ENABLED or not EligibilityEndpointConfig.BATCH_KEY:
+        return Response(status=404)
+    if not _authorized(req):
+        return Response(status=401)
+    return json_response(connection_metrics())
+
+
+# Create the chat history container (and its client) once, off the event loop, rather than on every turn, see
+# common/session_history.py
+async def start_session_history(app: web.Application):
+    await asyncio.get_running_loop().run_in_executor(None, session_history.prepare_cosmos)
+
+
+# Load the local fieldMapping code index (when enabled) before the first tool call needs it, see common/code_index.py
+async def start_code_index(app: web.Application):
+    code_index.start()
+
+
 APP = web.Application(middlewares=[aiohttp_error_middleware])
 APP.router.add_post("/api/messages", messages)
+APP.router.add_post("/api/eligibility/batch", eligibility_batch)
+APP.router.add_get("/api/http/metrics", http_metrics)
+APP.on_cleanup.append(close_async_client)
+APP.on_startup.append(start_code_index)
+APP.on_startup.append(start_session_history)
 
 if __name__ == "__main__":
     try:
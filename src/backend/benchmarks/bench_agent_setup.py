@@ -0,0 +1,88 @@
+"""
+Micro-benchmark of the agent setup done on every chat turn by send_request_to_agent_async.
+
+Compares the original per-turn construction (model, tools, OpenAI tool schemas, agent, executor and message history
+wrapper built for every message) with the process-wide executor of get_agent_executor, where a turn only builds its
+runnable config. The model is never called, so no Azure OpenAI endpoint is needed.
+
+Usage (from src/backend): python benchmarks/bench_agent_setup.py [--turns 200]
+"""
+import argparse, os, sys, time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+# placeholders, the model client is built but never used
+os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "https://localhost")
+os.environ.setdefault("AZURE_OPENAI_API_KEY", "fake-key")
+os.environ.setdefault("AZURE_OPENAI_API_VERSION", "2024-03-01-preview")
+os.environ.setdefault("AZURE_OPENAI_MODEL_NAME", "fake-deployment")
+
+from langchain_openai import AzureChatOpenAI
+from langchain.agents import AgentExecutor, create_openai_tools_agent
+from langchain.callbacks.manager import CallbackManager
+from langchain_core.runnables import ConfigurableFieldSpec
+from langchain_core.runnables.history import RunnableWithMessageHistory
+
+import scenario_prompts as prompts
+from agents import get_agent_executor, Code2TextTool, Text2CodeTool, EligibilityTool, CodeTypeTool
+from callbacks import StdOutCallbackHandler
+from config import AzureOpenAIConfig
+from session_history import get_session_history
+
+def setup_per_turn(cb_handler, user_id, session_id):
+    # what send_request_to_agent_async used to do before invoking the executor
+    cb_manager = CallbackManager(handlers=[cb_handler])
+    llm = AzureChatOpenAI(
+        azure_endpoint=AzureOpenAIConfig.ENDPOINT,
+        deployment_name=AzureOpenAIConfig.MODEL_NAME,
+        temperature=0,
+        max_tokens=1500,
+        callback_manager=cb_manager,
+        api_version=AzureOpenAIConfig.API_VERSION,
+        streaming=True)
+
+    tools = [Code2TextTool(), Text2CodeTool(), EligibilityTool(), CodeTypeTool()]
+    agent = create_openai_tools_agent(llm, tools, prompts.CUSTOM_CHATBOT_PROMPT)
+    agent_executor = AgentExecutor(agent=agent, tools=tools)
+    executor = RunnableWithMessageHistory(
+        agent_executor,
+        get_session_history,
+        input_messages_key="question",
+        history_messages_key="history",
+        history_factory_config=[
+            ConfigurableFieldSpec(id="user_id", annotation=str, name="User ID", description="Unique identifier for the user.", default="", is_shared=True),
+            ConfigurableFieldSpec(id="session_id", annotation=str, name="Session ID", description="Unique identifier for the conversation.", default="", is_shared=True),
+        ],
+    )
+    config = {"configurable": {"session_id": session_id, "user_id": user_id}}
+    return executor, config
+
+def setup_shared(cb_handler, user_id, session_id):
+    executor = get_agent_executor()
+    config = {"callbacks": [cb_handler], "configurable": {"session_id": session_id, "user_id": user_id}}
+    return executor, config
+
+def measure(name, turns, fn):
+    latencies = []
+    for turn in range(turns):
+        start = time.perf_counter()
+        fn(StdOutCallbackHandler(), "bench-user", f"session-{turn}")
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    mean = sum(latencies) / turns
+    print(f"{name:<12} turns={turns} mean={mean * 1000:.3f}ms p50={latencies[turns // 2] * 1000:.3f}ms p99={latencies[min(turns - 1, int(turns * 0.99))] * 1000:.3f}ms")
+    return mean
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200)
+    args = parser.parse_args()
+
+    # the first turn of the shared executor pays for its construction, as the first message of a process does
+    start = time.perf_counter()
+    get_agent_executor()
+    print(f"first turn (shared executor build) {(time.perf_counter() - start) * 1000:.3f}ms")
+
+    before = measure("per-turn", args.turns, setup_per_turn)
+    after = measure("shared", args.turns, setup_shared)
+    print(f"{'':<12} speedup={before / after:.0f}x")
@@ -0,0 +1,85 @@
+"""
+Micro-benchmark of rule evaluation strategies on the sample expression of experiments/ExpToRules01/app.py.
+
+Compares a naive recursive walk of the parsed tree, the iterative walk of the optimized tree used by
+EligibilityEvaluator, and the functions generated by RuleCompiler (default ordering and ordering from observed
+code frequencies).
+
+The parsed and optimized trees are read from sample_rules.json, the [dbo].[Rules] rows the parser writes for the
+expression (roots "parsed" and "optimized"), with rules_from_table as the backend does.
+
+Usage (from src/backend): python benchmarks/bench_compiler.py [--customers 10000] [--rounds 5]
+"""
+import argparse, json, os, random, re, sys, time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+from rule_tree import rules_from_table
+from eligibility import _walk
+from compiler import CodeStatistics, RuleCompiler
+
+SAMPLE_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample_rules.json")
+
+EXPRESSION = "(((97126 AND 97350 AND (97838 OR 80118 OR 97418 OR 97422 OR 97430 OR 97564 OR 97640 OR 97632 OR 97536)) OR (((97028 OR 97029 OR 97170 OR 97172) AND (NOT 97180)) AND (97546 OR 97610 OR 97644 OR 97814 OR 97444 OR 97550 OR 97386)) OR ((97344 OR 97346) AND (97418 OR 97422 OR 97430 OR 97632 OR 97546 OR 97564))) AND (NOT 82118) AND (NOT 103086))"
+
+def naive_walk(node, codes):
+    if node.__is_operator__(node.value):
+        results = [naive_walk(child, codes) for child in node.children()]
+        return all(results) if node.value.upper() == "AND" else any(results)
+    if node.value.upper().startswith("NOT "):
+        return node.value[4:].strip() not in codes
+    return node.value.strip() in codes
+
+def generate_customers(count, seed=0):
+    # skewed code popularity: a few codes are common, most are rare
+    random.seed(seed)
+    codes = sorted(set(re.findall(r"[0-9]+", EXPRESSION)))
+    popularity = { code: random.random() ** 3 for code in codes }
+    noise = [str(100000 + i) for i in range(200)]
+    return [{ code for code in codes if random.random() < popularity[code] } | set(random.sample(noise, 20)) for _ in range(count)]
+
+def measure(name, rounds, customers, fn):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for codes in customers:
+            fn(codes)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    print(f"{name:<20} customers={len(customers)} best={best * 1000:.2f}ms per_eval={best / len(customers) * 1e6:.3f}us")
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--customers", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    customers = generate_customers(args.customers)
+    with open(SAMPLE_RULES_PATH) as file:
+        roots = rules_from_table(json.load(file))
+    tree = roots["parsed"]
+    optimized = roots["optimized"]
+
+    statistics = CodeStatistics()
+    for codes in customers:
+        statistics.observe(codes)
+
+    compiled = RuleCompiler().compile(optimized)
+    profiled = RuleCompiler(statistics).compile(optimized)
+    expected = [naive_walk(tree, codes) for codes in customers]
+    for function in (compiled, profiled, lambda codes: _walk(optimized, codes, {})):
+        assert [function(codes) for codes in customers] == expected
+    print(f"eligible customers: {sum(expected)} of {len(customers)}")
+
+    baseline = measure("naive walk", args.rounds, customers, lambda codes: naive_walk(tree, codes))
+    for name, fn in (
+        ("iterative walk", lambda codes: _walk(optimized, codes, {})),
+        ("compiled", compiled),
+        ("compiled+profile", profiled)
+    ):
+        best = measure(name, args.rounds, customers, fn)
+        print(f"{'':<20} speedup={baseline / best:.1f}x")
+
+if __name__ == "__main__":
+    main()
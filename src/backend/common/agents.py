@@ -1,92 +1,136 @@
-import json, requests
+import json
 
 from typing import List, Optional, Type
-import asyncio
-import requests
+import asyncio, threading
 
 from langchain_openai import AzureChatOpenAI
 from langchain.agents import AgentExecutor, create_openai_tools_agent
 from langchain_core.runnables import ConfigurableFieldSpec
 from langchain.agents import AgentExecutor
 from langchain.callbacks.base import BaseCallbackHandler
-from langchain.callbacks.manager import CallbackManager
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain.tools import BaseTool
 from langchain.pydantic_v1 import BaseModel, Field
-from langchain.callbacks.manager import CallbackManagerForToolRun
+from langchain.callbacks.manager import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
 
 from opentelemetry.instrumentation.langchain import LangchainInstrumentor
 from promptflow.tracing import trace, start_trace
 
 import scenario_prompts as prompts
 from session_history import get_session_history
+import local_eligibility, code_index
+from http_client import get_async_client, get_client
 from config import AzureOpenAIConfig, AzureSearchConfig, EligibilityEndpointConfig
 
+_agent_executor = None
+_agent_executor_lock = threading.Lock()
+
+def get_agent_executor() -> RunnableWithMessageHistory:
+    """
+    Build the agent once per process: the model, the tools (and their OpenAI schemas, bound to the model by
+    create_openai_tools_agent), the prompt and the executor are the same for every turn. The callback handler and the
+    session of a turn are passed in the runnable config of each invocation instead.
+    """
+    global _agent_executor
+    if _agent_executor is not None:
+        return _agent_executor
+
+    with _agent_executor_lock:
+        if _agent_executor is None:
+            # Set LLM 
+            llm = AzureChatOpenAI(
+                azure_endpoint=AzureOpenAIConfig.ENDPOINT,
+                deployment_name=AzureOpenAIConfig.MODEL_NAME, 
+                temperature=0, 
+                max_tokens=1500, 
+                api_version=AzureOpenAIConfig.API_VERSION, 
+                streaming=True)
+
+            # Initialize our Tools/Experts
+            tools = [
+                Code2TextTool(), # Core Tool
+                Text2CodeTool(), # Core Tool
+                EligibilityTool(), # Core Tool
+                CodeTypeTool()
+            ]
+
+            agent = create_openai_tools_agent(llm, tools, prompts.CUSTOM_CHATBOT_PROMPT)
+            agent_executor = AgentExecutor(agent=agent, tools=tools)
+            _agent_executor = RunnableWithMessageHistory(
+                agent_executor,
+                get_session_history,
+                input_messages_key="question",
+                history_messages_key="history",
+                history_factory_config=[
+                    ConfigurableFieldSpec(
+                        id="user_id",
+                        annotation=str,
+                        name="User ID",
+                        description="Unique identifier for the user.",
+                        default="",
+                        is_shared=True,
+                    ),
+                    ConfigurableFieldSpec(
+                        id="session_id",
+                        annotation=str,
+                        name="Session ID",
+                        description="Unique identifier for the conversation.",
+                        default="",
+                        is_shared=True,
+                    ),
+                ],
+            )
+    return _agent_executor
+
 @trace
 async def send_request_to_agent_async(question: str, user_id: str, session_id: str, cb_handler: BaseCallbackHandler):
-    cb_manager = CallbackManager(handlers=[cb_handler])
-
-    # Set LLM 
-    llm = AzureChatOpenAI(
-        azure_endpoint=AzureOpenAIConfig.ENDPOINT,
-        deployment_name=AzureOpenAIConfig.MODEL_NAME, 
-        temperature=0, 
-        max_tokens=1500, 
-        callback_manager=cb_manager,
-        api_version=AzureOpenAIConfig.API_VERSION, 
-        streaming=True)
-
-    # Initialize our Tools/Experts
-
-    code_2_text_tool = Code2TextTool(run_manager=cb_manager) 
-    text_2_code_tool = Text2CodeTool(run_manager=cb_manager) 
-    eligibility_tool = EligibilityTool(run_manager=cb_manager)
-    code_type_tool = CodeTypeTool(run_manager=cb_manager)
-    
-    tools = [
-        code_2_text_tool, # Core Tool
-        text_2_code_tool, # Core Tool
-        eligibility_tool, # Core Tool
-        code_type_tool
-    ]
-
-    agent = create_openai_tools_agent(llm, tools, prompts.CUSTOM_CHATBOT_PROMPT)
-    agent_executor = AgentExecutor(agent=agent, tools=tools)
-    brain_agent_executor = RunnableWithMessageHistory(
-        agent_executor,
-        get_session_history,
-        input_messages_key="question",
-        history_messages_key="history",
-        history_factory_config=[
-            ConfigurableFieldSpec(
-                id="user_id",
-                annotation=str,
-                name="User ID",
-                description="Unique identifier for the user.",
-                default="",
-                is_shared=True,
-            ),
-            ConfigurableFieldSpec(
-                id="session_id",
-                annotation=str,
-                name="Session ID",
-                description="Unique identifier for the conversation.",
-                default="",
-                is_shared=True,
-            ),
-        ],
-    )
-
-    config={"configurable": {"session_id": session_id, "user_id": user_id}}
+    brain_agent_executor = get_agent_executor()
 
+    # the callbacks of the config are inherited by the executor, the model (streamed tokens) and the tools; the bot
+    # handler ignores the executor's chain and agent events (see BotServiceCallbackHandler)
+    config={"callbacks": [cb_handler], "configurable": {"session_id": session_id, "user_id": user_id}}
 
-    answer = brain_agent_executor.invoke({"question": question}, config=config)["output"]
+    answer = (await brain_agent_executor.ainvoke({"question": question}, config=config))["output"]
     return answer
 
 #####################################################################################################
 ############################### AGENTS AND TOOL CLASSES #############################################
 #####################################################################################################
     
+# built once, every search request sends the same headers and parameters
+SEARCH_HEADERS = {'Content-Type': 'application/json','api-key': AzureSearchConfig.SEARCH_KEY}
+SEARCH_PARAMS = {'api-version': AzureSearchConfig.API_VERSION}
+ELIGIBILITY_HEADERS = {"x-functions-key": EligibilityEndpointConfig.FUNCTION_KEY}
+
+def _search_url(index: str) -> str:
+    return f"{AzureSearchConfig.ENDPOINT}/indexes/{index}/docs/search"
+
+def _search(index: str, search_payload: dict) -> list:
+    response = get_client().post(_search_url(index),
+        content=json.dumps(search_payload),
+        headers=SEARCH_HEADERS,
+        params=SEARCH_PARAMS
+    )
+    return response.json()['value']
+
+async def _asearch(index: str, search_payload: dict) -> list:
+    response = await get_async_client().post(_search_url(index),
+        content=json.dumps(search_payload),
+        headers=SEARCH_HEADERS,
+        params=SEARCH_PARAMS
+    )
+    return response.json()['value']
+
+def _local_lookup(code: str) -> List[dict]:
+    # exact or partial code lookup in the local fieldMapping index; empty when it is disabled, not loaded or has no match
+    index = code_index.get_index()
+    return index.lookup(code) if index is not None else []
+
+def _local_text_search(question: str) -> List[dict]:
+    # exact description or ranked search in the local fieldMapping text index; empty when it is disabled, not loaded or has no match
+    index = code_index.get_text_index()
+    return index.lookup(question) if index is not None else []
+
 class EligibilityToolInput(BaseModel):
     codes: list[str] = Field(description="A list of numeric customer attribute codes to check the offer eligibility for")
 
@@ -98,8 +142,23 @@ class EligibilityTool(BaseTool):
     
     @trace
     def _run(self, codes: list[str], run_manager: Optional[CallbackManagerForToolRun] = None) -> dict:
-        eligibility = requests.post(url=EligibilityEndpointConfig.ENDPOINT, 
-                      headers={"x-functions-key": EligibilityEndpointConfig.FUNCTION_KEY}, 
+        if EligibilityEndpointConfig.MODE == "local":
+            return local_eligibility.evaluate(codes)
+
+        eligibility = get_client().post(url=EligibilityEndpointConfig.ENDPOINT, 
+                      headers=ELIGIBILITY_HEADERS, 
+                      json=codes)
+        eligibility.raise_for_status()
+        return eligibility.json()
+
+    @trace
+    async def _arun(self, codes: list[str], run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> dict:
+        if EligibilityEndpointConfig.MODE == "local":
+            # may refresh the rules from the database, kept off the event loop
+            return await asyncio.get_running_loop().run_in_executor(None, local_eligibility.evaluate, codes)
+
+        eligibility = await get_async_client().post(url=EligibilityEndpointConfig.ENDPOINT, 
+                      headers=ELIGIBILITY_HEADERS, 
                       json=codes)
         eligibility.raise_for_status()
         return eligibility.json()
@@ -115,11 +174,28 @@ class Text2CodeTool(BaseTool):
  
     @trace
     def _run(self, question:str, run_manager:Optional[CallbackManagerForToolRun]=None) -> List[dict]:
-       
-        headers = {'Content-Type': 'application/json','api-key': AzureSearchConfig.SEARCH_KEY}
-        params = {'api-version': AzureSearchConfig.API_VERSION}
+        result = _local_text_search(question)
+        if result:
+            return result
+        try:
+            return self._result(question, _search("ixcombofieldprodmap", self._payload(question)))
+        except Exception:
+            # log this
+            return []
 
-        search_payload = {
+    @trace
+    async def _arun(self, question:str, run_manager:Optional[AsyncCallbackManagerForToolRun]=None) -> List[dict]:
+        result = _local_text_search(question)
+        if result:
+            return result
+        try:
+            return self._result(question, await _asearch("ixcombofieldprodmap", self._payload(question)))
+        except Exception:
+            # log this
+            return []
+
+    def _payload(self, question:str) -> dict:
+        return {
             "search": question,
             "searchFields": "Short_Descr, Long_Descr",
             "select": "code, mapping_id, Short_Descr, Long_Descr",
@@ -128,43 +204,22 @@ class Text2CodeTool(BaseTool):
             "top": 10   
         }
 
-        search_url = f"{AzureSearchConfig.ENDPOINT}/indexes/ixcombofieldprodmap/docs/search"       
+    def _result(self, question:str, values:list) -> List[dict]:
         result = []
-
-        try:
-            response = requests.post(search_url,
-                data=json.dumps(search_payload),
-                headers=headers,
-                params=params
-            )
-
-            response_obj = response.json()
-            values = response_obj['value']
-            if values:
-                
-                temp = []
-                for value in values:
-                    if value["Short_Descr"].lower() == question.lower() or value["Long_Descr"].lower() == question.lower():
-                        temp = [{
-                            "code": value["code"],
-                            "type": value["mapping_id"],
-                            "short_descr": value["Short_Descr"],
-                            "long_descr": value["Long_Descr"]
-                        }]
-                        break
-                    else:
-                        temp.append({
-                            "code": value["code"],
-                            "type": value["mapping_id"],
-                            "short_descr": value["Short_Descr"],
-                            "long_descr": value["Long_Descr"]
-                        })
-                result = temp
-
-        except Exception:
-            # log this
-            pass
-
+        for value in values:
+            if value["Short_Descr"].lower() == question.lower() or value["Long_Descr"].lower() == question.lower():
+                return [{
+                    "code": value["code"],
+                    "type": value["mapping_id"],
+                    "short_descr": value["Short_Descr"],
+                    "long_descr": value["Long_Descr"]
+                }]
+            result.append({
+                "code": value["code"],
+                "type": value["mapping_id"],
+                "short_descr": value["Short_Descr"],
+                "long_descr": value["Long_Descr"]
+            })
         return result
 
 class Code2TextTool(BaseTool):
@@ -174,10 +229,27 @@ class Code2TextTool(BaseTool):
     return_direct:bool = False    
     
     def _run(self, question:str, run_manager:Optional[CallbackManagerForToolRun]=None) -> List[dict]:
-        headers = {'Content-Type': 'application/json','api-key': AzureSearchConfig.SEARCH_KEY}
-        params = {'api-version': AzureSearchConfig.API_VERSION}
-                
-        search_payload = {
+        result = _local_lookup(question)
+        if result:
+            return result
+        try:
+            return self._result(question, _search("ixcombofieldprodmap", self._payload(question)))
+        except Exception:
+            # log this 
+            return []
+
+    async def _arun(self, question:str, run_manager:Optional[AsyncCallbackManagerForToolRun]=None) -> List[dict]:
+        result = _local_lookup(question)
+        if result:
+            return result
+        try:
+            return self._result(question, await _asearch("ixcombofieldprodmap", self._payload(question)))
+        except Exception:
+            # log this 
+            return []
+
+    def _payload(self, question:str) -> dict:
+        return {
             "search": question,
             "searchFields": "code",
             "select": "code, mapping_id, Short_Descr, Long_Descr",
@@ -186,43 +258,22 @@ class Code2TextTool(BaseTool):
             "top": 5   
         }
 
-        search_url = f"{AzureSearchConfig.ENDPOINT}/indexes/ixcombofieldprodmap/docs/search" 
-
+    def _result(self, question:str, values:list) -> List[dict]:
         result = []
-        try:
-            response = requests.post(search_url,
-                data=json.dumps(search_payload),
-                headers=headers,
-                params=params
-            )
-
-            response_obj = response.json()
-            values = response_obj['value']
-            if values:                       
-                temp = []
-                for value in values:
-                    if value["code"] == question:
-                        temp = [{
-                            "code": value["code"],
-                            "type": value["mapping_id"],
-                            "short_descr": value['Short_Descr'],
-                            "long_descr": value['Long_Descr']
-                        }]
-                        break
-                    else:
-                        temp.append({
-                            "code": value["code"],
-                            "type": value["mapping_id"],
-                            "short_descr": value['Short_Descr'],
-                            "long_descr": value['Long_Descr']
-                        })
-                               
-                result = temp
-
-        except Exception:
-            # log this 
-            pass
-
+        for value in values:
+            if value["code"] == question:
+                return [{
+                    "code": value["code"],
+                    "type": value["mapping_id"],
+                    "short_descr": value['Short_Descr'],
+                    "long_descr": value['Long_Descr']
+                }]
+            result.append({
+                "code": value["code"],
+                "type": value["mapping_id"],
+                "short_descr": value['Short_Descr'],
+                "long_descr": value['Long_Descr']
+            })
         return result
 
 class CodeTypeTool(BaseTool):
@@ -233,10 +284,28 @@ class CodeTypeTool(BaseTool):
  
     @trace
     def _run(self, question:str, run_manager:Optional[CallbackManagerForToolRun]=None) -> List[str]:
-        headers = {'Content-Type': 'application/json','api-key': AzureSearchConfig.SEARCH_KEY}
-        params = {'api-version': AzureSearchConfig.API_VERSION}
-                
-        search_payload = {
+        result = _local_lookup(question)
+        if result:
+            return [entry["type"] for entry in result]
+        try:
+            return self._result(_search("ixcombofieldprodmap", self._payload(question)))
+        except Exception:
+            # log this 
+            return "Not found"
+
+    @trace
+    async def _arun(self, question:str, run_manager:Optional[AsyncCallbackManagerForToolRun]=None) -> List[str]:
+        result = _local_lookup(question)
+        if result:
+            return [entry["type"] for entry in result]
+        try:
+            return self._result(await _asearch("ixcombofieldprodmap", self._payload(question)))
+        except Exception:
+            # log this 
+            return "Not found"
+
+    def _payload(self, question:str) -> dict:
+        return {
             "search": question,
             "searchFields": "code",
             "select": "mapping_id",
@@ -245,31 +314,8 @@ class CodeTypeTool(BaseTool):
             "top": 5   
         }
 
-        search_url = f"{AzureSearchConfig.ENDPOINT}/indexes/ixcombofieldprodmap/docs/search" 
-
-        result = "Not found"
-        try:
-            response = requests.post(search_url,
-                data=json.dumps(search_payload),
-                headers=headers,
-                params=params
-            )
-
-            response_obj = response.json()
-            values = response_obj['value']
-            if values:
-                
-                temp = []
-                for value in values:
-                    temp.append(value["mapping_id"])                    
-                         
-                result = temp
-
-        except Exception:
-            # log this 
-            pass
-
-        return result
+    def _result(self, values:list) -> List[str]:
+        return [value["mapping_id"] for value in values] if values else "Not found"
 
 class SearchToolInput(BaseModel):
     expressions: List[str] = Field(description="The expressions to search for")
@@ -281,10 +327,21 @@ class GetProductByExpresionSearchTool(BaseTool):
     return_direct:bool = False
     
     def _run(self, expressions: List[str], run_manager:Optional[CallbackManagerForToolRun]=None) -> List[dict]:
-        headers = {'Content-Type': 'application/json','api-key': AzureSearchConfig.SEARCH_KEY}
-        params = {'api-version': AzureSearchConfig.API_VERSION}
-                
-        search_payload = {
+        try:
+            return self._result(_search("ixenhancedproductmapping", self._payload(expressions)))
+        except Exception:
+            # log this 
+            return "Not found"
+
+    async def _arun(self, expressions: List[str], run_manager:Optional[AsyncCallbackManagerForToolRun]=None) -> List[dict]:
+        try:
+            return self._result(await _asearch("ixenhancedproductmapping", self._payload(expressions)))
+        except Exception:
+            # log this 
+            return "Not found"
+
+    def _payload(self, expressions: List[str]) -> dict:
+        return {
             "search": str(expressions),
             "searchFields": "expanded_value",
             "select": "id, name",
@@ -293,33 +350,8 @@ class GetProductByExpresionSearchTool(BaseTool):
             "top": 5   
         }
 
-        search_url = f"{AzureSearchConfig.ENDPOINT}/indexes/ixenhancedproductmapping/docs/search" 
-
-        result = "Not found"
-        try:
-            response = requests.post(search_url,
-                data=json.dumps(search_payload),
-                headers=headers,
-                params=params
-            )
-
-            response_obj = response.json()
-            values = response_obj['value']
-            if values:
-                
-                temp = []
-                for value in values:
-                    temp.append({
-                        "code": value["id"],
-                        "name": value["name"]
-                    })                                    
-                result = temp
-
-        except Exception:
-            # log this 
-            pass
-
-        return result
+    def _result(self, values:list) -> List[dict]:
+        return [{ "code": value["id"], "name": value["name"] } for value in values] if values else "Not found"
             
 ### Testing ###
 if (__name__ == "__main__"):
@@ -4,7 +4,6 @@ from langchain.callbacks.base import BaseCallbackHandler
 from langchain.schema import AgentAction, AgentFinish, LLMResult
 
 from botbuilder.core import TurnContext
-from botbuilder.schema import Activity, ActivityTypes
 
 # Callback handler to use in notebooks, uses stdout
 class StdOutCallbackHandler(BaseCallbackHandler):
@@ -37,12 +36,18 @@ class BotServiceCallbackHandler(BaseCallbackHandler):
     def __init__(self, turn_context: TurnContext) -> None:
         self.tc = turn_context
 
+    # the handler is passed in the config of the whole agent run (see send_request_to_agent_async), so it would also
+    # receive the executor's chain and agent events: only the model and tool events are sent to the client
+    @property
+    def ignore_chain(self) -> bool:
+        return True
+
+    @property
+    def ignore_agent(self) -> bool:
+        return True
+
     async def on_llm_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> Any:
         await self.tc.send_activity(f"LLM Error: {error}\n")
 
     async def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> Any:
         await self.tc.send_activity(f"Tool: {serialized['name']}")
-
-    async def on_agent_action(self, action: AgentAction, **kwargs: Any) -> Any:
-        await self.tc.send_activity(f"\u2611{action.log} ...")
-        await self.tc.send_activity(Activity(type=ActivityTypes.typing))
@@ -0,0 +1,160 @@
+import bisect, json, logging, os, threading, time
+import pyodbc
+
+from config import CodeIndexConfig
+from text_index import TextIndex
+
+GET_FIELD_MAPPING_VERSION_COMMAND_TEXT = "SELECT [Version] FROM [dbo].[fieldMappingVersion] WHERE [Id] = 1"
+GET_FIELD_MAPPING_COMMAND_TEXT = "SELECT [Code], [Mapping_ID], [Short_Descr], [Long_Descr] FROM [dbo].[fieldMapping]"
+
+class CodeIndex:
+    """
+    In-memory copy of the fieldMapping table for the code lookups of Code2TextTool and CodeTypeTool.
+    Entries have the format of the tools' results ("code", "type", "short_descr" and "long_descr" keys).
+    """
+
+    def __init__(self, rows, version=None):
+        """
+        Parameters:
+        rows: fieldMapping rows, with "Code", "Mapping_ID", "Short_Descr" and "Long_Descr" keys
+        version: the version of the rows (fieldMapping version or snapshot file modification time)
+        """
+        self.version = version
+        self._entries = {}
+        for row in rows:
+            code = str(row["Code"]).strip()
+            self._entries.setdefault(code, {
+                "code": code,
+                "type": row["Mapping_ID"],
+                "short_descr": row["Short_Descr"],
+                "long_descr": row["Long_Descr"]
+            })
+        self._codes = sorted(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def entries(self):
+        """
+        The entries by code, not to be modified
+        """
+        return self._entries
+
+    def get(self, code):
+        """
+        The entry of a code, or None
+        """
+        entry = self._entries.get(code.strip())
+        return dict(entry) if entry is not None else None
+
+    def prefix(self, prefix, limit=5):
+        """
+        The entries of the codes starting with a partial code, in code order
+        """
+        prefix = prefix.strip()
+        if not prefix:
+            return []
+        start = bisect.bisect_left(self._codes, prefix)
+        entries = []
+        for code in self._codes[start:start + limit]:
+            if not code.startswith(prefix):
+                break
+            entries.append(dict(self._entries[code]))
+        return entries
+
+    def lookup(self, code, limit=5):
+        """
+        The entry of a code if it exists (as a single item list), the entries of the codes it is a prefix of otherwise
+        """
+        entry = self.get(code)
+        return [entry] if entry is not None else self.prefix(code, limit)
+
+def _load_from_database(version):
+    connection = pyodbc.connect(CodeIndexConfig.CONNECTION_STRING)
+    try:
+        cursor = connection.cursor()
+        current = cursor.execute(GET_FIELD_MAPPING_VERSION_COMMAND_TEXT).fetchval()
+        if version is not None and current == version:
+            return None
+        rows = [{ "Code": code, "Mapping_ID": mapping_id, "Short_Descr": short_descr, "Long_Descr": long_descr } for code, mapping_id, short_descr, long_descr in cursor.execute(GET_FIELD_MAPPING_COMMAND_TEXT)]
+        cursor.close()
+        return CodeIndex(rows, current)
+    finally:
+        connection.close()
+
+def _load_from_snapshot(version):
+    current = os.stat(CodeIndexConfig.SNAPSHOT_PATH).st_mtime_ns
+    if version is not None and current == version:
+        return None
+    with open(CodeIndexConfig.SNAPSHOT_PATH, encoding="utf-8") as file:
+        return CodeIndex(json.load(file), current)
+
+_lock = threading.Lock()
+_index = None
+_text_index = None
+_thread = None
+
+def refresh():
+    """
+    Reload the index if the fieldMapping version (or the snapshot file) changed.
+    The text index is built on the first load; afterwards a copy of it gets the entries that changed, and the new
+    index and text index replace the current ones together, so queries never see a partially updated text index.
+
+    Returns:
+    True if the index was reloaded
+    """
+    global _index, _text_index
+    version = _index.version if _index is not None else None
+    index = _load_from_database(version) if CodeIndexConfig.CONNECTION_STRING else _load_from_snapshot(version)
+    if index is None:
+        return False
+
+    if _text_index is None:
+        text_index = TextIndex(index.entries().values())
+    else:
+        text_index = _text_index.copy()
+        previous = _index.entries()
+        current = index.entries()
+        for code in previous.keys() - current.keys():
+            text_index.remove(code)
+        for code, entry in current.items():
+            if previous.get(code) != entry:
+                text_index.update(entry)
+    with _lock:
+        _index, _text_index = index, text_index
+    logging.info(f"code_index: loaded {len(index)} codes, version {index.version}")
+    return True
+
+def _refresh_loop():
+    while True:
+        try:
+            refresh()
+        except Exception:
+            logging.exception("code_index: refresh failed, the previous index (if any) is kept")
+        time.sleep(CodeIndexConfig.REFRESH_SECONDS)
+
+def start():
+    """
+    Start loading and periodically refreshing the index in a background thread, when CODE_INDEX_MODE is "local"
+    """
+    global _thread
+    if CodeIndexConfig.MODE != "local" or _thread is not None:
+        return
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_refresh_loop, name="code-index-refresh", daemon=True)
+            _thread.start()
+
+def get_index():
+    """
+    The current index, or None when it is disabled or not loaded yet; callers then fall back to Azure AI Search
+    """
+    start()
+    return _index
+
+def get_text_index():
+    """
+    The text index of the current entries (see TextIndex), or None when it is disabled or not loaded yet
+    """
+    start()
+    return _text_index
@@ -0,0 +1,194 @@
+import hashlib, json, logging, os, threading
+from collections import Counter
+
+from eligibility import leaf, _walk
+
+class CodeStatistics:
+    """
+    Observed presence frequency of customer codes, used to order the operands of compiled rules
+    """
+
+    def __init__(self, frequencies=None, default=0.5):
+        """
+        Parameters:
+        frequencies: known presence probabilities by code, e.g. from a previous run (see to_dict)
+        default: the probability assumed for codes never observed
+        """
+        self.counts = Counter()
+        self.customers = 0
+        self.known = dict(frequencies or {})
+        self.default = default
+
+    def observe(self, codes):
+        self.counts.update(set(map(str, codes)))
+        self.customers += 1
+
+    def to_dict(self):
+        return { code: count / self.customers for code, count in self.counts.items() } if self.customers else dict(self.known)
+
+    def digest(self):
+        """
+        Hash of the probabilities (rounded), compiled rules are only reused for the same ordering
+        """
+        rounded = sorted((code, round(probability, 2)) for code, probability in self.to_dict().items())
+        return hashlib.sha1(json.dumps([self.default] + rounded).encode("utf-8")).hexdigest()[:16]
+
+def load_profile(path):
+    """
+    The code frequencies saved by save_profile, or None when the file does not exist or cannot be read
+    """
+    try:
+        with open(path, encoding="utf-8") as file:
+            frequencies = json.load(file)
+        return { str(code): float(probability) for code, probability in frequencies.items() }
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, AttributeError) as error:
+        logging.warning(f"Ignoring the code frequency profile {path}: {error}")
+        return None
+
+def save_profile(path, frequencies):
+    """
+    Save code frequencies as JSON (data only, nothing in the file is executed when it is loaded)
+    """
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(frequencies, file)
+    os.replace(temporary, path)
+
+class RuleCompiler:
+    """
+    Compiles rule trees to specialized Python functions of the customer's code set.
+    Leaves become direct set membership tests and AND/OR become Python's short-circuiting and/or; the operands of
+    every group are ordered so the cheapest and most decisive operand runs first (for an AND the most likely false,
+    for an OR the most likely true, per leaf tested) based on the code frequencies of the current profile.
+    The profile is a snapshot of the observed frequencies (see observe), taken again every reprofile_every observed
+    customers and saved to profile_path, so a new worker starts with the last ordering.
+    Functions are cached in memory by the hash of their source, rules with the same structure share their function.
+    """
+
+    def __init__(self, statistics=None, reprofile_every=None, profile_path=None):
+        """
+        Parameters:
+        statistics: the observed code frequencies (see CodeStatistics); by default the ones saved to profile_path
+        reprofile_every: the number of observed customers between two profiles, None to keep the initial one
+        profile_path: the JSON file the profile is saved to (see save_profile), None to keep it in memory only
+        """
+        if statistics is None:
+            statistics = CodeStatistics(load_profile(profile_path) if profile_path else None)
+        self.statistics = statistics
+        self.reprofile_every = reprofile_every
+        self.profile_path = profile_path
+        self.generation = 0 # incremented when the profile changes, callers caching compiled functions drop them
+        self._profile = self.statistics.digest()
+        self._probabilities = self.statistics.to_dict()
+        self._observed = 0
+        self._functions = {}
+        self._lock = threading.Lock()
+
+    def observe(self, code_sets):
+        """
+        Count the codes of evaluated customers, and reprofile every reprofile_every customers
+        """
+        with self._lock:
+            for codes in code_sets:
+                self.statistics.observe(codes)
+            self._observed += len(code_sets)
+            due = self.reprofile_every is not None and self._observed >= self.reprofile_every
+            if due:
+                self._observed = 0
+        if due:
+            self.reprofile()
+
+    def reprofile(self):
+        """
+        Order the next compilations after the current statistics; when the (rounded) frequencies changed, previously
+        compiled functions are dropped and the profile is saved
+
+        Returns:
+        True if the profile changed
+        """
+        with self._lock:
+            profile = self.statistics.digest()
+            if profile == self._profile:
+                return False
+            self._profile = profile
+            self._probabilities = self.statistics.to_dict()
+            self._functions = {}
+            self.generation += 1
+            probabilities = self._probabilities
+
+        if self.profile_path:
+            try:
+                save_profile(self.profile_path, probabilities)
+            except OSError as error:
+                logging.warning(f"Could not save the code frequency profile {self.profile_path}: {error}")
+        return True
+
+    def compile(self, rule):
+        """
+        Return the compiled function of a rule: f(codes) -> bool, where codes is a set of strings
+        """
+        # the source depends on the structure and on the ordering, rules with the same source share their function
+        source = self.source(rule)
+        key = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        function = self._functions.get(key)
+        if function is None:
+            try:
+                code = compile(source, f"<rule {key}>", "eval")
+            except (SyntaxError, RecursionError, MemoryError):
+                # too deeply nested for the Python parser, fall back to the tree walk
+                code = None
+            function = eval(code, {}) if code is not None else (lambda codes: _walk(rule, codes, {}))
+            with self._lock:
+                self._functions[key] = function
+        return function
+
+    def source(self, rule):
+        """
+        The Python source of the lambda compiled for a rule
+        """
+        return "lambda codes: " + self._expression(rule)
+
+    def _expression(self, rule):
+        # iterative post-order, every node gets its source, probability of being true and cost (leaves tested)
+        compiled = {}
+        stack = [(rule, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in compiled:
+                continue
+            children = node.children() if node.__is_operator__(node.value) else []
+            if not children:
+                code, negated = leaf(node)
+                if code is None:
+                    compiled[id(node)] = ("True", 1.0, 0) if negated else ("False", 0.0, 0)
+                else:
+                    probability = self._probabilities.get(code, self.statistics.default)
+                    if negated:
+                        compiled[id(node)] = (f"({code!r} not in codes)", 1.0 - probability, 1)
+                    else:
+                        compiled[id(node)] = (f"({code!r} in codes)", probability, 1)
+            elif expanded:
+                operands = [compiled[id(child)] for child in children]
+                if node.value.upper() == "AND":
+                    # most likely false first, per leaf tested
+                    operands.sort(key=lambda operand: operand[2] / max(1.0 - operand[1], 1e-9))
+                    probability = 1.0
+                    for operand in operands:
+                        probability *= operand[1]
+                    joiner = " and "
+                else:
+                    # most likely true first, per leaf tested
+                    operands.sort(key=lambda operand: operand[2] / max(operand[1], 1e-9))
+                    probability = 1.0
+                    for operand in operands:
+                        probability *= 1.0 - operand[1]
+                    probability = 1.0 - probability
+                    joiner = " or "
+                source = "(" + joiner.join(operand[0] for operand in operands) + ")"
+                compiled[id(node)] = (source, probability, sum(operand[2] for operand in operands))
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in children)
+        return compiled[id(rule)][0]
@@ -42,3 +42,34 @@ class EligibilityEndpointConfig:
 
     ENDPOINT = os.environ.get("ELIGIBILITY_ENDPOINT", "")
     FUNCTION_KEY = os.environ.get("ELIGIBILITY_FUNCTION_KEY", "")
+    MODE = os.environ.get("ELIGIBILITY_MODE", "remote") # "local" evaluates the rules in process, see local_eligibility.py
+    BATCH_KEY = os.environ.get("ELIGIBILITY_BATCH_KEY", "") # the /api/eligibility/batch endpoint is disabled when empty
+    BATCH_CHUNK_SIZE = int(os.environ.get("ELIGIBILITY_BATCH_CHUNK_SIZE", "1024"))
+
+class RulesDataConfig:
+    """ Rules Database Configuration """
+
+    CONNECTION_STRING = os.environ.get("RULES_DATA_ODBC_CONNECTION_STRING", "")
+    REFRESH_SECONDS = float(os.environ.get("RULES_REFRESH_SECONDS", "5"))
+    COMPILED = os.environ.get("RULES_COMPILED", "false").lower() == "true" # compile the rules evaluated one by one (see compiler.py)
+    REPROFILE_CUSTOMERS = int(os.environ.get("RULES_REPROFILE_CUSTOMERS", "10000")) # evaluated customers between two code frequency profiles
+    PROFILE_PATH = os.environ.get("RULES_PROFILE_PATH", "") # JSON file the code frequency profile is saved to and loaded from, none when empty
+
+class HttpClientConfig:
+    """ Shared HTTP Connection Pool Configuration (Azure AI Search and eligibility requests) """
+
+    MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+    MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+    CONNECT_TIMEOUT_SECONDS = float(os.environ.get("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+    TIMEOUT_SECONDS = float(os.environ.get("HTTP_TIMEOUT_SECONDS", "30"))
+    HTTP2 = os.environ.get("HTTP_HTTP2", "auto") # "auto" enables HTTP/2 when the h2 package is installed
+    METRICS_ENABLED = os.environ.get("HTTP_METRICS_ENABLED", "false").lower() == "true" # GET /api/http/metrics, with the ELIGIBILITY_BATCH_KEY
+
+class CodeIndexConfig:
+    """ Local fieldMapping Code Index Configuration """
+
+    MODE = os.environ.get("CODE_INDEX_MODE", "remote") # "local" answers Code2Text/CodeType lookups in process, see code_index.py
+    CONNECTION_STRING = os.environ.get("REFERENCE_DATA_ODBC_CONNECTION_STRING", "")
+    SNAPSHOT_PATH = os.environ.get("CODE_INDEX_SNAPSHOT_PATH", "") # a JSON list of fieldMapping rows, used when there is no connection string
+    REFRESH_SECONDS = float(os.environ.get("CODE_INDEX_REFRESH_SECONDS", "300"))
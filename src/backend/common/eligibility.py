@@ -0,0 +1,332 @@
+import threading
+from collections import Counter, defaultdict
+import numpy as np
+
+class EligibilityEvaluator:
+    """
+    In-process equivalent of the GetEligibility function.
+    Every customer code referenced by the rules is interned to a column index and the whole catalog is compiled into
+    a single program over a boolean node vector: leaves are gathered from the customer's code membership row, then
+    each tree level is reduced with np.logical_and/np.logical_or.reduceat. A set of input codes is evaluated against
+    every product in one vectorized pass, level by level.
+    A RequiredCodeIndex prunes the products whose required codes the customer does not have; when few products are
+    left, they are evaluated one by one (walking their trees, or with the functions of a RuleCompiler) instead of
+    running the whole program.
+    """
+
+    def __init__(self, rules, prune_ratio=0.05, compiler=None):
+        """
+        Parameters:
+        rules: a dictionary of root rules by name (see rules_from_table); shared subtrees are compiled once
+        prune_ratio: the largest share of candidate products evaluated one by one rather than with the compiled program
+        compiler: a RuleCompiler (see compiler.py) for the products evaluated one by one, None to walk their trees
+        """
+        self.rules = dict(rules)
+        self.index = RequiredCodeIndex(self.rules)
+        self.prune_ratio = prune_ratio
+        self.compiler = compiler
+        self._functions = {}
+        self._generation = compiler.generation if compiler is not None else 0
+        self.codes = {}
+        self.rule_names = []
+        self._compiled = False
+        self._pending = set()
+        self._lock = threading.RLock()
+
+    def update(self, name, rule):
+        """
+        Replace the rule of a product, or remove the product when rule is None; only that product is recompiled, on the
+        next use of the program (see compile)
+        """
+        with self._lock:
+            if rule is None:
+                if name not in self.rules:
+                    return
+                self.rules.pop(name)
+            else:
+                self.rules[name] = rule
+            self.index.update(name, rule)
+            self._functions.pop(name, None)
+            self._pending.add(name)
+
+    def compile(self):
+        """
+        Compile the program now rather than on its next use: the whole catalog the first time, then only the products
+        updated since. Updated products get new nodes and their previous nodes are left unused, until unused nodes
+        outnumber the used ones and the whole catalog is compiled again.
+        """
+        with self._lock:
+            if not self._compiled or self._unused > self._node_count - self._unused:
+                self._reset()
+                self._append(self.rules)
+                self._compiled = True
+            elif self._pending:
+                updated = self._pending & set(self._positions)
+                if updated:
+                    keep = [position for position, name in enumerate(self.rule_names) if name not in updated]
+                    self._unused += sum(self._sizes.pop(name) for name in updated)
+                    self.rule_names = [self.rule_names[position] for position in keep]
+                    self._roots = self._roots[keep]
+                self._append({ name: self.rules[name] for name in self._pending if name in self.rules })
+            self._pending = set()
+
+    def _reset(self):
+        # column 0 of the membership matrix is always false, for constants and unknown leaves; codes start at column 1
+        self.codes = {}
+        self.rule_names = []
+        self._roots = np.zeros(0, dtype=np.int64)
+        self._positions = {}
+        self._sizes = {}
+        self._unused = 0
+        self._node_count = 0
+        self._leaf_nodes = np.zeros(0, dtype=np.int64)
+        self._leaf_codes = np.zeros(0, dtype=np.int64)
+        self._leaf_negated = np.zeros(0, dtype=bool)
+        self._groups = {} # (height, operator) -> (nodes, children, offsets, reduce)
+        self._levels = []
+
+    def _append(self, rules):
+        # number the nodes of the new trees after the existing ones, then merge their operators into the groups of the
+        # existing program, one group per height and operator
+        order = []
+        heights = {}
+        sizes = {}
+        for name, root in rules.items():
+            size = 0
+            stack = [(root, False)]
+            while stack:
+                node, expanded = stack.pop()
+                if id(node) in heights:
+                    continue
+                children = node.children() if node.__is_operator__(node.value) else []
+                if expanded:
+                    heights[id(node)] = 1 + max((heights[id(child)] for child in children), default=-1) if children else 0
+                    order.append(node)
+                    size += 1
+                else:
+                    stack.append((node, True))
+                    stack.extend((child, False) for child in children if id(child) not in heights)
+            sizes[name] = size
+
+        leaves = [node for node in order if heights[id(node)] == 0]
+        operators = [node for node in order if heights[id(node)] > 0]
+
+        index = {}
+        leaf_codes = []
+        leaf_negated = []
+        for node in leaves:
+            index[id(node)] = self._node_count + len(index)
+            code, negated = leaf(node)
+            leaf_codes.append(self._intern(code) if code is not None else 0)
+            leaf_negated.append(negated)
+        for node in operators:
+            index[id(node)] = self._node_count + len(index)
+
+        self._leaf_nodes = np.concatenate([self._leaf_nodes, np.array([index[id(node)] for node in leaves], dtype=np.int64)])
+        self._leaf_codes = np.concatenate([self._leaf_codes, np.array(leaf_codes, dtype=np.int64)])
+        self._leaf_negated = np.concatenate([self._leaf_negated, np.array(leaf_negated, dtype=bool)])
+        self._node_count += len(index)
+
+        grouped = defaultdict(list)
+        for node in operators:
+            grouped[(heights[id(node)], node.value.upper())].append(node)
+        for key, group in grouped.items():
+            children = [[index[id(child)] for child in node.children()] for node in group]
+            nodes = np.array([index[id(node)] for node in group], dtype=np.int64)
+            flat = np.array([child for child_indexes in children for child in child_indexes], dtype=np.int64)
+            offsets = np.cumsum([0] + [len(child_indexes) for child_indexes in children[:-1]]).astype(np.int64)
+            if key in self._groups:
+                previous_nodes, previous_children, previous_offsets, reduce = self._groups[key]
+                self._groups[key] = (
+                    np.concatenate([previous_nodes, nodes]),
+                    np.concatenate([previous_children, flat]),
+                    np.concatenate([previous_offsets, offsets + len(previous_children)]),
+                    reduce
+                )
+            else:
+                self._groups[key] = (nodes, flat, offsets, np.logical_and if key[1] == "AND" else np.logical_or)
+        self._levels = [self._groups[key] for key in sorted(self._groups)]
+
+        self.rule_names = self.rule_names + list(rules.keys())
+        self._roots = np.concatenate([self._roots, np.array([index[id(root)] for root in rules.values()], dtype=np.int64)])
+        self._positions = { name: position for position, name in enumerate(self.rule_names) }
+        self._sizes.update(sizes)
+
+    def _intern(self, code):
+        return self.codes.setdefault(code, len(self.codes) + 1)
+
+    def membership(self, code_sets):
+        """
+        Build the customers x codes membership matrix; codes that no rule references are ignored
+        """
+        matrix = np.zeros((len(code_sets), len(self.codes) + 1), dtype=bool)
+        for row, codes in enumerate(code_sets):
+            columns = [self.codes[code] for code in map(str, codes) if code in self.codes]
+            matrix[row, columns] = True
+        return matrix
+
+    def evaluate_matrix(self, membership):
+        """
+        Evaluate every root rule for every row of a membership matrix
+
+        Returns:
+        A customers x rules boolean matrix, columns in rule_names order
+        """
+        values = np.empty((membership.shape[0], self._node_count), dtype=bool)
+        values[:, self._leaf_nodes] = membership[:, self._leaf_codes] ^ self._leaf_negated
+        for nodes, children, offsets, reduce in self._levels:
+            values[:, nodes] = reduce.reduceat(values[:, children], offsets, axis=1)
+        return values[:, self._roots]
+
+    def evaluate(self, codes):
+        """
+        Evaluate every root rule for a single customer
+
+        Parameters:
+        codes: the customer's codes
+
+        Returns:
+        A dictionary of eligibility by rule name, as returned by the GetEligibility function
+        """
+        codes = set(map(str, codes))
+        with self._lock:
+            candidates = self.index.candidates(codes)
+            if len(candidates) <= self.prune_ratio * len(self.rules):
+                if self.compiler is not None:
+                    eligible = { name for name in candidates if self._function(name)(codes) }
+                else:
+                    values = {}
+                    eligible = { name for name in candidates if _walk(self.rules[name], codes, values) }
+                return { name: name in eligible for name in self.rules }
+
+            self.compile()
+            results = self.evaluate_matrix(self.membership([codes]))[0]
+            return { name: bool(result) for name, result in zip(self.rule_names, results) }
+
+    def _function(self, name):
+        if self._generation != self.compiler.generation:
+            # the compiler was reprofiled, its functions follow the new ordering
+            self._functions = {}
+            self._generation = self.compiler.generation
+        function = self._functions.get(name)
+        if function is None:
+            function = self._functions[name] = self.compiler.compile(self.rules[name])
+        return function
+
+    def evaluate_many(self, code_sets):
+        """
+        Evaluate every root rule for several customers in one vectorized pass
+
+        Returns:
+        A tuple with the rule names and the customers x rules boolean matrix, columns in the order of the names
+        """
+        with self._lock:
+            self.compile()
+            return self.rule_names, self.evaluate_matrix(self.membership(code_sets))
+
+class RequiredCodeIndex:
+    """
+    Inverted index from customer code to the products that require it.
+    The required codes of a rule are the positive leaves it cannot be true without: all the required codes of the
+    operands of an AND, and the codes required by every operand of an OR. A product is a candidate for a customer only
+    if the customer has all its required codes, so finding the candidates only touches the postings of the customer's
+    codes. Products without required codes are always candidates.
+    """
+
+    def __init__(self, rules=None):
+        self.required = {}
+        self.postings = defaultdict(set)
+        self.unconditional = set()
+        for name, rule in (rules or {}).items():
+            self.update(name, rule)
+
+    def update(self, name, rule):
+        """
+        Index (or re-index) the rule of a product, or remove the product when rule is None
+        """
+        for code in self.required.pop(name, ()):
+            self.postings[code].discard(name)
+            if not self.postings[code]:
+                del self.postings[code]
+        self.unconditional.discard(name)
+
+        if rule is None:
+            return
+
+        required = required_codes(rule)
+        self.required[name] = required
+        for code in required:
+            self.postings[code].add(name)
+        if not required:
+            self.unconditional.add(name)
+
+    def candidates(self, codes):
+        """
+        The products whose required codes are all among the customer's codes
+        """
+        counts = Counter()
+        for code in set(map(str, codes)):
+            counts.update(self.postings.get(code, ()))
+        return self.unconditional.union(name for name, count in counts.items() if count == len(self.required[name]))
+
+def leaf(node):
+    """
+    The code tested by a leaf (None for constants) and whether the test is negated.
+    Operators without operands are constants: an empty AND is true, an empty OR is false.
+    """
+    if node.__is_operator__(node.value):
+        return None, node.value.upper() == "AND"
+    if node.value and node.value.upper().startswith("NOT "):
+        return node.value[4:].strip(), True
+    return (node.value.strip() if node.value else None), False
+
+def required_codes(rule):
+    """
+    The codes a customer must have for the rule to be true (see RequiredCodeIndex)
+    """
+    required = {}
+    stack = [(rule, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in required:
+            continue
+        children = node.children() if node.__is_operator__(node.value) else []
+        if not children:
+            code, negated = leaf(node)
+            required[id(node)] = frozenset([code]) if code is not None and not negated else frozenset()
+        elif expanded:
+            operands = [required[id(child)] for child in children]
+            if node.value.upper() == "AND":
+                required[id(node)] = frozenset().union(*operands)
+            else:
+                required[id(node)] = frozenset.intersection(*operands)
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in children)
+    return required[id(rule)]
+
+def _walk(rule, codes, values):
+    # iterative tree walk, values caches the results of shared subtrees by node id
+    stack = [(rule, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in values:
+            continue
+        children = node.children() if node.__is_operator__(node.value) else []
+        if not children:
+            code, negated = leaf(node)
+            values[id(node)] = (code in codes) != negated
+        elif expanded:
+            results = [values[id(child)] for child in children]
+            values[id(node)] = all(results) if node.value.upper() == "AND" else any(results)
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in children)
+    return values[id(rule)]
+
+def pack_rows(matrix):
+    """
+    Encode each row of a boolean eligibility matrix as a string of "0"/"1", one character per rule
+    """
+    characters = np.where(matrix, ord("1"), ord("0")).astype(np.uint8)
+    return [row.tobytes().decode("ascii") for row in characters]
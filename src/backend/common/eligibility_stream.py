@@ -0,0 +1,57 @@
+import json
+
+def parse_customer(line):
+    """
+    Parse a customer line of the batch endpoint: {"id": ..., "codes": [...]}
+
+    Raises:
+    ValueError: when the line is not such an object
+    """
+    customer = json.loads(line)
+    if not isinstance(customer, dict) or not isinstance(customer.get("codes"), list) or "id" not in customer:
+        raise ValueError('expected {"id": ..., "codes": [...]}')
+    return customer["id"], customer["codes"]
+
+async def stream_customers(lines, write_chunk, write, chunk_size):
+    """
+    Read the NDJSON customer lines of a batch request and write their results a chunk of customers at a time.
+    An invalid line ends the batch: the customers read before it still get their results, then an {"error": ...} line
+    is written, unless no result was written yet (the request can then still be rejected as a whole).
+
+    Parameters:
+    lines: an async iterable of the request body lines
+    write_chunk: a coroutine writing the results of (ids, code_sets); its first call sends the response status
+    write: a coroutine writing encoded bytes to the response
+    chunk_size: the number of customers evaluated together
+
+    Returns:
+    The error message of an invalid line found before any result was written, None otherwise
+    """
+    written = False
+    ids, code_sets = [], []
+    count = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        count += 1
+        try:
+            id, codes = parse_customer(line)
+        except ValueError as error:
+            message = f"invalid customer line {count}: {error}"
+            if not written:
+                return message
+            if ids:
+                await write_chunk(ids, code_sets)
+            await write((json.dumps({"error": message}) + "\n").encode("utf-8"))
+            return None
+        ids.append(id)
+        code_sets.append(codes)
+
+        if len(ids) == chunk_size:
+            await write_chunk(ids, code_sets)
+            written = True
+            ids, code_sets = [], []
+
+    if ids or not written:
+        await write_chunk(ids, code_sets)
+    return None
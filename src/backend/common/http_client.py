@@ -0,0 +1,126 @@
+import asyncio, importlib.util, threading
+import httpx
+
+from config import HttpClientConfig
+
+_lock = threading.Lock()
+_client = None
+_async_clients = {}
+_metrics = {
+    "requests": 0,
+    "responses": 0,
+    "connections_opened": 0, # new TCP connections; under HTTP/2 one connection serves concurrent requests
+    "tls_handshakes": 0,
+    "http_versions": {}
+}
+
+def _count(name, amount=1):
+    with _lock:
+        _metrics[name] += amount
+
+def _trace(event_name, info):
+    if event_name == "connection.connect_tcp.complete":
+        _count("connections_opened")
+    elif event_name == "connection.start_tls.complete":
+        _count("tls_handshakes")
+
+async def _atrace(event_name, info):
+    _trace(event_name, info)
+
+def _on_response(response):
+    with _lock:
+        _metrics["responses"] += 1
+        _metrics["http_versions"][response.http_version] = _metrics["http_versions"].get(response.http_version, 0) + 1
+
+async def _aon_response(response):
+    _on_response(response)
+
+def _on_request(request):
+    _count("requests")
+    request.extensions["trace"] = _trace
+
+async def _aon_request(request):
+    _count("requests")
+    request.extensions["trace"] = _atrace
+
+def _http2():
+    if HttpClientConfig.HTTP2 == "auto":
+        return importlib.util.find_spec("h2") is not None
+    return HttpClientConfig.HTTP2.lower() == "true"
+
+def _options():
+    return {
+        "http2": _http2(),
+        "limits": httpx.Limits(
+            max_connections=HttpClientConfig.MAX_CONNECTIONS,
+            max_keepalive_connections=HttpClientConfig.MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HttpClientConfig.KEEPALIVE_EXPIRY_SECONDS
+        ),
+        "timeout": httpx.Timeout(HttpClientConfig.TIMEOUT_SECONDS, connect=HttpClientConfig.CONNECT_TIMEOUT_SECONDS)
+    }
+
+def get_client() -> httpx.Client:
+    """
+    The keep-alive Client shared by the tools' synchronous requests, so Azure AI Search and the eligibility function
+    are not sent a new TCP and TLS handshake for every call
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = httpx.Client(**_options(), event_hooks={"request": [_on_request], "response": [_on_response]})
+    return _client
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    The AsyncClient shared by the tools' requests, one per event loop since its connections belong to the loop that
+    opened them (the aiohttp app has a single loop, the agents.py test loop runs a new one per question)
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        for closed_loop in [other for other in _async_clients if other.is_closed()]:
+            del _async_clients[closed_loop]
+        client = _async_clients[loop] = httpx.AsyncClient(**_options(), event_hooks={"request": [_aon_request], "response": [_aon_response]})
+    return client
+
+def _pool_state(client):
+    # the connections of the client's httpcore pool (httpx keeps its transport private, hence the getattr)
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return { "open": len(connections), "idle": idle, "in_use": len(connections) - idle }
+
+def connection_metrics() -> dict:
+    """
+    The request, response, new connection and TLS handshake counts of the shared clients since the process started,
+    the number of responses by HTTP version, and the current state of the connection pools (open connections, idle
+    or serving requests) of the synchronous client and of the async clients. Requests without a response failed
+    (timeout, connection error) or are in flight.
+    """
+    with _lock:
+        metrics = dict(_metrics)
+        metrics["http_versions"] = dict(_metrics["http_versions"])
+        client = _client
+    metrics["without_response"] = metrics["requests"] - metrics["responses"]
+    metrics["http2"] = _http2()
+
+    pools = [_pool_state(async_client) for async_client in list(_async_clients.values()) if not async_client.is_closed]
+    metrics["pool"] = {
+        "sync": _pool_state(client) if client is not None else { "open": 0, "idle": 0, "in_use": 0 },
+        "async": { key: sum(pool[key] for pool in pools) for key in ("open", "idle", "in_use") }
+    }
+    return metrics
+
+async def close_async_client(*args):
+    """
+    Close the clients, e.g. as an aiohttp on_cleanup handler
+    """
+    global _client
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+    with _lock:
+        if _client is not None:
+            _client.close()
+        _client = None
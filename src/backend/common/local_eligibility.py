@@ -0,0 +1,67 @@
+import contextlib, json, threading
+import pyodbc
+
+from compiler import RuleCompiler
+from config import RulesDataConfig
+from eligibility import pack_rows
+from rule_cache import RuleGraphCache
+
+_lock = threading.Lock()
+_cache = None
+
+@contextlib.contextmanager
+def _connect():
+    connection = pyodbc.connect(RulesDataConfig.CONNECTION_STRING)
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+def get_cache():
+    """
+    The process-wide rule graph cache, loaded on its first evaluation and refreshed from the rules' change tracking
+    """
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                compiler = None
+                if RulesDataConfig.COMPILED:
+                    compiler = RuleCompiler(reprofile_every=RulesDataConfig.REPROFILE_CUSTOMERS, profile_path=RulesDataConfig.PROFILE_PATH or None)
+                _cache = RuleGraphCache(_connect, refresh_interval=RulesDataConfig.REFRESH_SECONDS, compiler=compiler)
+    return _cache
+
+def reset():
+    """
+    Drop the cached rules, they are reloaded on the next evaluation
+    """
+    global _cache
+    with _lock:
+        _cache = None
+
+def _observe(cache, code_sets):
+    # the evaluated customers' codes order the compiled rules (see RuleCompiler.observe)
+    if cache.compiler is not None:
+        cache.compiler.observe(code_sets)
+
+def evaluate(codes):
+    """
+    Local equivalent of the GetEligibility function: the eligibility of the customer codes by product rule name
+    """
+    cache = get_cache()
+    _, eligibility = cache.evaluate(codes)
+    _observe(cache, [codes])
+    return eligibility
+
+def evaluate_lines(cache, ids, code_sets):
+    """
+    Evaluate a chunk of customers and format the NDJSON lines of the batch endpoint: {"id": ..., "eligibility": "0110..."},
+    one character per rule in the order of the returned rule names
+
+    Returns:
+    A tuple with the rules version, the rule names and the encoded lines
+    """
+    version, names, matrix = cache.evaluate_many(code_sets)
+    _observe(cache, code_sets)
+    lines = "".join(json.dumps({ "id": id, "eligibility": row }) + "\n" for id, row in zip(ids, pack_rows(matrix)))
+    return version, names, lines.encode("utf-8")
@@ -0,0 +1,228 @@
+import logging, json, threading, time
+from collections import defaultdict
+
+from rule_tree import rules_from_table
+from eligibility import EligibilityEvaluator
+
+# see src/data/rulesengine/rulesChangeTracking.sql
+RULES_COLUMNS = ["RuleName", "Operator", "Enabled", "Expression", "RuleNameFK", "Properties"]
+GET_RULES_VERSION_COMMAND_TEXT = "SELECT CHANGE_TRACKING_CURRENT_VERSION(), CHANGE_TRACKING_MIN_VALID_VERSION(OBJECT_ID('dbo.Rules'))"
+LOAD_RULES_COMMAND_TEXT = "SELECT [RuleName], [Operator], [Enabled], [Expression], [RuleNameFK], [Properties] FROM [dbo].[Rules] WHERE [WorkflowName] LIKE ?"
+LOAD_RULES_CHANGES_COMMAND_TEXT = "SELECT ct.[RuleName], r.[Operator], r.[Enabled], r.[Expression], r.[RuleNameFK], r.[Properties], r.[WorkflowName] FROM CHANGETABLE(CHANGES [dbo].[Rules], ?) AS ct LEFT JOIN [dbo].[Rules] r ON r.[RuleName] = ct.[RuleName]"
+
+class RuleGraphCache:
+    """
+    In-process copy of the [dbo].[Rules] graph of a workflow, kept current with SQL change tracking.
+    The table is loaded once; each refresh only reads the rows changed since the last synchronized change tracking
+    version and rebuilds the root rules whose tree (or a shared subtree they reference) contains one of them.
+    The synchronized version tells callers which rule snapshot answered them.
+    """
+
+    def __init__(self, connect, workflow_name="Eligibility", refresh_interval=5.0, prune_ratio=0.05, compiler=None):
+        """
+        Parameters:
+        connect: a callable returning a context manager that yields a pyodbc connection to the rules database
+        workflow_name: the workflow whose rules are cached
+        refresh_interval: the minimum number of seconds between two change tracking queries (see maybe_refresh)
+        compiler: a RuleCompiler shared by the successive evaluators (see EligibilityEvaluator)
+        """
+        self._connect = connect
+        self.workflow_name = workflow_name
+        self.refresh_interval = refresh_interval
+        self.prune_ratio = prune_ratio
+        self.compiler = compiler
+        self.version = None
+        self.evaluator = None
+        self.rows = {}
+        self.children = defaultdict(set)
+        self.references = defaultdict(set)
+        self._refreshed_at = 0.0
+        self._lock = threading.RLock() # the evaluator and version snapshot
+        self._refresh_lock = threading.RLock() # one load or refresh at a time
+
+    def load(self):
+        """
+        Load the whole workflow and rebuild every root rule; evaluations keep using the previous snapshot until the
+        new one is compiled
+        """
+        with self._refresh_lock:
+            self._load()
+
+    def _load(self):
+        with self._connect() as connection:
+            cursor = connection.cursor()
+            # the version is read first: changes committed during the load are read again by the next refresh
+            version = cursor.execute(GET_RULES_VERSION_COMMAND_TEXT).fetchone()[0]
+            rows = [dict(zip(RULES_COLUMNS, row)) for row in cursor.execute(LOAD_RULES_COMMAND_TEXT, self.workflow_name)]
+            cursor.close()
+
+        self.rows = {}
+        self.children = defaultdict(set)
+        self.references = defaultdict(set)
+        for row in rows:
+            self._add(row)
+
+        evaluator = EligibilityEvaluator(rules_from_table(rows), prune_ratio=self.prune_ratio, compiler=self.compiler)
+        evaluator.compile()
+        with self._lock:
+            self.evaluator = evaluator
+            self.version = version
+        self._refreshed_at = time.monotonic()
+        logging.info(f"Loaded {len(rows)} rules of the {self.workflow_name} workflow at version {version}")
+
+    def refresh(self):
+        """
+        Apply the changes made since the synchronized version; the whole workflow is reloaded when the cache was never
+        loaded or when change tracking no longer has the changes since that version.
+        The changes are read and the affected trees rebuilt without blocking evaluations, only the swap of the rebuilt
+        roots into the evaluator (see EligibilityEvaluator.compile) holds the snapshot lock.
+
+        Returns:
+        The names of the root rules that were rebuilt
+        """
+        with self._refresh_lock:
+            if self.version is None:
+                self._load()
+                return set(self.evaluator.rules)
+
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                version, min_valid_version = cursor.execute(GET_RULES_VERSION_COMMAND_TEXT).fetchone()
+                if min_valid_version is None or min_valid_version > self.version:
+                    cursor.close()
+                    logging.warning(f"Rule changes since version {self.version} are no longer tracked, reloading")
+                    self._load()
+                    return set(self.evaluator.rules)
+
+                changes = cursor.execute(LOAD_RULES_CHANGES_COMMAND_TEXT, self.version).fetchall()
+                cursor.close()
+
+            self._refreshed_at = time.monotonic()
+            if not changes:
+                with self._lock:
+                    self.version = version
+                return set()
+
+            # the rows, children and references are only used by the thread holding the refresh lock
+            names = [str(change[0]) for change in changes]
+            affected = self._roots_of(names)
+            for change in changes:
+                name = str(change[0])
+                self._remove(name)
+                # deleted rows (no current row) and rows moved to another workflow are dropped
+                if change[6] == self.workflow_name:
+                    self._add(dict(zip(RULES_COLUMNS, (name,) + tuple(change[1:6]))))
+            affected |= self._roots_of(names)
+            affected = { name for name in affected if name in self.evaluator.rules or self._is_root(name) }
+            rules = { root: rules_from_table(self._tree_rows(root))[root] if self._is_root(root) else None for root in affected }
+
+            with self._lock:
+                for root, rule in rules.items():
+                    self.evaluator.update(root, rule)
+                self.evaluator.compile()
+                self.version = version
+            logging.info(f"Rebuilt {len(affected)} root rules for {len(changes)} changed rows, now at version {version}")
+            return affected
+
+    def maybe_refresh(self):
+        """
+        Refresh the cache if the last refresh is older than the refresh interval. Only the first load waits for a
+        refresh running in another thread, later evaluations use the current snapshot meanwhile.
+        """
+        if self.version is None or time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            if self._refresh_lock.acquire(blocking=self.version is None):
+                try:
+                    if self.version is None or time.monotonic() - self._refreshed_at >= self.refresh_interval:
+                        self.refresh()
+                finally:
+                    self._refresh_lock.release()
+
+    def evaluate(self, codes):
+        """
+        Evaluate the customer codes against every root rule of the cached snapshot
+
+        Returns:
+        A tuple with the synchronized version and the eligibility by rule name (see EligibilityEvaluator.evaluate)
+        """
+        self.maybe_refresh()
+        with self._lock:
+            return self.version, self.evaluator.evaluate(codes)
+
+    def evaluate_many(self, code_sets):
+        """
+        Evaluate several customers against the cached snapshot
+
+        Returns:
+        A tuple with the synchronized version, the rule names and the eligibility matrix (see EligibilityEvaluator.evaluate_many)
+        """
+        self.maybe_refresh()
+        with self._lock:
+            return (self.version,) + self.evaluator.evaluate_many(code_sets)
+
+    def _add(self, row):
+        row["RuleName"] = str(row["RuleName"])
+        row["RuleNameFK"] = str(row["RuleNameFK"]) if row["RuleNameFK"] is not None else None
+        row["Reference"] = _properties(row).get("Ref")
+        self.rows[row["RuleName"]] = row
+        if row["RuleNameFK"] is not None:
+            self.children[row["RuleNameFK"]].add(row["RuleName"])
+        if row["Reference"] is not None:
+            self.references[row["Reference"]].add(row["RuleName"])
+
+    def _remove(self, name):
+        row = self.rows.pop(name, None)
+        if row is None:
+            return
+        if row["RuleNameFK"] is not None:
+            self.children[row["RuleNameFK"]].discard(name)
+        if row["Reference"] is not None:
+            self.references[row["Reference"]].discard(name)
+
+    def _is_root(self, name):
+        row = self.rows.get(name)
+        return row is not None and row["RuleNameFK"] is None and not _properties(row).get("Shared")
+
+    def _roots_of(self, names):
+        """
+        The root rules whose tree contains one of the rules, through parents and references to shared subtrees
+        """
+        roots = set()
+        seen = set()
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            row = self.rows.get(name)
+            if row is None:
+                roots.add(name) # a deleted root, or a row whose parent is unknown
+            elif row["RuleNameFK"] is not None:
+                stack.append(row["RuleNameFK"])
+            elif _properties(row).get("Shared"):
+                stack.extend(self.references[name])
+            else:
+                roots.add(name)
+        return roots
+
+    def _tree_rows(self, root):
+        """
+        The rows of a root rule's tree and of the shared subtrees it references
+        """
+        rows = []
+        seen = set()
+        stack = [root]
+        while stack:
+            name = stack.pop()
+            row = self.rows.get(name)
+            if name in seen or row is None:
+                continue
+            seen.add(name)
+            rows.append(row)
+            stack.extend(self.children[name])
+            if row["Reference"] is not None:
+                stack.append(row["Reference"])
+        return rows
+
+def _properties(row):
+    return json.loads(row["Properties"]) if row.get("Properties") else {}
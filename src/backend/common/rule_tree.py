@@ -0,0 +1,64 @@
+import json, re
+
+EXPRESSION_PATTERN = re.compile(r'^(!?)input1\.Contains\("(.*)"\)$')
+
+class RuleNode:
+    """
+    A node of a rule tree read from the [dbo].[Rules] table: an AND/OR operator and its operands, or a leaf testing a
+    customer code ("NOT <code>" when negated).
+    The rows are written by the parser (Rule.get_table in src/parser/utils/rule.py); this is the read side the backend
+    needs to evaluate them (see eligibility.py), with the same node interface as Rule.
+    """
+    __slots__ = ("name", "value", "enabled", "rules")
+
+    def __init__(self, name=None, value=None, enabled=True, rules=None):
+        self.name = name
+        self.value = value
+        self.enabled = enabled
+        self.rules = rules
+
+    def __is_operator__(self, val):
+        return bool(val) and val.upper() in ["AND", "OR"]
+
+    def children(self):
+        return self.rules if self.rules is not None else []
+
+def rules_from_table(table):
+    """
+    Rebuild the rule trees from rows of the rules engine Rules table.
+    References to shared subtrees ({"Ref": "shared-<hash>"} in the Properties column) are resolved to a single
+    RuleNode instance, shared by every parent.
+
+    Returns:
+    A dictionary of the root rules by name
+    """
+    nodes = {}
+    references = {}
+    shared = set()
+    for row in table:
+        name = str(row["RuleName"])
+        value = None
+        if row["Operator"]:
+            value = row["Operator"].upper()
+        elif row["Expression"]:
+            match = EXPRESSION_PATTERN.match(row["Expression"].strip())
+            if match:
+                value = ("NOT " if match.group(1) else "") + match.group(2)
+
+        nodes[name] = RuleNode(name=name, value=value, enabled=bool(row.get("Enabled", True)), rules=[] if row["Operator"] else None)
+
+        properties = json.loads(row["Properties"]) if row.get("Properties") else {}
+        if "Ref" in properties:
+            references[name] = properties["Ref"]
+        if properties.get("Shared"):
+            shared.add(name)
+
+    roots = {}
+    for row in table:
+        name = str(row["RuleName"])
+        if row["RuleNameFK"] is None:
+            if name not in shared:
+                roots[name] = nodes[name]
+        else:
+            nodes[str(row["RuleNameFK"])].rules.append(nodes[references[name]] if name in references else nodes[name])
+    return roots
@@ -1,17 +1,68 @@
-from langchain_community.chat_message_histories import CosmosDBChatMessageHistory
+import logging, threading
+from typing import List, Sequence
+
+from azure.cosmos import CosmosClient, PartitionKey
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
 
 from config import CosmosConfig
 
-def get_session_history(session_id: str, user_id: str) -> CosmosDBChatMessageHistory:
-    cosmos = CosmosDBChatMessageHistory(
-        cosmos_endpoint=CosmosConfig.ENDPOINT,
-        cosmos_database=CosmosConfig.DATABASE,
-        cosmos_container=CosmosConfig.CONTAINER,
-        connection_string=CosmosConfig.CONNECTION_STRING,
-        session_id=session_id,
-        user_id=user_id
-    )
-
-    # prepare the cosmosdb instance
-    cosmos.prepare_cosmos()
-    return cosmos
+_container = None
+_container_lock = threading.Lock()
+
+def prepare_cosmos():
+    """
+    Create the Cosmos DB database and container if they do not exist and keep the container client for the process.
+    Called once at startup (see app.py); the sessions use the same client afterwards.
+    """
+    global _container
+    if _container is not None:
+        return _container
+
+    with _container_lock:
+        if _container is None:
+            client = CosmosClient.from_connection_string(CosmosConfig.CONNECTION_STRING)
+            database = client.create_database_if_not_exists(CosmosConfig.DATABASE)
+            # same layout as langchain's CosmosDBChatMessageHistory, which stored the sessions before
+            _container = database.create_container_if_not_exists(CosmosConfig.CONTAINER, partition_key=PartitionKey("/user_id"))
+    return _container
+
+class CosmosSessionHistory(BaseChatMessageHistory):
+    """
+    Chat history of a session, stored as one {"id": session_id, "user_id": ..., "messages": [...]} item of the Cosmos DB
+    container. Creating it does no I/O: the messages are read on first access, which RunnableWithMessageHistory does
+    off the event loop (aget_messages), and written back by add_messages (aadd_messages).
+    """
+
+    def __init__(self, session_id: str, user_id: str) -> None:
+        self.session_id = session_id
+        self.user_id = user_id
+        self._messages = None
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        if self._messages is None:
+            try:
+                item = prepare_cosmos().read_item(item=self.session_id, partition_key=self.user_id)
+                self._messages = messages_from_dict(item.get("messages", []))
+            except CosmosResourceNotFoundError:
+                # only a missing item is an empty history: other errors propagate, an empty list written back by
+                # add_messages would erase the stored one
+                logging.info(f"No stored history for session {self.session_id}")
+                self._messages = []
+        return self._messages
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.messages.extend(messages)
+        prepare_cosmos().upsert_item(body={ "id": self.session_id, "user_id": self.user_id, "messages": messages_to_dict(self.messages) })
+
+    def clear(self) -> None:
+        self._messages = []
+        try:
+            prepare_cosmos().delete_item(item=self.session_id, partition_key=self.user_id)
+        except CosmosResourceNotFoundError:
+            pass
+
+def get_session_history(session_id: str, user_id: str) -> CosmosSessionHistory:
+    return CosmosSessionHistory(session_id, user_id)
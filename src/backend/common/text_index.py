@@ -0,0 +1,176 @@
+import heapq, math, re, threading
+from collections import defaultdict
+
+# words of any script (accented, non-Latin), after casefold
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.casefold()) if text else []
+
+def trigrams(term):
+    padded = f"#{term}#"
+    return { padded[index:index + 3] for index in range(len(padded) - 2) }
+
+class TextIndex:
+    """
+    In-memory full-text index over the Short_Descr and Long_Descr of fieldMapping entries (see CodeIndex), for
+    Text2CodeTool. Exact descriptions (case and surrounding spaces ignored) are answered from a hash map. Other
+    queries are ranked with BM25 over an inverted index. A query word that is not in the index (e.g. a typo) is
+    replaced by the indexed words with the most similar trigrams. Entries can be added, updated and removed one at a
+    time.
+    """
+
+    def __init__(self, entries=(), k1=1.2, b=0.75, min_similarity=0.4, max_expansions=3):
+        """
+        Parameters:
+        entries: entries with "code", "type", "short_descr" and "long_descr" keys
+        min_similarity: the minimum trigram Jaccard similarity of a word replacing an unknown query word
+        max_expansions: the maximum number of words replacing an unknown query word
+        """
+        self.k1 = k1
+        self.b = b
+        self.min_similarity = min_similarity
+        self.max_expansions = max_expansions
+
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._exact = defaultdict(set)
+        self._postings = defaultdict(dict)
+        self._lengths = {}
+        self._total_length = 0
+        self._trigrams = defaultdict(set)
+        self._norms = None # BM25 length normalization by code, recomputed after updates
+        for entry in entries:
+            self.update(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def copy(self):
+        """
+        An independent copy of the index, to update off to the side while this one keeps answering queries
+        """
+        with self._lock:
+            other = TextIndex(k1=self.k1, b=self.b, min_similarity=self.min_similarity, max_expansions=self.max_expansions)
+            # entries are copied on update and never modified in place, they can be shared
+            other._entries = dict(self._entries)
+            other._exact = defaultdict(set, { description: set(codes) for description, codes in self._exact.items() })
+            other._postings = defaultdict(dict, { term: dict(postings) for term, postings in self._postings.items() })
+            other._lengths = dict(self._lengths)
+            other._total_length = self._total_length
+            other._trigrams = defaultdict(set, { trigram: set(terms) for trigram, terms in self._trigrams.items() })
+            return other
+
+    def _descriptions(self, entry):
+        return [description.strip().casefold() for description in (entry["short_descr"], entry["long_descr"]) if description and description.strip()]
+
+    def update(self, entry):
+        """
+        Add an entry, or replace the entry with the same code
+        """
+        with self._lock:
+            self.remove(entry["code"])
+            self._norms = None
+            code = entry["code"]
+            self._entries[code] = dict(entry)
+            for description in self._descriptions(entry):
+                self._exact[description].add(code)
+
+            terms = tokenize(entry["short_descr"]) + tokenize(entry["long_descr"])
+            for term in terms:
+                if term not in self._postings:
+                    for trigram in trigrams(term):
+                        self._trigrams[trigram].add(term)
+                self._postings[term][code] = self._postings[term].get(code, 0) + 1
+            self._lengths[code] = len(terms)
+            self._total_length += len(terms)
+
+    def remove(self, code):
+        """
+        Remove the entry of a code, if any
+        """
+        with self._lock:
+            entry = self._entries.pop(code, None)
+            if entry is None:
+                return
+            self._norms = None
+            for description in self._descriptions(entry):
+                codes = self._exact[description]
+                codes.discard(code)
+                if not codes:
+                    del self._exact[description]
+
+            for term in set(tokenize(entry["short_descr"]) + tokenize(entry["long_descr"])):
+                postings = self._postings[term]
+                del postings[code]
+                if not postings:
+                    del self._postings[term]
+                    for trigram in trigrams(term):
+                        self._trigrams[trigram].discard(term)
+                        if not self._trigrams[trigram]:
+                            del self._trigrams[trigram]
+            self._total_length -= self._lengths.pop(code)
+
+    def exact(self, text):
+        """
+        The entry whose short or long description is the text (the lowest code if there are several), or None
+        """
+        with self._lock:
+            codes = self._exact.get(text.strip().casefold())
+            return dict(self._entries[min(codes)]) if codes else None
+
+    def _similar_terms(self, term):
+        query_trigrams = trigrams(term)
+        shared = defaultdict(int)
+        for trigram in query_trigrams:
+            for candidate in self._trigrams.get(trigram, ()):
+                shared[candidate] += 1
+
+        similar = []
+        for candidate, count in shared.items():
+            similarity = count / (len(query_trigrams) + len(trigrams(candidate)) - count)
+            if similarity >= self.min_similarity:
+                similar.append((similarity, candidate))
+        similar.sort(key=lambda pair: (-pair[0], pair[1]))
+        return similar[:self.max_expansions]
+
+    def search(self, query, top=10):
+        """
+        Rank the entries matching any word of the query (as Azure AI Search's searchMode "any" does)
+
+        Returns:
+        Up to top entries, best first
+        """
+        with self._lock:
+            if not self._entries:
+                return []
+            count = len(self._entries)
+            if self._norms is None:
+                average_length = self._total_length / count or 1.0
+                self._norms = { code: self.k1 * (1 - self.b + self.b * length / average_length) for code, length in self._lengths.items() }
+            norms = self._norms
+
+            weighted_terms = defaultdict(float)
+            for term in tokenize(query):
+                if term in self._postings:
+                    weighted_terms[term] = max(weighted_terms[term], 1.0)
+                else:
+                    for similarity, similar in self._similar_terms(term):
+                        weighted_terms[similar] = max(weighted_terms[similar], similarity)
+
+            scores = defaultdict(float)
+            for term, weight in weighted_terms.items():
+                postings = self._postings[term]
+                factor = weight * math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)) * (self.k1 + 1)
+                for code, frequency in postings.items():
+                    scores[code] += factor * frequency / (frequency + norms[code])
+
+            ranked = heapq.nsmallest(top, scores.items(), key=lambda pair: (-pair[1], pair[0]))
+            return [dict(self._entries[code]) for code, _ in ranked]
+
+    def lookup(self, question, top=10):
+        """
+        The entry of an exact description (as a single item list), the best ranked entries otherwise
+        """
+        entry = self.exact(question)
+        return [entry] if entry is not None else self.search(question, top)
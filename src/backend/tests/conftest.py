@@ -0,0 +1,15 @@
+import os, random, sys
+
+import pytest
+
+# the backend modules import each other from common, as app.py does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+from rule_rows import CODES, random_tree
+
+@pytest.fixture(scope="module")
+def catalog():
+    rng = random.Random(0)
+    trees = { str(product): random_tree(rng) for product in range(1, 121) }
+    customers = [rng.sample(CODES + ["1", "2"], rng.randint(0, 12)) for _ in range(150)]
+    return trees, customers
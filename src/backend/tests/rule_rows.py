@@ -0,0 +1,69 @@
+# random rule trees, their rows in the Rules table and a reference evaluator, shared by the eligibility tests
+
+import json
+
+CODES = [str(code) for code in range(97100, 97120)]
+
+def random_tree(rng, depth=0):
+    # a leaf is a code or ("NOT", code), an operator is ("And" | "Or", operand, ...)
+    if depth > 3 or rng.random() < 0.3:
+        code = rng.choice(CODES)
+        return ("NOT", code) if rng.random() < 0.3 else code
+    return (rng.choice(["And", "Or"]),) + tuple(random_tree(rng, depth + 1) for _ in range(rng.randint(1, 4)))
+
+def to_rows(trees, shared=False):
+    """
+    Rows of the Rules table for trees by root name, as the parser writes them; with shared, every operator subtree
+    below a root is stored once as a "shared-<n>" rule and referenced with {"Ref": ...}
+    """
+    rows = []
+    shared_names = {}
+    counter = iter(range(10 ** 9))
+
+    def add(tree, name, parent, properties=None):
+        if isinstance(tree, tuple) and tree[0] != "NOT":
+            rows.append({ "RuleName": name, "Operator": tree[0], "Enabled": True, "Expression": None, "RuleNameFK": parent, "Properties": properties })
+            for child in tree[1:]:
+                child_name = f"{name}-{next(counter)}"
+                if shared and isinstance(child, tuple) and child[0] != "NOT":
+                    if child not in shared_names:
+                        shared_names[child] = f"shared-{len(shared_names)}"
+                        add(child, shared_names[child], None, json.dumps({ "Shared": True }))
+                    rows.append({ "RuleName": child_name, "Operator": None, "Enabled": True, "Expression": None, "RuleNameFK": name, "Properties": json.dumps({ "Ref": shared_names[child] }) })
+                else:
+                    add(child, child_name, name)
+        else:
+            expression = f'!input1.Contains("{tree[1]}")' if isinstance(tree, tuple) else f'input1.Contains("{tree}")'
+            rows.append({ "RuleName": name, "Operator": None, "Enabled": True, "Expression": expression, "RuleNameFK": parent, "Properties": properties })
+
+    for root, tree in trees.items():
+        add(tree, root, None)
+    return rows
+
+def get_eligibility(rows, codes):
+    """
+    Reference implementation of src/eligibility/GetEligibility.cs: roots are the rules that are neither shared nor
+    children, references are resolved to the shared rule, "And"/"Or" need all/any of their rules and the expressions
+    are input1.Contains tests
+    """
+    by_name = { row["RuleName"]: row for row in rows }
+    children = { row["RuleName"]: [] for row in rows }
+    shared = set()
+    for row in rows:
+        properties = json.loads(row["Properties"]) if row["Properties"] else {}
+        if properties.get("Shared"):
+            shared.add(row["RuleName"])
+        if row["RuleNameFK"] is not None:
+            children[row["RuleNameFK"]].append(properties.get("Ref", row["RuleName"]))
+
+    def evaluate(name):
+        row = by_name[name]
+        if row["Operator"] == "And":
+            return all(evaluate(child) for child in children[name])
+        if row["Operator"] == "Or":
+            return any(evaluate(child) for child in children[name])
+        negated = row["Expression"].startswith("!")
+        code = row["Expression"].split('"')[1]
+        return (code in codes) != negated
+
+    return { row["RuleName"]: evaluate(row["RuleName"]) for row in rows if row["RuleNameFK"] is None and row["RuleName"] not in shared }
@@ -0,0 +1,86 @@
+import json, os
+
+import pytest
+
+# code_index loads the table with pyodbc, config reads the .env file with python-dotenv
+pytest.importorskip("pyodbc")
+pytest.importorskip("dotenv")
+
+import code_index
+from code_index import CodeIndex
+from config import CodeIndexConfig
+
+def row(code, mapping_id, short, long=None):
+    return { "Code": code, "Mapping_ID": mapping_id, "Short_Descr": short, "Long_Descr": long }
+
+ROWS = [
+    row("97", "cat1", "Therapy"),
+    row("9701", "cat2", "Hot packs"),
+    row("970", "cat2", "Physical therapy"),
+    row("97010", "cat3", "Hot or cold packs therapy"),
+    row(" 98 ", "cat1", "Other"),
+    row("970", "cat3", "Duplicate"),
+]
+
+def test_get_and_first_row_wins():
+    index = CodeIndex(ROWS, version=1)
+    assert len(index) == 5
+    assert index.get(" 98") == { "code": "98", "type": "cat1", "short_descr": "Other", "long_descr": None }
+    assert index.get("970")["short_descr"] == "Physical therapy"
+    assert index.get("99") is None
+
+def test_prefix_lookup_in_code_order():
+    index = CodeIndex(ROWS)
+    assert [entry["code"] for entry in index.prefix("970")] == ["970", "9701", "97010"]
+    assert [entry["code"] for entry in index.prefix("97", limit=2)] == ["97", "970"]
+    assert index.prefix("99") == [] and index.prefix(" ") == []
+
+    # an existing code is returned alone, a partial code returns the codes it starts
+    assert [entry["code"] for entry in index.lookup("970")] == ["970"]
+    assert [entry["code"] for entry in index.lookup("9701")] == ["9701"]
+    assert [entry["code"] for entry in index.lookup("9")] == ["97", "970", "9701", "97010", "98"]
+
+def test_entries_are_copies():
+    index = CodeIndex(ROWS)
+    index.get("97")["short_descr"] = "changed"
+    index.prefix("97")[0]["short_descr"] = "changed"
+    assert index.get("97")["short_descr"] == "Therapy"
+
+@pytest.fixture
+def snapshot(tmp_path, monkeypatch):
+    path = tmp_path / "fieldMapping.json"
+    monkeypatch.setattr(CodeIndexConfig, "MODE", "remote") # no refresh thread, the test refreshes
+    monkeypatch.setattr(CodeIndexConfig, "CONNECTION_STRING", "")
+    monkeypatch.setattr(CodeIndexConfig, "SNAPSHOT_PATH", str(path))
+    monkeypatch.setattr(code_index, "_index", None)
+    monkeypatch.setattr(code_index, "_text_index", None)
+
+    def write(rows):
+        path.write_text(json.dumps(rows))
+        # a new modification time, even within the file system's time resolution
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000 * (write.count + 1)))
+        write.count += 1
+    write.count = 0
+    return write
+
+def test_refresh_swaps_a_copy_of_the_text_index(snapshot):
+    snapshot(ROWS)
+    assert code_index.refresh()
+    assert not code_index.refresh() # unchanged snapshot
+    index, text_index = code_index.get_index(), code_index.get_text_index()
+    assert [entry["code"] for entry in text_index.lookup("hot packs")][:1] == ["9701"]
+
+    snapshot([row("97", "cat1", "Therapy"), row("9701", "cat2", "Paraffin bath"), row("99", "cat1", "Massage")])
+    assert code_index.refresh()
+
+    # the previous index and text index are left as they were, for the queries still using them
+    assert index.get("98") is not None and text_index.exact("Hot packs")["code"] == "9701"
+    assert code_index.get_index().get("98") is None and code_index.get_index().version != index.version
+
+    current = code_index.get_text_index()
+    assert current is not text_index
+    assert current.exact("Hot packs") is None
+    assert current.exact("Paraffin bath")["code"] == "9701"
+    assert [entry["code"] for entry in current.lookup("massage")] == ["99"]
+    assert current.exact("Other") is None and len(current) == 3
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from compiler import CodeStatistics, RuleCompiler, load_profile
+from eligibility import EligibilityEvaluator
+from rule_tree import RuleNode, rules_from_table
+
+from rule_rows import get_eligibility, to_rows
+
+def rule():
+    return RuleNode(value="OR", rules=[RuleNode(value="1"), RuleNode(value="2")])
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_compiled_functions_match_get_eligibility(catalog, shared):
+    trees, customers = catalog
+    rows = to_rows(trees, shared)
+    evaluator = EligibilityEvaluator(rules_from_table(rows), prune_ratio=1.0, compiler=RuleCompiler())
+    assert [evaluator.evaluate(codes) for codes in customers] == [get_eligibility(rows, set(codes)) for codes in customers]
+
+def test_operands_follow_the_profile():
+    # an OR tests the most likely true operand first
+    assert RuleCompiler(CodeStatistics({ "1": 0.1, "2": 0.9 })).source(rule()) == "lambda codes: (('2' in codes) or ('1' in codes))"
+    assert RuleCompiler(CodeStatistics({ "1": 0.9, "2": 0.1 })).source(rule()) == "lambda codes: (('1' in codes) or ('2' in codes))"
+
+def test_observe_reprofiles_and_saves(tmp_path):
+    path = str(tmp_path / "profile.json")
+    compiler = RuleCompiler(CodeStatistics({ "1": 0.9, "2": 0.1 }), reprofile_every=10, profile_path=path)
+    before = compiler.source(rule())
+
+    compiler.observe([["2"]] * 9)
+    assert compiler.generation == 0 and compiler.source(rule()) == before # not due yet
+    compiler.observe([["2"]])
+    assert compiler.generation == 1
+    assert compiler.source(rule()) == "lambda codes: (('2' in codes) or ('1' in codes))"
+    assert json.load(open(path)) == { "2": 1.0 }
+
+    # a new worker starts with the saved profile
+    assert RuleCompiler(profile_path=path).source(rule()) == compiler.source(rule())
+
+def test_unchanged_profile_keeps_functions():
+    compiler = RuleCompiler(reprofile_every=2)
+    compiler.observe([["1"], ["1"]])
+    generation = compiler.generation
+    compiler.observe([["1"], ["1"]])
+    assert compiler.generation == generation
+
+def test_evaluator_drops_functions_after_reprofile():
+    compiler = RuleCompiler(reprofile_every=1)
+    evaluator = EligibilityEvaluator({ "p": rule() }, prune_ratio=1.0, compiler=compiler)
+    assert evaluator.evaluate(["1"]) == { "p": True }
+    first = evaluator._functions["p"]
+    compiler.observe([["2"]])
+    assert evaluator.evaluate(["2"]) == { "p": True }
+    assert evaluator._functions["p"] is not first
+
+def test_load_profile_ignores_missing_and_invalid_files(tmp_path):
+    assert load_profile(str(tmp_path / "missing.json")) is None
+    (tmp_path / "invalid.json").write_text("[1, 2]")
+    assert load_profile(str(tmp_path / "invalid.json")) is None
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from eligibility import EligibilityEvaluator, pack_rows
+from rule_tree import rules_from_table
+
+from rule_rows import get_eligibility, to_rows
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_evaluate_matches_get_eligibility(catalog, shared):
+    trees, customers = catalog
+    rows = to_rows(trees, shared)
+    expected = [get_eligibility(rows, set(codes)) for codes in customers]
+    # the compiled program and the pruned tree walk
+    for prune_ratio in (0.0, 1.0):
+        evaluator = EligibilityEvaluator(rules_from_table(rows), prune_ratio=prune_ratio)
+        assert [evaluator.evaluate(codes) for codes in customers] == expected
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_evaluate_many_matches_get_eligibility(catalog, shared):
+    trees, customers = catalog
+    rows = to_rows(trees, shared)
+    names, matrix = EligibilityEvaluator(rules_from_table(rows)).evaluate_many(customers)
+    for codes, row in zip(customers, matrix):
+        expected = get_eligibility(rows, set(codes))
+        assert dict(zip(names, row.tolist())) == expected
+
+def test_constants_and_unknown_codes():
+    rows = to_rows({ "1": ("And", "97100", ("NOT", "97101")), "2": ("Or", ("NOT", "99999")) })
+    evaluator = EligibilityEvaluator(rules_from_table(rows), prune_ratio=0.0)
+    assert evaluator.evaluate(["97100", "unknown"]) == { "1": True, "2": True }
+    assert evaluator.evaluate(["97100", "97101", "99999"]) == { "1": False, "2": False }
+
+def test_pack_rows():
+    assert pack_rows(np.array([[True, False, True], [False, False, False]])) == ["101", "000"]
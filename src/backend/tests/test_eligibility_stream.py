@@ -0,0 +1,54 @@
+import asyncio, json
+
+import pytest
+
+from eligibility_stream import parse_customer, stream_customers
+
+async def lines_of(*lines):
+    for line in lines:
+        yield (line + "\n").encode("utf-8")
+
+def run(lines, chunk_size):
+    chunks = []
+    written = []
+
+    async def write_chunk(ids, code_sets):
+        chunks.append(list(ids))
+
+    async def write(data):
+        written.append(json.loads(data))
+
+    error = asyncio.run(stream_customers(lines, write_chunk, write, chunk_size))
+    return error, chunks, written
+
+def customer(id):
+    return json.dumps({ "id": id, "codes": ["97100"] })
+
+def test_chunks():
+    error, chunks, written = run(lines_of(*(customer(id) for id in range(5)), ""), chunk_size=2)
+    assert error is None
+    assert chunks == [[0, 1], [2, 3], [4]]
+    assert written == []
+
+def test_empty_body_writes_the_header():
+    assert run(lines_of(), chunk_size=2) == (None, [[]], [])
+
+def test_invalid_line_in_the_first_chunk_rejects_the_request():
+    error, chunks, written = run(lines_of(customer(0), "not json", customer(1)), chunk_size=2)
+    assert error.startswith("invalid customer line 2")
+    assert chunks == [] and written == []
+
+def test_invalid_line_after_the_first_chunk_keeps_earlier_results():
+    error, chunks, written = run(lines_of(*(customer(id) for id in range(5)), '{"id": 5}', customer(6)), chunk_size=2)
+    assert error is None
+    # every valid customer before the invalid line gets a result, none after it
+    assert [id for chunk in chunks for id in chunk] == [0, 1, 2, 3, 4]
+    assert len(written) == 1 and written[0]["error"].startswith("invalid customer line 6")
+
+def test_parse_customer():
+    assert parse_customer(b'{"id": "a", "codes": ["1", "2"]}') == ("a", ["1", "2"])
+
+@pytest.mark.parametrize("line", [b'{"id": "a", "codes": "1"}', b'{"codes": []}', b'[1]', b'{"id": '])
+def test_parse_customer_rejects(line):
+    with pytest.raises(ValueError):
+        parse_customer(line)
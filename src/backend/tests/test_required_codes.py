@@ -0,0 +1,12 @@
+from eligibility import RequiredCodeIndex
+from rule_tree import rules_from_table
+
+from rule_rows import get_eligibility, to_rows
+
+def test_required_codes_prune_only_ineligible_products(catalog):
+    trees, customers = catalog
+    rows = to_rows(trees)
+    index = RequiredCodeIndex(rules_from_table(rows))
+    for codes in customers:
+        eligible = { name for name, result in get_eligibility(rows, set(codes)).items() if result }
+        assert eligible <= index.candidates(codes)
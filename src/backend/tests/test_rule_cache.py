@@ -0,0 +1,76 @@
+import contextlib, random
+
+from eligibility import EligibilityEvaluator
+from rule_cache import RuleGraphCache
+from rule_tree import rules_from_table
+
+from rule_rows import get_eligibility, random_tree, to_rows
+
+def test_update_recompiles_only_updated_roots(catalog):
+    trees, customers = catalog
+    trees = dict(trees)
+    rng = random.Random(1)
+    evaluator = EligibilityEvaluator(rules_from_table(to_rows(trees)), prune_ratio=0.0)
+    evaluator.compile()
+
+    for step in range(40):
+        name = str(rng.randint(1, 140))
+        if rng.random() < 0.2:
+            trees.pop(name, None)
+            evaluator.update(name, None)
+        else:
+            trees[name] = random_tree(rng)
+            evaluator.update(name, rules_from_table(to_rows({ name: trees[name] }))[name])
+
+        rows = to_rows(trees)
+        names, matrix = evaluator.evaluate_many(customers[:20])
+        for codes, row in zip(customers, matrix):
+            assert dict(zip(names, row.tolist())) == get_eligibility(rows, set(codes)), step
+
+class FakeConnection:
+    """
+    A pyodbc connection answering the queries of RuleGraphCache from a rows dictionary and a change list
+    """
+
+    def __init__(self, state):
+        self.state = state
+
+    def cursor(self):
+        return self
+
+    def execute(self, command_text, *params):
+        self.command_text = command_text
+        return self
+
+    def fetchone(self):
+        return (self.state["version"], self.state["min_valid_version"])
+
+    def fetchall(self):
+        return self.state["changes"]
+
+    def __iter__(self):
+        columns = ["RuleName", "Operator", "Enabled", "Expression", "RuleNameFK", "Properties"]
+        return iter([tuple(row[column] for column in columns) for row in self.state["rows"].values()])
+
+    def close(self):
+        pass
+
+def test_rule_cache_applies_changes():
+    rows = { row["RuleName"]: row for row in to_rows({ "1": ("And", "97100", "97101"), "2": "97102" }, shared=True) }
+    state = { "version": 1, "min_valid_version": 0, "rows": rows, "changes": [] }
+
+    @contextlib.contextmanager
+    def connect():
+        yield FakeConnection(state)
+
+    cache = RuleGraphCache(connect, refresh_interval=0)
+    assert cache.evaluate(["97100", "97101"]) == (1, { "1": True, "2": False })
+
+    # a new leaf under product 1, product 2 deleted
+    state["version"] = 2
+    state["changes"] = [
+        ("1-new", None, True, 'input1.Contains("97103")', "1", None, "Eligibility"),
+        ("2", None, None, None, None, None, None),
+    ]
+    assert cache.evaluate(["97100", "97101"]) == (2, { "1": False })
+    assert cache.evaluate(["97100", "97101", "97103"]) == (2, { "1": True })
@@ -0,0 +1,68 @@
+import random
+
+from text_index import TextIndex, tokenize
+
+WORDS = ["cardiac", "surgery", "dental", "implant", "vision", "therapy", "kidney", "dialysis", "émergence", "größe"]
+
+def random_entry(rng, code):
+    return {
+        "code": str(code),
+        "type": rng.choice(["Affiliate", "LOB", "CustomField"]),
+        "short_descr": " ".join(rng.sample(WORDS, rng.randint(1, 3))),
+        "long_descr": " ".join(rng.sample(WORDS, rng.randint(0, 4))) or None
+    }
+
+def state(index):
+    return (
+        index._entries,
+        { description: codes for description, codes in index._exact.items() },
+        { term: postings for term, postings in index._postings.items() },
+        index._lengths,
+        index._total_length,
+        { trigram: terms for trigram, terms in index._trigrams.items() }
+    )
+
+def test_incremental_updates_match_a_rebuild():
+    rng = random.Random(0)
+    entries = { str(code): random_entry(rng, code) for code in range(200) }
+    index = TextIndex(entries.values())
+
+    for _ in range(300):
+        code = str(rng.randint(0, 250))
+        if rng.random() < 0.3:
+            entries.pop(code, None)
+            index.remove(code)
+        else:
+            entries[code] = random_entry(rng, code)
+            index.update(entries[code])
+
+    rebuilt = TextIndex(entries.values())
+    assert state(index) == state(rebuilt)
+    for query in ["cardiac surgery", "dialisys", "implant vision therapy", "GRÖSSE"]:
+        assert index.search(query) == rebuilt.search(query)
+
+def test_copy_is_independent():
+    rng = random.Random(1)
+    index = TextIndex(random_entry(rng, code) for code in range(20))
+    before = state(index)
+    copy = index.copy()
+    copy.update({ "code": "3", "type": "LOB", "short_descr": "orthodontics", "long_descr": None })
+    copy.remove("4")
+    assert state(index) == before
+    assert [entry["code"] for entry in copy.search("orthodontics")] == ["3"]
+    assert index.search("orthodontics") == []
+
+def test_exact_and_typos():
+    index = TextIndex([
+        { "code": "1", "type": "LOB", "short_descr": "Dental Implant", "long_descr": None },
+        { "code": "2", "type": "LOB", "short_descr": "Kidney dialysis", "long_descr": "Renal dialysis" },
+    ])
+    assert index.lookup("  dental implant ") == [index.exact("Dental Implant")]
+    assert index.exact("DENTAL IMPLANT")["code"] == "1"
+    assert index.search("dialysys")[0]["code"] == "2"
+
+def test_unicode_tokens():
+    assert tokenize("Hämoglobin-Test für STRASSE") == ["hämoglobin", "test", "für", "strasse"]
+    index = TextIndex([{ "code": "1", "type": "LOB", "short_descr": "Größe", "long_descr": None }])
+    assert index.exact("GRÖSSE")["code"] == "1"
+    assert [entry["code"] for entry in index.search("größe")] == ["1"]
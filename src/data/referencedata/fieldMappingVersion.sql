@@ -0,0 +1,22 @@
+CREATE TABLE [dbo].[fieldMappingVersion](
+	[Id] [int] NOT NULL DEFAULT 1,
+	[Version] [bigint] NOT NULL DEFAULT 1,
+CONSTRAINT [PK_fieldMappingVersion] PRIMARY KEY CLUSTERED
+(
+	[Id] ASC
+),
+CONSTRAINT [CK_fieldMappingVersion_SingleRow] CHECK ([Id] = 1)
+) ON [PRIMARY]
+GO
+
+INSERT INTO [dbo].[fieldMappingVersion] ([Id], [Version]) VALUES (1, 1)
+GO
+
+CREATE TRIGGER [dbo].[TR_fieldMapping_Version] ON [dbo].[fieldMapping]
+AFTER INSERT, UPDATE, DELETE
+AS
+BEGIN
+	SET NOCOUNT ON;
+	UPDATE [dbo].[fieldMappingVersion] SET [Version] = [Version] + 1 WHERE [Id] = 1;
+END
+GO
@@ -0,0 +1,9 @@
+CREATE TABLE [dbo].[translationCache](
+	[CacheKey] [char](64) NOT NULL,
+	[Translation] [nvarchar](MAX) NOT NULL,
+	[CreatedAt] [datetime2](0) NOT NULL,
+CONSTRAINT [PK_translationCache] PRIMARY KEY CLUSTERED
+(
+	[CacheKey] ASC
+)
+) ON [PRIMARY]
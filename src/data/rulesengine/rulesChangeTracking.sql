@@ -0,0 +1,8 @@
+/****** Change tracking on [dbo].[Rules], read by the rule graph cache (src/backend/common/rule_cache.py) ******/
+IF NOT EXISTS (SELECT 1 FROM sys.change_tracking_databases WHERE database_id = DB_ID())
+	ALTER DATABASE CURRENT SET CHANGE_TRACKING = ON (CHANGE_RETENTION = 2 DAYS, AUTO_CLEANUP = ON)
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.change_tracking_tables WHERE object_id = OBJECT_ID('dbo.Rules'))
+	ALTER TABLE [dbo].[Rules] ENABLE CHANGE_TRACKING
+GO
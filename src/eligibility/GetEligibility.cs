@@ -56,6 +56,8 @@ public class GetEligibility
     private static List<Rule> GetRules(IEnumerable<DatabaseRule> databaseRules)
     {
         var ruleDictionary = new Dictionary<string, Rule>();
+        var references = new Dictionary<string, string>();
+        var sharedRules = new HashSet<string>();
         var rootRules = new List<Rule>();
 
         foreach (var databaseRule in databaseRules)
@@ -69,21 +71,37 @@ public class GetEligibility
             };
 
             ruleDictionary[databaseRule.RuleName] = rule;
+
+            // shared subtrees are stored once ({"Shared": true}) and referenced from each position ({"Ref": "<name>"})
+            if (!string.IsNullOrEmpty(databaseRule.Properties))
+            {
+                using var properties = JsonDocument.Parse(databaseRule.Properties);
+                if (properties.RootElement.TryGetProperty("Ref", out var reference))
+                {
+                    references[databaseRule.RuleName] = reference.GetString()!;
+                }
+                if (properties.RootElement.TryGetProperty("Shared", out var shared) && shared.ValueKind == JsonValueKind.True)
+                {
+                    sharedRules.Add(databaseRule.RuleName);
+                }
+            }
         }
 
+        var childRules = new HashSet<string>();
         foreach (var databaseRule in databaseRules)
         {
             if (!string.IsNullOrEmpty(databaseRule.RuleNameFK))
             {
+                childRules.Add(databaseRule.RuleName);
                 var parentRule = ruleDictionary[databaseRule.RuleNameFK];
-                var childRule = ruleDictionary[databaseRule.RuleName];
+                var childRule = references.TryGetValue(databaseRule.RuleName, out var target) ? ruleDictionary[target] : ruleDictionary[databaseRule.RuleName];
                 ((List<Rule>)parentRule.Rules).Add(childRule);
             }
         }
 
         foreach (var rule in ruleDictionary.Values)
         {
-            if (!databaseRules.Any(dr => dr.RuleName == rule.RuleName && !string.IsNullOrEmpty(dr.RuleNameFK)))
+            if (!sharedRules.Contains(rule.RuleName) && !childRules.Contains(rule.RuleName))
             {
                 rootRules.Add(rule);
             }
@@ -0,0 +1,244 @@
+"""
+Offline backfill of [dbo].[enhancedProductMapping] and [dbo].[Rules] from the whole [dbo].[productMapping] table.
+
+Runs the work of the enrich_changes, translate_changes and store_rules_batch activities outside Durable Functions,
+e.g. to rebuild everything after a fieldMapping change. productMapping is streamed in id order, batches are enriched
+and parsed by a pool of worker processes, translated (unless --skip-translation) and bulk-merged through staging
+tables. A checkpoint file records the last id written, so an interrupted run resumes where it stopped. Once every
+batch is written, the rows of products no longer in productMapping are deleted from both tables.
+
+The settings are the app settings of the function (ReferenceDataOdbcConnectionString, RulesDataOdbcConnectionString,
+AZURE_OPENAI_*, TRANSLATION_CACHE*, PARSER_*), read from the environment or from a local.settings.json file.
+
+Usage (from src/parser): python backfill.py [--settings local.settings.json] [--processes 4] [--batch-size 500]
+    [--checkpoint backfill.checkpoint.json] [--restart] [--skip-translation]
+"""
+import argparse, json, logging, multiprocessing, os, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from utils.rule import Rule, RuleSyntaxError
+from utils.parse_cache import ParseCache
+from utils.snapshot import MapSnapshot, load_maps
+from utils.rule_store import RuleStore
+from utils import db
+import utils.constants as constants
+
+# per worker process state, see _init_worker
+_worker = {}
+
+def _init_worker(version, maps, shared, min_shared_size):
+    _worker["snapshot"] = MapSnapshot(version, maps)
+    _worker["parse_cache"] = ParseCache(int(os.environ.get("PARSER_PARSE_CACHE_SIZE", constants.DEFAULT_PARSE_CACHE_SIZE)))
+    _worker["shared"] = shared
+    _worker["min_shared_size"] = min_shared_size
+
+def process_batch(items):
+    """
+    Enrich a batch of productMapping items and convert their expressions into rule tables, in a worker process
+
+    Returns:
+    A tuple with the enriched items, the rule tables by item id and the ids of the items whose expression is invalid
+    """
+    snapshot = _worker["snapshot"]
+    parse_cache = _worker["parse_cache"]
+
+    tables = {}
+    invalid = []
+    for item in items:
+        snapshot.enrich(item)
+        try:
+            parsed = parse_cache.get(item["value"])
+        except RuleSyntaxError as e:
+            # as in store_rules_batch, the stored rules of the item are left untouched
+            logging.error(f"backfill: the expression of item {item['id']} is invalid: {e}")
+            invalid.append(item["id"])
+            continue
+        rule = Rule.thaw(parsed.optimized)
+        rule.name = str(item["id"])
+        tables[rule.name] = rule.get_table("Eligibility", shared=_worker["shared"], min_shared_size=_worker["min_shared_size"])
+
+    return items, tables, invalid
+
+def read_products(last_id, batch_size):
+    """
+    Stream the productMapping rows with an id greater than last_id, in id order, a batch at a time.
+    The result set is read with a forward-only cursor as it is consumed, so the table is never loaded in memory.
+    """
+    with db.connection("ReferenceDataOdbcConnectionString", autocommit=True) as connection:
+        cursor = connection.cursor()
+        cursor.execute(constants.READ_PRODUCT_MAPPING_COMMAND_TEXT, last_id)
+        columns = [column[0] for column in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [dict(zip(columns, row)) for row in rows]
+        cursor.close()
+
+def write_batch(items, tables, keep_translation):
+    """
+    Merge a batch of enriched items into enhancedProductMapping and their rule tables into Rules.
+    Both writes are idempotent, so a batch whose checkpoint was not saved can safely be written again.
+
+    Parameters:
+    keep_translation: leave the stored translated_value of existing rows untouched (--skip-translation)
+
+    Returns:
+    The RuleStore.write statistics
+    """
+    with db.connection("ReferenceDataOdbcConnectionString") as connection:
+        cursor = connection.cursor()
+        cursor.fast_executemany = True
+        cursor.execute(constants.CREATE_ENHANCED_STAGE_COMMAND_TEXT)
+        cursor.executemany(constants.INSERT_ENHANCED_STAGE_COMMAND_TEXT, [tuple(item.get(column) for column in constants.ENHANCED_PRODUCT_MAPPING_COLUMNS) for item in items])
+        cursor.execute(constants.MERGE_ENHANCED_STAGE_KEEP_TRANSLATION_COMMAND_TEXT if keep_translation else constants.MERGE_ENHANCED_STAGE_COMMAND_TEXT)
+        cursor.execute(constants.DROP_ENHANCED_STAGE_COMMAND_TEXT)
+        cursor.close()
+
+    with db.connection("RulesDataOdbcConnectionString") as connection:
+        return RuleStore(connection).write(tables, "Eligibility")
+
+def delete_vanished(workflow_name="Eligibility"):
+    """
+    Delete the enhancedProductMapping rows and the root rules (with their descendants) of the products that are no
+    longer in productMapping.
+    The root rules are read before the product ids: a root written meanwhile by the function belongs to a product that
+    is already in productMapping, so only products deleted since are removed.
+
+    Returns:
+    A tuple with the number of enhancedProductMapping rows deleted and the RuleStore.write statistics
+    """
+    with db.connection("RulesDataOdbcConnectionString") as connection:
+        cursor = connection.cursor()
+        roots = [row[0] for row in cursor.execute(constants.READ_RULES_ROOT_NAMES_COMMAND_TEXT, workflow_name)]
+        cursor.close()
+
+    with db.connection("ReferenceDataOdbcConnectionString") as connection:
+        cursor = connection.cursor()
+        ids = { str(row[0]) for row in cursor.execute(constants.READ_PRODUCT_MAPPING_IDS_COMMAND_TEXT) }
+        deleted = cursor.execute(constants.DELETE_VANISHED_ENHANCED_COMMAND_TEXT).rowcount
+        cursor.close()
+
+    vanished = [name for name in roots if name not in ids]
+    if not vanished:
+        return deleted, { "upserted": 0, "deleted": 0, "unchanged": 0, "shared": 0 }
+    with db.connection("RulesDataOdbcConnectionString") as connection:
+        return deleted, RuleStore(connection).write({ name: None for name in vanished }, workflow_name)
+
+def load_checkpoint(path, maps_version):
+    """
+    Returns:
+    The saved progress, or a new one when there is no checkpoint or when it was saved with other field mapping tables
+    """
+    checkpoint = { "last_id": -1, "maps_version": maps_version, "processed": 0, "invalid": 0 }
+    if not os.path.exists(path):
+        return checkpoint
+
+    with open(path) as file:
+        saved = json.load(file)
+    if saved.get("maps_version") != maps_version:
+        logging.warning(f"backfill: the checkpoint was saved with fieldMapping version {saved.get('maps_version')}, the current one is {maps_version}; starting over")
+        return checkpoint
+    return saved
+
+def save_checkpoint(path, checkpoint):
+    # written to a temporary file first, so an interrupted save never leaves a truncated checkpoint
+    with open(path + ".tmp", "w") as file:
+        json.dump(checkpoint, file)
+    os.replace(path + ".tmp", path)
+
+def load_settings(path):
+    """
+    Copy the "Values" of a local.settings.json file to the environment, without overriding variables already set
+    """
+    with open(path) as file:
+        values = json.load(file).get("Values", {})
+    for name, value in values.items():
+        os.environ.setdefault(name, str(value))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--settings", help="a local.settings.json file")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-size", type=int, default=constants.DEFAULT_BACKFILL_BATCH_SIZE)
+    parser.add_argument("--checkpoint", default="backfill.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and process every product")
+    parser.add_argument("--skip-translation", action="store_true", help="keep the stored translations, new products get none")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.settings:
+        load_settings(args.settings)
+
+    with db.connection("ReferenceDataOdbcConnectionString") as connection:
+        maps_version, maps = load_maps(connection)
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    checkpoint = load_checkpoint(args.checkpoint, maps_version)
+    logging.info(f"backfill: fieldMapping version {maps_version}, resuming after id {checkpoint['last_id']}")
+
+    translator = None
+    if not args.skip_translation:
+        # langchain is only needed (and imported) when translating
+        from utils.translator import create_translator, translate_item, translate_items
+        from utils.translation_cache import create_translation_cache
+        translator = create_translator()
+        translation_cache = create_translation_cache(partial(db.connect, "ReferenceDataOdbcConnectionString", autocommit=True))
+    translation_batch_size = max(1, int(os.environ.get("PARSER_TRANSLATION_BATCH_SIZE", constants.DEFAULT_TRANSLATION_BATCH_SIZE)))
+    translation_concurrency = int(os.environ.get("PARSER_TRANSLATION_CONCURRENCY", constants.DEFAULT_TRANSLATION_CONCURRENCY))
+
+    shared = os.environ.get("PARSER_SHARED_SUBTREES", "false").lower() == "true"
+    min_shared_size = int(os.environ.get("PARSER_MIN_SHARED_RULE_SIZE", constants.DEFAULT_MIN_SHARED_RULE_SIZE))
+
+    start = time.perf_counter()
+    processed = 0
+
+    def write(result):
+        nonlocal processed
+        items, tables, invalid = result
+        if translator is not None:
+            # as in process_changes_batch_orchestrator, the JSON-mode prompt is only used when batches are enabled
+            with ThreadPoolExecutor(max_workers=translation_concurrency) as executor:
+                if translation_batch_size > 1:
+                    chunks = [items[index:index + translation_batch_size] for index in range(0, len(items), translation_batch_size)]
+                    list(executor.map(partial(translate_items, translator, translation_cache), chunks))
+                else:
+                    list(executor.map(partial(translate_item, translator, translation_cache), items))
+        stats = write_batch(items, tables, args.skip_translation)
+
+        # batches are written in id order, so every id up to the last one of the batch is done
+        checkpoint["last_id"] = items[-1]["id"]
+        checkpoint["processed"] += len(items)
+        checkpoint["invalid"] += len(invalid)
+        save_checkpoint(args.checkpoint, checkpoint)
+
+        processed += len(items)
+        logging.info(f"backfill: {checkpoint['processed']} products up to id {checkpoint['last_id']} ({processed / (time.perf_counter() - start):.1f}/s), rules {stats}")
+
+    with multiprocessing.Pool(args.processes, initializer=_init_worker, initargs=(maps_version, maps, shared, min_shared_size)) as pool:
+        # a bounded number of batches is in flight; imap would read the whole table ahead of the workers
+        pending = deque()
+        for batch in read_products(checkpoint["last_id"], args.batch_size):
+            pending.append(pool.apply_async(process_batch, (batch,)))
+            if len(pending) >= 2 * args.processes:
+                write(pending.popleft().get())
+        while pending:
+            write(pending.popleft().get())
+
+    deleted, stats = delete_vanished()
+    logging.info(f"backfill: deleted {deleted} enhancedProductMapping rows and {stats['deleted']} rules of products no longer in productMapping")
+
+    if shared:
+        # unlike after a function batch, the backfill waits for the writers in progress rather than skipping the collection
+        with db.connection("RulesDataOdbcConnectionString") as connection:
+            logging.info(f"backfill: collected {RuleStore(connection).collect_shared(lock_timeout=-1)} unreferenced shared rules")
+
+    if translator is not None:
+        translator.close()
+    logging.info(f"backfill: done, {processed} products in {time.perf_counter() - start:.1f}s, {checkpoint['processed']} ({checkpoint['invalid']} invalid) since the checkpoint was created")
+
+if __name__ == "__main__":
+    main()
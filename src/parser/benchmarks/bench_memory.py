@@ -0,0 +1,78 @@
+"""
+Memory benchmark of in-memory rule catalogs.
+
+Builds the optimized trees of a synthetic catalog (see catalog.py) and compares the memory held by Rule trees with a
+per-instance __dict__ (the Rule class before __slots__) and by Rule trees with __slots__.
+Both forms are built from the same trees and are measured with tracemalloc.
+
+Usage (from src/parser): python benchmarks/bench_memory.py [--products 100000]
+"""
+import argparse, gc, os, sys, time, tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.rule import Rule
+from catalog import CatalogGenerator
+
+class DictRule:
+    # the attributes of Rule, stored in a per-instance __dict__
+    def __init__(self, rule, nodes):
+        self.name = rule.name
+        self.value = rule.value
+        self.left = None
+        self.right = None
+        self.enabled = rule.enabled
+        self.expression_type = rule.expression_type
+        self.rules = [nodes[id(child)] for child in rule.rules] if rule.rules is not None else None
+
+def to_rules(rule, factory):
+    # a copy of the tree, n-ary like optimized trees, built bottom-up with factory(node, nodes)
+    nodes = {}
+    stack = [(rule, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            nodes[id(node)] = factory(node, nodes)
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children())
+    return nodes[id(rule)]
+
+def slots_rule(rule, nodes):
+    return Rule(name=rule.name, value=rule.value, enabled=rule.enabled, expression_type=rule.expression_type, rules=[nodes[id(child)] for child in rule.rules] if rule.rules is not None else None)
+
+def measure(name, build):
+    # strings (codes, names) are shared with the source trees in every form, so only the structure is measured
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    value = build()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<20} memory={current / 2**20:8.1f}MiB build={elapsed:.2f}s")
+    return value
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--codes", type=int, default=5000)
+    args = parser.parse_args()
+
+    generator = CatalogGenerator(codes=args.codes // 2, unmapped=args.codes - args.codes // 2)
+    expressions = [generator.expression() for _ in range(args.products)]
+
+    rules = {}
+    for id, expression in enumerate(expressions):
+        rule = Rule.parse_expression(expression)
+        rule.name = str(id)
+        rules[str(id)] = rule.optimize()
+    nodes = sum(rule.stats()["nodes"] for rule in rules.values())
+    print(f"products={args.products} nodes={nodes}")
+
+    measure("Rule (__dict__)", lambda: { name: to_rules(rule, DictRule) for name, rule in rules.items() })
+    measure("Rule (__slots__)", lambda: { name: to_rules(rule, slots_rule) for name, rule in rules.items() })
+
+if __name__ == "__main__":
+    main()
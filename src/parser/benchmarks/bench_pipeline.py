@@ -0,0 +1,173 @@
+"""
+Benchmark of the parser stages on a synthetic catalog (see catalog.py).
+
+Measures Rule.parse_expression, Rule.optimize, Rule.get_table, the field mapping load (snapshot.load_maps and the
+MapSnapshot matcher build, the code that replaced get_maps and its per-row hashing) and enrich_changes
+(MapSnapshot.enrich). Runs offline: the database binding is replaced by an in-memory connection serving the
+generated fieldMapping rows, and the activities' code is called without the Azure Functions host.
+
+For each stage, reports the throughput, the p50/p99 latency of a call and the peak memory of a pass (measured in a
+separate, untimed pass under tracemalloc). Results can be saved and compared with a baseline; the script exits with
+status 1 when a stage is slower or bigger than the baseline by more than the tolerance.
+
+Usage (from src/parser): python benchmarks/bench_pipeline.py [--products 2000] [--codes 3000] [--depth 3] [--width 6]
+    [--overlap 0.5] [--output results.json] [--baseline results.json] [--tolerance 0.2]
+"""
+import argparse, gc, json, os, sys, time, tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.rule import Rule
+from utils.snapshot import MapSnapshot, load_maps
+from catalog import CatalogGenerator
+
+class FakeCursor:
+    # the subset of the pyodbc cursor used by load_maps
+    def __init__(self, version, rows):
+        self._version = version
+        self._rows = rows
+        self._result = None
+
+    def execute(self, command_text, *params):
+        if "fieldMappingVersion" in command_text:
+            self._result = [(self._version,)]
+        else:
+            self._result = [(row["Code"], row["Mapping_ID"], row["Short_Descr"], row["Long_Descr"]) for row in sorted(self._rows, key=lambda row: -len(row["Code"]))]
+        return self
+
+    def fetchval(self):
+        return self._result[0][0] if self._result else None
+
+    def __iter__(self):
+        return iter(self._result)
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    def __init__(self, version, rows):
+        self._version = version
+        self._rows = rows
+
+    def cursor(self):
+        return FakeCursor(self._version, self._rows)
+
+def percentile(sorted_values, ratio):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * ratio))]
+
+def run_stage(name, inputs, fn, rounds):
+    """
+    Time fn on every input for a number of rounds, then measure the peak memory of one more pass
+
+    Returns:
+    A dictionary of the stage results (calls per second, p50/p99 latency in microseconds, peak memory in MiB)
+    """
+    latencies = []
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for value in inputs:
+            call_start = time.perf_counter()
+            fn(value)
+            latencies.append(time.perf_counter() - call_start)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    latencies.sort()
+
+    # outputs are kept, as an activity returns them for the whole batch
+    gc.collect()
+    tracemalloc.start()
+    outputs = [fn(value) for value in inputs]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del outputs
+
+    return {
+        "stage": name,
+        "calls": len(inputs),
+        "throughput": len(inputs) / best if best else 0.0,
+        "p50_us": percentile(latencies, 0.5) * 1e6,
+        "p99_us": percentile(latencies, 0.99) * 1e6,
+        "peak_mib": peak / 2**20
+    }
+
+def compare(results, baseline, tolerance):
+    """
+    Returns:
+    The list of regressions (stage, metric, baseline and current values) of results against a baseline
+    """
+    baseline = { stage["stage"]: stage for stage in baseline["stages"] }
+    regressions = []
+    for stage in results["stages"]:
+        previous = baseline.get(stage["stage"])
+        if previous is None:
+            continue
+        for metric in ("p50_us", "p99_us", "peak_mib"):
+            if stage[metric] > previous[metric] * (1 + tolerance):
+                regressions.append((stage["stage"], metric, previous[metric], stage[metric]))
+        if stage["throughput"] < previous["throughput"] * (1 - tolerance):
+            regressions.append((stage["stage"], "throughput", previous["throughput"], stage["throughput"]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--codes", type=int, default=3000, help="number of fieldMapping codes")
+    parser.add_argument("--unmapped", type=int, default=2000, help="number of codes not in fieldMapping")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--width", type=int, default=6)
+    parser.add_argument("--overlap", type=float, default=0.5, help="probability that an expression code is in fieldMapping")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="save the results to a JSON file")
+    parser.add_argument("--baseline", help="compare the results with a JSON file saved with --output")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    generator = CatalogGenerator(args.codes, args.unmapped, args.depth, args.width, args.overlap, seed=args.seed)
+    field_mapping = generator.field_mapping()
+    items = generator.product_mapping(args.products)
+    connection = FakeConnection(1, field_mapping)
+
+    trees = [Rule.parse_expression(item["value"]) for item in items]
+    optimized = []
+    for item, tree in zip(items, trees):
+        tree.name = item["id"]
+        optimized.append(tree.optimize())
+    snapshot = MapSnapshot(*load_maps(connection))
+
+    nodes = sum(tree.stats()["nodes"] for tree in trees)
+    print(f"products={len(items)} fieldMapping={len(field_mapping)} nodes={nodes} ({nodes / len(items):.1f} per expression)")
+
+    def load_snapshot(_):
+        return MapSnapshot(*load_maps(connection))
+
+    stages = [
+        ("parse_expression", [item["value"] for item in items], Rule.parse_expression),
+        ("optimize", trees, lambda tree: tree.optimize()),
+        ("get_table", optimized, lambda tree: tree.get_table("Eligibility")),
+        ("maps", [None] * max(1, args.rounds), load_snapshot),
+        ("enrich_changes", items, lambda item: snapshot.enrich(dict(item)))
+    ]
+
+    results = { "parameters": vars(args), "stages": [] }
+    print(f"{'stage':<18} {'calls':>7} {'calls/s':>12} {'p50':>11} {'p99':>11} {'peak':>10}")
+    for name, inputs, fn in stages:
+        stage = run_stage(name, inputs, fn, args.rounds)
+        results["stages"].append(stage)
+        print(f"{name:<18} {stage['calls']:>7} {stage['throughput']:>12.1f} {stage['p50_us']:>9.1f}us {stage['p99_us']:>9.1f}us {stage['peak_mib']:>7.2f}MiB")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for stage, metric, previous, current in regressions:
+            print(f"REGRESSION {stage} {metric}: {previous:.2f} -> {current:.2f}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
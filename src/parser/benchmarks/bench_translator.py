@@ -0,0 +1,99 @@
+"""
+Micro-benchmark of the translation client setup overhead.
+
+Runs a fake Azure OpenAI endpoint on localhost and compares the original translate_changes behavior
+(a new AzureChatOpenAI client and chain per call) with the shared, pooled Translator.
+
+Usage (from src/parser): python benchmarks/bench_translator.py [--calls 200]
+"""
+import argparse, json, os, sys, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from langchain_openai import AzureChatOpenAI
+from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+
+from utils.translator import Translator
+import utils.constants as constants
+
+API_VERSION = "2024-03-01-preview"
+DEPLOYMENT = "fake-deployment"
+
+COMPLETION = json.dumps({
+    "id": "chatcmpl-fake",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-4",
+    "choices": [{ "index": 0, "finish_reason": "stop", "message": { "role": "assistant", "content": "This offer is available to everyone." } }],
+    "usage": { "prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2 }
+}).encode("utf-8")
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(COMPLETION)))
+        self.end_headers()
+        self.wfile.write(COMPLETION)
+
+    def log_message(self, format, *args):
+        pass
+
+INPUTS = {
+    "cat1_codes": "[]",
+    "cat2_codes": "[]",
+    "cat3_codes": "[]",
+    "expression": "((\"General Market\" AND (97028 OR 97029)) AND (NOT 82118))"
+}
+
+def translate_per_call(endpoint):
+    # what translate_changes used to do on every activity invocation
+    model = AzureChatOpenAI(
+        azure_endpoint=endpoint,
+        azure_deployment=DEPLOYMENT,
+        openai_api_version=API_VERSION,
+        temperature=0.5,
+        max_tokens = 2048
+    )
+
+    prompt = PromptTemplate(
+        input_variables=["cat1_codes", "cat2_codes", "cat3_codes", "expression"],
+        template = constants.TRANSLATE_TEMPLATE
+    )
+
+    chain = prompt | model | StrOutputParser()
+    return chain.invoke(INPUTS)
+
+def measure(name, calls, fn):
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"{name:<12} calls={calls} mean={sum(latencies) / calls * 1000:.2f}ms p50={latencies[calls // 2] * 1000:.2f}ms p99={latencies[min(calls - 1, int(calls * 0.99))] * 1000:.2f}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AZURE_OPENAI_API_KEY", "fake-key")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_port}"
+
+    translator = Translator(endpoint, DEPLOYMENT, API_VERSION)
+    translator.translate(INPUTS) # warm up the shared chain and connection pool
+    translate_per_call(endpoint)
+
+    measure("per-call", args.calls, lambda: translate_per_call(endpoint))
+    measure("shared", args.calls, lambda: translator.translate(INPUTS))
+
+    translator.close()
+    server.shutdown()
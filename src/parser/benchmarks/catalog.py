@@ -0,0 +1,81 @@
+"""
+Synthetic reference data for the parser benchmarks.
+
+Generates fieldMapping rows (see src/data/referencedata/fieldMapping.sql) and productMapping items whose values have
+the shape of the sample expressions in experiments/Search01/data.json: numeric codes combined with AND/OR, nested in
+parentheses, with a few NOT exclusions.
+"""
+import random
+
+from utils import constants
+
+class CatalogGenerator:
+    """
+    Parameters:
+    codes: the number of fieldMapping codes, spread over the Affiliate, LOB and CustomField mapping ids
+    unmapped: the number of codes that appear in expressions without being in fieldMapping
+    depth: the maximum nesting depth of an expression
+    width: the maximum number of operands of an AND/OR
+    overlap: the probability that an expression code is a fieldMapping code (replaced by enrich_changes)
+    not_ratio: the probability that a code is an exclusion (NOT code)
+    seed: the random seed, the same parameters and seed always generate the same catalog
+    """
+
+    def __init__(self, codes=3000, unmapped=2000, depth=3, width=6, overlap=0.5, not_ratio=0.1, seed=0):
+        self.depth = depth
+        self.width = width
+        self.overlap = overlap
+        self.not_ratio = not_ratio
+        self.random = random.Random(seed)
+
+        # codes of every mapping id are interleaved, as the real 5 and 6 digit codes are
+        numbers = self.random.sample(range(10000, 1000000), codes + unmapped)
+        self.mapped_codes = [str(number) for number in numbers[:codes]]
+        self.unmapped_codes = [str(number) for number in numbers[codes:]] or self.mapped_codes
+
+    def field_mapping(self):
+        """
+        Returns:
+        A list of fieldMapping rows ("Code", "Mapping_ID", "Short_Descr" and "Long_Descr" keys)
+        """
+        rows = []
+        for index, code in enumerate(self.mapped_codes):
+            mapping_id = constants.MAPPING_IDS[index % len(constants.MAPPING_IDS)]
+            short_descr = f"{mapping_id} {code}"[:30]
+            # about a third of the rows have no long description, enrich_changes then uses the short one
+            long_descr = None if self.random.random() < 0.3 else f"{mapping_id} offer {code} for ${self.random.randint(10, 200)} x {self.random.choice([12, 24])}M"[:100]
+            rows.append({ "Code": code, "Mapping_ID": mapping_id, "Short_Descr": short_descr, "Long_Descr": long_descr })
+        return rows
+
+    def code(self):
+        pool = self.mapped_codes if self.random.random() < self.overlap else self.unmapped_codes
+        code = self.random.choice(pool)
+        return f"NOT {code}" if self.random.random() < self.not_ratio else code
+
+    def expression(self, depth=None):
+        """
+        Generate an expression of at most the given depth (self.depth by default).
+        Operands get more likely to be codes the deeper they are, so trees are irregular.
+        """
+        depth = self.depth if depth is None else depth
+        operands = []
+        for _ in range(self.random.randint(2, max(2, self.width))):
+            if depth > 1 and self.random.random() < depth / (self.depth + 1):
+                operands.append(self.expression(depth - 1))
+            else:
+                operand = self.code()
+                operands.append(f"({operand})" if operand.startswith("NOT ") else operand)
+        operator = self.random.choice([" AND ", " OR "])
+        return "(" + operator.join(operands) + ")"
+
+    def product_mapping(self, count, start_id=9776100000):
+        """
+        Returns:
+        A list of productMapping items ("name", "id", "state" and "value" keys)
+        """
+        return [{
+            "name": f"Synthetic offer {index}",
+            "id": str(start_id + index),
+            "state": "ACTIVE",
+            "value": self.expression()
+        } for index in range(count)]
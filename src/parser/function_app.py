@@ -1,33 +1,93 @@
-import json, hashlib, logging, os
+import json, logging, os
+from datetime import timedelta
+from functools import partial
 import azure.functions as func
 import azure.durable_functions as df
 
-from langchain_openai import AzureChatOpenAI
-from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-
-from utils.rule import Rule
+from utils.rule import Rule, RuleSyntaxError
+from utils.snapshot import MapSnapshotCache, load_maps
+from utils.rule_store import RuleStore
+from utils.parse_cache import ParseCache
+from utils.translator import create_translator, translate_item, translate_items
+from utils.translation_cache import create_translation_cache
+from utils.changes import collapse_changes, latest_changes, join_ids
+from utils import db
 import utils.constants as constants
 
 os.environ["OPEN_API_VERSION"] = os.environ["AZURE_OPENAI_API_VERSION"]
 app = df.DFApp()
 
+def _load_maps():
+    with db.connection("ReferenceDataOdbcConnectionString") as connection:
+        return load_maps(connection)
+
+# loaded once per worker, reloaded only when an orchestration sees a newer fieldMapping version
+map_snapshots = MapSnapshotCache(_load_maps)
+
+translation_cache = create_translation_cache(partial(db.connect, "ReferenceDataOdbcConnectionString", autocommit=True))
+
+# shared by every translate_changes invocation on this worker; the chain itself is built on first use
+translator = create_translator()
+
+# parsed expressions, shared by every activity on this worker
+parse_cache = ParseCache(int(os.environ.get("PARSER_PARSE_CACHE_SIZE", constants.DEFAULT_PARSE_CACHE_SIZE)))
+
 @app.sql_trigger(arg_name="changes", table_name="productMapping", connection_string_setting="ReferenceDataConnectionString")
 @app.durable_client_input(client_name="client")
 async def process_changes(changes, client):
-    instance_id = await client.start_new("process_changes_orchestrator", None, changes)
+    translation_concurrency = int(os.environ.get("PARSER_TRANSLATION_CONCURRENCY", constants.DEFAULT_TRANSLATION_CONCURRENCY))
+    translation_batch_size = int(os.environ.get("PARSER_TRANSLATION_BATCH_SIZE", constants.DEFAULT_TRANSLATION_BATCH_SIZE))
+    debounce_seconds = int(os.environ.get("PARSER_DEBOUNCE_SECONDS", constants.DEFAULT_DEBOUNCE_SECONDS))
+
+    if debounce_seconds > 0:
+        for id, change in latest_changes(json.loads(changes)).items():
+            await _debounce_change(client, change, debounce_seconds, translation_concurrency, translation_batch_size)
+    elif os.environ.get("PARSER_ORCHESTRATION_MODE", constants.ORCHESTRATION_MODE_BATCH) == constants.ORCHESTRATION_MODE_SERIAL:
+        instance_id = await client.start_new("process_changes_orchestrator", None, changes)
+    else:
+        instance_id = await client.start_new("process_changes_batch_orchestrator", None, {
+            "Changes": changes,
+            "TranslationConcurrency": translation_concurrency,
+            "TranslationBatchSize": translation_batch_size
+        })
+
+async def _debounce_change(client, change, debounce_seconds, translation_concurrency, translation_batch_size):
+    """
+    Hand the change to the product's singleton debounce orchestration, starting it if it is not running.
+    The orchestration completes after a quiet window (see debounce_product_orchestrator); raising the event fails when
+    it completed after the status check, and the change is then handed to a new instance.
+    """
+    instance_id = constants.DEBOUNCE_INSTANCE_PREFIX + str(change["Item"]["id"])
+    for attempt in range(2):
+        status = await client.get_status(instance_id)
+        if not (status and status.runtime_status in [df.OrchestrationRuntimeStatus.Pending, df.OrchestrationRuntimeStatus.Running, df.OrchestrationRuntimeStatus.ContinuedAsNew]):
+            try:
+                await client.start_new("debounce_product_orchestrator", instance_id, {
+                    "Window": debounce_seconds,
+                    "TranslationConcurrency": translation_concurrency,
+                    "TranslationBatchSize": translation_batch_size
+                })
+            except Exception:
+                # started by another invocation in the meantime, it buffers the event until it runs
+                logging.info(f"{instance_id} is already running")
+
+        try:
+            await client.raise_event(instance_id, constants.DEBOUNCE_EVENT_NAME, change)
+            return
+        except Exception:
+            if attempt:
+                raise
+            logging.info(f"{instance_id} completed before the change was raised, it is handed to a new instance")
 
 @app.orchestration_trigger(context_name="context")
 def process_changes_orchestrator(context):
     changes = context.get_input()
     changes_obj = json.loads(changes)
     
-    maps = yield context.call_activity("get_maps", "get_maps_input")
+    maps_version = yield context.call_activity("get_maps_version", "get_maps_version_input")
     for change in changes_obj:
         if ((change["Operation"] == constants.SQL_INSERT) or (change["Operation"] == constants.SQL_UPDATE)):
-            enriched_changes = yield context.call_activity("enrich_changes", { "Map1": maps[0], "Map2": maps[1], "Map3": maps[2], "Item": change["Item"] })
+            enriched_changes = yield context.call_activity("enrich_changes", { "MapsVersion": maps_version, "Item": change["Item"] })
             translated_changes = yield context.call_activity("translate_changes", enriched_changes)
             yield context.call_activity("process_upsert", translated_changes)
 
@@ -40,36 +100,112 @@ def process_changes_orchestrator(context):
         else:
             logging.warning("process_changes_orchestrator received an unsupported change type")
 
+@app.orchestration_trigger(context_name="context")
+def debounce_product_orchestrator(context):
+    """
+    Singleton orchestration per product id (see _debounce_change), fed by ProductChanged events.
+    The first change opens a window; changes raised while it is open replace the pending one, and when it closes only
+    the latest change is processed. A change received during the processing or the quiet window after it opens the
+    next window (continue as new); without one the orchestration completes, and the next change starts a new instance.
+    """
+    params = context.get_input()
+    change = params.pop("Change", None)
+    if change is None:
+        # a new instance receives its first change as an event, right after it is started
+        timer = context.create_timer(context.current_utc_datetime + timedelta(seconds=params["Window"]))
+        event = context.wait_for_external_event(constants.DEBOUNCE_EVENT_NAME)
+        winner = yield context.task_any([timer, event])
+        if winner == timer:
+            return
+        timer.cancel()
+        change = event.result
+    deadline = context.current_utc_datetime + timedelta(seconds=params["Window"])
+
+    while True:
+        timer = context.create_timer(deadline)
+        event = context.wait_for_external_event(constants.DEBOUNCE_EVENT_NAME)
+        winner = yield context.task_any([timer, event])
+        if winner == timer:
+            break
+        timer.cancel()
+        change = event.result
+
+    yield context.call_sub_orchestrator("process_changes_batch_orchestrator", {
+        "Changes": json.dumps([change]),
+        "TranslationConcurrency": params["TranslationConcurrency"],
+        "TranslationBatchSize": params.get("TranslationBatchSize", 1)
+    })
+
+    # changes received while processing are buffered; the first one, or one raised during the quiet window, ends the
+    # wait, and the buffered ones are then consumed in order, so none is left to continue_as_new and the latest one
+    # opens the next window right away
+    pending = None
+    quiet = context.current_utc_datetime + timedelta(seconds=params["Window"])
+    while True:
+        timer = context.create_timer(quiet if pending is None else context.current_utc_datetime)
+        event = context.wait_for_external_event(constants.DEBOUNCE_EVENT_NAME)
+        winner = yield context.task_any([timer, event])
+        if winner == timer:
+            break
+        timer.cancel()
+        pending = event.result
+
+    if pending is None:
+        return
+    params["Change"] = pending
+    context.continue_as_new(params)
+
+@app.orchestration_trigger(context_name="context")
+def process_changes_batch_orchestrator(context):
+    """
+    Process a whole batch of changes with a fixed number of activities:
+    only the last change of each product id is applied, translations are fanned out in windows of
+    TranslationConcurrency activities (of TranslationBatchSize items each) and the database writes are set-based.
+    """
+    params = context.get_input()
+    upserts, deletes = collapse_changes(json.loads(params["Changes"]))
+    concurrency = max(1, params["TranslationConcurrency"])
+    batch_size = max(1, params.get("TranslationBatchSize", 1))
+
+    if upserts:
+        maps_version = yield context.call_activity("get_maps_version", "get_maps_version_input")
+        enriched_changes = yield context.call_activity("enrich_changes_batch", { "MapsVersion": maps_version, "Items": upserts })
+
+        translated_changes = []
+        if batch_size > 1:
+            chunks = [enriched_changes[start:start + batch_size] for start in range(0, len(enriched_changes), batch_size)]
+            for start in range(0, len(chunks), concurrency):
+                tasks = [context.call_activity("translate_changes_batch", chunk) for chunk in chunks[start:start + concurrency]]
+                for translated_chunk in (yield context.task_all(tasks)):
+                    translated_changes.extend(translated_chunk)
+        else:
+            for start in range(0, len(enriched_changes), concurrency):
+                tasks = [context.call_activity("translate_changes", item) for item in enriched_changes[start:start + concurrency]]
+                translated_changes.extend((yield context.task_all(tasks)))
+
+        yield context.call_activity("process_upsert_batch", translated_changes)
+
+    if deletes:
+        yield context.call_activity("process_delete_batch", join_ids(deletes))
+
+    if upserts or deletes:
+        yield context.call_activity("store_rules_batch", { "Items": upserts, "Deletes": deletes }) # convert expressions into a database compatible structure and merge them into the database
+
 @app.activity_trigger(input_name="param")
-@app.sql_input(arg_name="map1", command_text=constants.GET_MAPS_TYPE_1_COMMAND_TEXT, command_type="Text", connection_string_setting="ReferenceDataConnectionString")
-@app.sql_input(arg_name="map2", command_text=constants.GET_MAPS_TYPE_2_COMMAND_TEXT, command_type="Text", connection_string_setting="ReferenceDataConnectionString")
-@app.sql_input(arg_name="map3", command_text=constants.GET_MAPS_TYPE_3_COMMAND_TEXT, command_type="Text", connection_string_setting="ReferenceDataConnectionString")
-def get_maps(param, map1, map2, map3):
+@app.sql_input(arg_name="version", command_text=constants.GET_MAPS_VERSION_COMMAND_TEXT, command_type="Text", connection_string_setting="ReferenceDataConnectionString")
+def get_maps_version(param, version: func.SqlRowList):
     """
-    Retrieve the three mapping tables from the database
+    Retrieve the current version of the mapping tables.
+    The version is bumped by a trigger on fieldMapping, so it is all the orchestration needs to carry around.
 
     Parameters:
     param: a dummy parameter to trigger the activity
 
     Returns:
-    A list of three lists, each containing the rows of a mapping table
+    The mapping tables version
     """
-    map1_rows = list(map(lambda r: json.loads(r.to_json()), map1))
-    for row in map1_rows:
-        hash = hashlib.sha1(str(row["Code"]).encode('utf-8')).hexdigest()
-        row["Hash"] = ''.join(char + '#' for char in hash)
-
-    map2_rows = list(map(lambda r: json.loads(r.to_json()), map2))
-    for row in map2_rows:
-        hash = hashlib.sha1(str(row["Code"]).encode('utf-8')).hexdigest()
-        row["Hash"] = ''.join(char + '#' for char in hash)
-
-    map3_rows = list(map(lambda r: json.loads(r.to_json()), map3))
-    for row in map3_rows:
-        hash = hashlib.sha1(str(row["Code"]).encode('utf-8')).hexdigest()
-        row["Hash"] = ''.join(char + '#' for char in hash)
-
-    return [map1_rows, map2_rows, map3_rows]
+    rows = list(version)
+    return rows[0]["Version"] if rows else 0
 
 @app.activity_trigger(input_name="params")
 def enrich_changes(params: dict):
@@ -78,64 +214,28 @@ def enrich_changes(params: dict):
     Include lists of codes that were replaced in the output.
 
     Parameters:
-    params: a dictionary containing the item to enrich and the maps to use for replacement
+    params: a dictionary containing the item to enrich and the version of the maps to use for replacement
 
     Returns:
     The item with the enhaced value and lists of codes that were replaced in the output
     """ 
     
-    item = params["Item"]       
-    expression = item["value"]
-
-    map1 = params["Map1"]
-    map2 = params["Map2"]
-    map3 = params["Map3"]
-
-    map1_matches = []
-    for val in map1:
-        if val["Code"] in expression:
-            map1_matches.append({
-                "Code": val["Code"],
-                "Short_Descr": val["Short_Descr"],
-                "Long_Descr": val["Long_Descr"]
-            })
-            expression = expression.replace(val["Code"], val["Hash"])
-    
-    map2_matches = []
-    for val in map2:
-        if val["Code"] in expression:
-            map2_matches.append({
-                "Code": val["Code"],
-                "Short_Descr": val["Short_Descr"],
-                "Long_Descr": val["Long_Descr"]
-            })
-            expression = expression.replace(val["Code"], val["Hash"])
-
-    map3_matches = []
-    for val in map3:
-        if val["Code"] in expression:
-            map3_matches.append({
-                "Code": val["Code"],
-                "Short_Descr": val["Short_Descr"],
-                "Long_Descr": val["Long_Descr"]
-            })
-            expression = expression.replace(val["Code"], val["Hash"])
-
-    for val in map1:
-        expression = expression.replace(val["Hash"], "\"" + val["Long_Descr"] + "\"" if val["Long_Descr"] else "\"" + val["Short_Descr"] + "\"")
-
-    for val in map2:
-        expresison = expression.replace(val["Hash"], "\"" + val["Long_Descr"] + "\"" if val["Long_Descr"] else "\"" + val["Short_Descr"] + "\"")
-
-    for val in map3:
-        expression = expression.replace(val["Hash"], "\"" + val["Long_Descr"] + "\"" if val["Long_Descr"] else "\"" + val["Short_Descr"] + "\"")
-
-    item["cat1_codes"] = json.dumps(map1_matches)
-    item["cat2_codes"] = json.dumps(map2_matches)
-    item["cat3_codes"] = json.dumps(map3_matches)
-    item["enhanced_value"] = expression
-
-    return item
+    snapshot = map_snapshots.get(params["MapsVersion"])
+    return snapshot.enrich(params["Item"])
+
+@app.activity_trigger(input_name="params")
+def enrich_changes_batch(params: dict):
+    """
+    Enrich a batch of product mapping values, see enrich_changes
+
+    Parameters:
+    params: a dictionary containing the items to enrich and the version of the maps to use for replacement
+
+    Returns:
+    The list of enriched items
+    """
+    snapshot = map_snapshots.get(params["MapsVersion"])
+    return [snapshot.enrich(item) for item in params["Items"]]
 
 @app.activity_trigger(input_name="params")
 def translate_changes(params: dict):
@@ -148,30 +248,21 @@ def translate_changes(params: dict):
     Returns:
     The params dictionay with a new key, "translated_value", containing the translated value
     """
-    model = AzureChatOpenAI(
-        azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
-        azure_deployment=os.environ["AZURE_OPENAI_DEPLOYMENT_NAME"],
-        openai_api_version=os.environ["AZURE_OPENAI_API_VERSION"],
-        temperature=0.5,
-        max_tokens = 2048
-    )
-
-    prompt = PromptTemplate(
-        input_variables=["cat1_codes", "cat2_codes", "cat3_codes", "expression"],
-        template = constants.TRANSLATE_TEMPLATE
-    )
-    
-    parser = StrOutputParser()
-    chain = prompt | model | parser
-    translation = chain.invoke({
-        "cat1_codes": params["cat1_codes"],
-        "cat2_codes": params["cat2_codes"],
-        "cat3_codes": params["cat3_codes"],
-        "expression": params["enhanced_value"]
-    })
+    return translate_item(translator, translation_cache, params)
 
-    params["translated_value"] = translation
-    return params
+@app.activity_trigger(input_name="items")
+def translate_changes_batch(items: list):
+    """
+    Convert a batch of items into plain english with a single Azure OpenAI request (see Translator.translate_batch).
+    Cached translations are reused and only the remaining items are sent to the model.
+
+    Parameters:
+    items: the list of items to translate
+
+    Returns:
+    The items, each one with a new key, "translated_value", containing the translated value
+    """
+    return translate_items(translator, translation_cache, items)
 
 @app.activity_trigger(input_name="item")
 @app.sql_output(arg_name="row", command_text="[dbo].[enhancedProductMapping]", connection_string_setting="ReferenceDataConnectionString")
@@ -186,6 +277,14 @@ def process_upsert(item, row: func.Out[func.SqlRow]):
     """
     row.set(func.SqlRow.from_dict(item))
 
+@app.activity_trigger(input_name="items")
+@app.sql_output(arg_name="rows", command_text="[dbo].[enhancedProductMapping]", connection_string_setting="ReferenceDataConnectionString")
+def process_upsert_batch(items, rows: func.Out[func.SqlRowList]):
+    """
+    Insert/update the specified items in the enhancedProductMapping table in a single output binding call
+    """
+    rows.set(func.SqlRowList([func.SqlRow.from_dict(item) for item in items]))
+
 @app.activity_trigger(input_name="id")
 @app.sql_input(arg_name="row", command_text=constants.PROCESS_DELETE_COMMAND_TEXT, command_type="Text", parameters="@id={id}", connection_string_setting="ReferenceDataConnectionString")
 def process_delete(id, row: func.SqlRowList): 
@@ -204,6 +303,17 @@ def process_delete(id, row: func.SqlRowList):
     """   
     pass
 
+@app.activity_trigger(input_name="ids")
+@app.sql_input(arg_name="row", command_text=constants.PROCESS_DELETE_BATCH_COMMAND_TEXT, command_type="Text", parameters="@ids={ids}", connection_string_setting="ReferenceDataConnectionString")
+def process_delete_batch(ids, row: func.SqlRowList):
+    """
+    Delete the specified items from the enhancedProductMapping table with a single DELETE statement
+
+    Parameters:
+    ids: the ids of the items to delete, joined with constants.ID_SEPARATOR
+    """
+    pass
+
 @app.activity_trigger(input_name="name")
 @app.sql_output(arg_name="row", command_text="[dbo].[Workflows]", connection_string_setting="RulesDataConnectionString")
 def process_workflow(name, row: func.Out[func.SqlRowList]):
@@ -230,7 +340,56 @@ def process_rules(params, rows: func.Out[func.SqlRowList]):
     """
     Convert expressions into a rules engine compatible data structure and store in database
     """
-    rule = Rule.parse_expression(params["value"])
+    rule = parse_cache.parse_optimized(params["value"])
     rule.name = params["id"]
     table = rule.get_table("Eligibility")
-    rows.set(func.SqlRowList(table))
\ No newline at end of file
+    rows.set(func.SqlRowList(table))
+
+@app.activity_trigger(input_name="params")
+def store_rules_batch(params: dict):
+    """
+    Convert the expressions of a batch of items and merge the resulting rules into the database in a single transaction.
+    Only the rows that changed are written (see RuleStore), and the rules of deleted items are removed.
+
+    Parameters:
+    params: a dictionary containing the items to store ("Items") and the ids of the deleted items ("Deletes")
+
+    Returns:
+    The number of upserted, deleted and unchanged rows, the number of nodes before and after Rule.optimize, the
+    number of items whose expression could not be parsed and the parse cache statistics
+    """
+    shared = os.environ.get("PARSER_SHARED_SUBTREES", "false").lower() == "true"
+    min_shared_size = int(os.environ.get("PARSER_MIN_SHARED_RULE_SIZE", constants.DEFAULT_MIN_SHARED_RULE_SIZE))
+
+    tables = { id: None for id in params["Deletes"] }
+    nodes_before = 0
+    nodes_after = 0
+    invalid = 0
+    for item in params["Items"]:
+        try:
+            parsed = parse_cache.get(item["value"])
+        except RuleSyntaxError as e:
+            # the stored rules of the item are left untouched until its expression is fixed
+            logging.error(f"store_rules_batch: the expression of item {item['id']} is invalid: {e}")
+            invalid += 1
+            continue
+        optimized = Rule.thaw(parsed.optimized)
+        optimized.name = item["id"]
+        nodes_before += parsed.nodes
+        nodes_after += parsed.optimized_nodes
+        tables[item["id"]] = optimized.get_table("Eligibility", shared=shared, min_shared_size=min_shared_size)
+
+    with db.connection("RulesDataOdbcConnectionString") as connection:
+        stats = RuleStore(connection).write(tables, "Eligibility")
+
+    if shared and stats["deleted"]:
+        # in a transaction of its own, after the write committed (see RuleStore.collect_shared)
+        with db.connection("RulesDataOdbcConnectionString") as connection:
+            stats["collected"] = RuleStore(connection).collect_shared()
+
+    stats["nodes_before_optimization"] = nodes_before
+    stats["nodes_after_optimization"] = nodes_after
+    stats["invalid"] = invalid
+    stats["parse_cache"] = parse_cache.stats()
+    logging.info(f"store_rules_batch: {stats}")
+    return stats
@@ -0,0 +1,4 @@
+import os, sys
+
+# the tests import the parser's utils package, as function_app.py does from src/parser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,37 @@
+# sample expressions and a reference evaluator of the parsed trees, shared by the Rule tests
+
+import itertools
+
+from utils.rule import Rule
+
+EXPRESSIONS = [
+    "97126",
+    "NOT 97126",
+    "97126 AND 97350",
+    "97126 OR 97350 AND 97838",
+    "(97126 OR 97350) AND NOT 97838",
+    "((97028 OR 97029) AND (NOT 97180)) OR (97546 AND 97610 AND 97644)",
+    "97126 AND (97350 AND (97838 AND 80118)) AND 97126",
+    "(97344 OR 97346) AND (97418 OR 97346 OR 97344) AND NOT 82118 AND NOT 103086",
+]
+
+def evaluate(rule, codes):
+    if rule.__is_operator__(rule.value):
+        results = [evaluate(child, codes) for child in rule.children()]
+        return all(results) if rule.value.upper() == "AND" else any(results)
+    if rule.value.upper().startswith("NOT "):
+        return rule.value[4:].strip() not in codes
+    return rule.value.strip() in codes
+
+def codes_of(expression):
+    return sorted({ token for token, _ in Rule.tokenize(expression) if token.isdigit() })
+
+def truth_table(rule, codes):
+    # every subset of the codes, as the customer's codes
+    return [evaluate(rule, set(itertools.compress(codes, mask))) for mask in itertools.product([False, True], repeat=len(codes))]
+
+def random_expression(rng, codes, depth=0):
+    if depth > 3 or rng.random() < 0.3:
+        return ("NOT " if rng.random() < 0.3 else "") + rng.choice(codes)
+    operator = rng.choice([" AND ", " OR "])
+    return "(" + operator.join(random_expression(rng, codes, depth + 1) for _ in range(rng.randint(2, 4))) + ")"
@@ -0,0 +1,45 @@
+import os, sys
+
+# the benchmark scripts import the catalog generator from their own folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+
+from bench_pipeline import FakeConnection, compare, run_stage
+from catalog import CatalogGenerator
+from utils.rule import Rule
+from utils.snapshot import MapSnapshot, load_maps
+
+def test_catalog_follows_its_parameters():
+    generator = CatalogGenerator(codes=40, unmapped=20, depth=2, width=3, overlap=0.0, seed=1)
+    rows = generator.field_mapping()
+    items = generator.product_mapping(30)
+    assert len(rows) == 40 and len(items) == 30
+
+    mapped = { row["Code"] for row in rows }
+    for item in items:
+        tree = Rule.parse_expression(item["value"])
+        codes = { token for token, _ in Rule.tokenize(item["value"]) if token.isdigit() }
+        assert not codes & mapped # no overlap
+        assert tree.stats()["nodes"] > 1
+
+    # the same seed generates the same catalog
+    again = CatalogGenerator(codes=40, unmapped=20, depth=2, width=3, overlap=0.0, seed=1)
+    assert again.field_mapping() == rows and again.product_mapping(30) == items
+
+def test_pipeline_stages_run_offline():
+    generator = CatalogGenerator(codes=50, unmapped=20, overlap=1.0, seed=2)
+    items = generator.product_mapping(10)
+    snapshot = MapSnapshot(*load_maps(FakeConnection(1, generator.field_mapping())))
+
+    # every code of the expressions is mapped, so enrich_changes replaces them all
+    enriched = snapshot.enrich(dict(items[0]))
+    assert not any(token.isdigit() for token, _ in Rule.tokenize(enriched["enhanced_value"]))
+
+    stage = run_stage("parse_expression", [item["value"] for item in items], Rule.parse_expression, rounds=2)
+    assert stage["calls"] == 10 and stage["throughput"] > 0
+    assert 0 < stage["p50_us"] <= stage["p99_us"] and stage["peak_mib"] > 0
+
+def test_compare_reports_regressions_beyond_the_tolerance():
+    baseline = { "stages": [{ "stage": "optimize", "throughput": 1000.0, "p50_us": 100.0, "p99_us": 300.0, "peak_mib": 1.0 }] }
+    results = { "stages": [{ "stage": "optimize", "throughput": 700.0, "p50_us": 110.0, "p99_us": 400.0, "peak_mib": 1.0 }] }
+    assert compare(results, baseline, 0.2) == [("optimize", "p99_us", 300.0, 400.0), ("optimize", "throughput", 1000.0, 700.0)]
+    assert compare(results, baseline, 0.5) == []
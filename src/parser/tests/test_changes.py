@@ -0,0 +1,40 @@
+from utils import constants
+from utils.changes import collapse_changes, join_ids, latest_changes
+
+def change(operation, id, expression=None):
+    return { "Operation": operation, "Item": { "id": id, "expression": expression } }
+
+def test_last_change_of_each_id_in_order():
+    changes = [
+        change(constants.SQL_INSERT, 1, "1 AND 2"),
+        change(constants.SQL_INSERT, 2, "3"),
+        change(constants.SQL_UPDATE, 1, "1 OR 2"),
+        change(constants.SQL_INSERT, 3, "4"),
+    ]
+    latest = latest_changes(changes)
+    assert list(latest) == [2, 1, 3]
+    assert latest[1]["Item"]["expression"] == "1 OR 2"
+
+def test_delete_wins_over_earlier_upserts():
+    upserts, deletes = collapse_changes([
+        change(constants.SQL_INSERT, 1, "1"),
+        change(constants.SQL_UPDATE, 2, "2"),
+        change(constants.SQL_UPDATE, 1, "1 AND 2"),
+        change(constants.SQL_DELETE, 1),
+    ])
+    assert [item["id"] for item in upserts] == [2]
+    assert deletes == [1]
+
+def test_upsert_after_delete_is_kept():
+    upserts, deletes = collapse_changes([
+        change(constants.SQL_DELETE, 1),
+        change(constants.SQL_INSERT, 1, "1 OR 3"),
+    ])
+    assert upserts == [{ "id": 1, "expression": "1 OR 3" }]
+    assert deletes == []
+
+def test_unsupported_operations_are_dropped():
+    assert collapse_changes([change(constants.SQL_INSERT, 1, "1"), change(9, 1)]) == ([], [])
+
+def test_join_ids():
+    assert join_ids([1, "2", 3]) == "1|2|3"
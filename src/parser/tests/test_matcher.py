@@ -0,0 +1,51 @@
+from utils.matcher import CodeMatcher
+
+def row(code, short, long=None):
+    return { "Code": code, "Short_Descr": short, "Long_Descr": long }
+
+def replace_loop(maps, expression):
+    # reference: whole-token replacement, longest code first, first map first (the behavior CodeMatcher keeps)
+    tokens = expression.replace("(", " ( ").replace(")", " ) ").split()
+    replacements = {}
+    for rows in maps:
+        for item in rows:
+            replacements.setdefault(str(item["Code"]), "\"" + (item["Long_Descr"] or item["Short_Descr"]) + "\"")
+    return " ".join(replacements.get(token, token) for token in tokens)
+
+def test_longer_code_wins_over_prefix():
+    matcher = CodeMatcher([[row("9702", "short"), row("97028", "long code")]])
+    enhanced, matches = matcher.substitute("97028 AND 9702")
+    assert enhanced == '"long code" AND "short"'
+    assert [match["Code"] for match in matches[0]] == ["9702", "97028"]
+
+def test_codes_only_match_whole_tokens():
+    matcher = CodeMatcher([[row("702", "inner"), row("97", "prefix")]])
+    enhanced, matches = matcher.substitute("97028 OR (97) OR 1702")
+    assert enhanced == '97028 OR ("prefix") OR 1702'
+    assert [match["Code"] for match in matches[0]] == ["97"]
+
+def test_overlapping_codes_across_maps():
+    maps = [
+        [row("123", "affiliate 123")],
+        [row("123", "lob 123"), row("1234", "lob 1234")],
+        [row("234", "field 234", "custom field 234")],
+    ]
+    matcher = CodeMatcher(maps)
+    enhanced, matches = matcher.substitute("NOT 1234 AND (123 OR 234)")
+    assert enhanced == 'NOT "lob 1234" AND ("affiliate 123" OR "custom field 234")'
+    assert [[match["Code"] for match in codes] for codes in matches] == [["123"], ["1234"], ["234"]]
+
+def test_matches_reference_replace_loop():
+    maps = [
+        [row(str(code), f"a{code}") for code in (1, 12, 123, 97, 970)],
+        [row(str(code), f"b{code}") for code in (12, 9701, 23)],
+    ]
+    matcher = CodeMatcher(maps)
+    for expression in ["1 AND 12 AND 123", "(9701 OR 970) AND NOT 97", "23 OR 231 OR 1234", "(12)"]:
+        enhanced, _ = matcher.substitute(expression)
+        assert " ".join(enhanced.replace("(", " ( ").replace(")", " ) ").split()) == replace_loop(maps, expression)
+
+def test_no_codes():
+    enhanced, matches = CodeMatcher([[], []]).substitute("1 AND 2")
+    assert enhanced == "1 AND 2"
+    assert matches == [[], []]
@@ -0,0 +1,31 @@
+import random
+
+import pytest
+
+from utils.rule import Rule
+
+from expressions import EXPRESSIONS, codes_of, random_expression, truth_table
+
+@pytest.mark.parametrize("expression", EXPRESSIONS)
+def test_optimize_preserves_truth_table(expression):
+    rule = Rule.parse_expression(expression)
+    codes = codes_of(expression)
+    assert truth_table(rule.optimize(), codes) == truth_table(rule, codes)
+
+def test_optimize_preserves_random_truth_tables():
+    rng = random.Random(0)
+    codes = ["1", "2", "3", "4", "5", "6"]
+    for _ in range(200):
+        expression = random_expression(rng, codes)
+        rule = Rule.parse_expression(expression)
+        assert truth_table(rule.optimize(), codes) == truth_table(rule, codes), expression
+
+def test_optimize_flattens_and_deduplicates():
+    optimized = Rule.parse_expression("1 AND (2 AND (3 AND 1))").optimize()
+    assert optimized.value == "AND"
+    assert sorted(child.value for child in optimized.children()) == ["1", "2", "3"]
+    assert optimized.structural_hash() == Rule.parse_expression("(3 AND 2) AND 1").optimize().structural_hash()
+
+def test_optimize_keeps_quoted_whitespace():
+    optimized = Rule.parse_expression('NOT   "two  spaces" AND 1').optimize()
+    assert sorted(child.value for child in optimized.children()) == ["1", 'NOT "two  spaces"']
@@ -0,0 +1,52 @@
+import pytest
+
+from utils.parse_cache import ParseCache
+from utils.rule import Rule, RuleSyntaxError
+
+from expressions import EXPRESSIONS
+
+@pytest.mark.parametrize("expression", EXPRESSIONS)
+def test_parsed_trees_match_the_parser(expression):
+    cache = ParseCache()
+    assert cache.parse(expression).freeze() == Rule.parse_expression(expression).freeze()
+    assert cache.parse_optimized(expression).freeze() == Rule.parse_expression(expression).optimize().freeze()
+
+def test_mutated_tree_does_not_poison_the_cache():
+    cache = ParseCache()
+    tree = cache.parse_optimized("(97126 OR 97350) AND NOT 97838")
+    tree.name = "1001"
+    tree.value = "OR"
+    tree.children()[0].value = "80118"
+    tree.get_table("Eligibility")
+
+    again = cache.parse_optimized("(97126 OR 97350) AND NOT 97838")
+    assert again is not tree and again.name is None
+    assert again.freeze() == Rule.parse_expression("(97126 OR 97350) AND NOT 97838").optimize().freeze()
+    assert cache.stats()["hits"] == 1
+
+def test_whitespace_shares_an_entry_but_case_does_not():
+    cache = ParseCache()
+    cache.get("97126  AND\t97350")
+    cache.get(" 97126 AND 97350 ")
+    assert cache.stats()["hits"] == 1
+    cache.get('"Therapy" AND 97350')
+    cache.get('"therapy" AND 97350')
+    assert cache.stats()["misses"] == 3
+
+def test_lru_eviction():
+    cache = ParseCache(maxsize=2)
+    cache.get("1")
+    cache.get("2")
+    cache.get("1")
+    cache.get("3")
+    stats = cache.stats()
+    assert stats["size"] == 2 and stats["evictions"] == 1
+    cache.get("1")
+    assert cache.stats()["hits"] == 2 # 2 was evicted, 1 was kept
+
+def test_invalid_expressions_are_not_cached():
+    cache = ParseCache()
+    for _ in range(2):
+        with pytest.raises(RuleSyntaxError):
+            cache.get("1 AND")
+    assert cache.stats()["size"] == 0
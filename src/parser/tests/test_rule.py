@@ -0,0 +1,41 @@
+import pytest
+
+from utils.rule import Rule, RuleSyntaxError
+
+def test_precedence():
+    rule = Rule.parse_expression("1 OR 2 AND 3")
+    assert rule.value == "OR"
+    assert rule.left.value == "1"
+    assert rule.right.value == "AND"
+
+    rule = Rule.parse_expression("1 AND 2 AND 3")
+    assert rule.value == "AND" and rule.left.value == "AND" and rule.right.value == "3"
+
+def test_iter_parse_yields_children_before_parents():
+    seen = set()
+    parser = Rule.iter_parse("(1 OR 2) AND NOT 3")
+    try:
+        while True:
+            node = next(parser)
+            assert all(id(child) in seen for child in node.children())
+            seen.add(id(node))
+    except StopIteration as stop:
+        assert id(stop.value) in seen
+
+@pytest.mark.parametrize("expression, position", [
+    ("A B", 2),
+    ("()", 1),
+    ("A AND", 2),
+    ("AND A", 0),
+    ("A AND OR B", 6),
+    ("(A OR B", 0),
+    ("A OR B)", 6),
+    ("A (B)", 2),
+    ("(A) B", 4),
+    ("", 0),
+])
+def test_syntax_error_position(expression, position):
+    with pytest.raises(RuleSyntaxError) as error:
+        Rule.parse_expression(expression)
+    assert error.value.position == position
+    assert error.value.expression == expression
@@ -0,0 +1,155 @@
+import random
+
+from utils import constants
+from utils.rule import Rule, SHARED_RULE_PREFIX
+from utils.rule_store import COLUMNS, RuleStore, diff_rules, split_shared
+
+CODES = ["97126", "97350", "97838", "80118", "97028", "97029"]
+
+def table_of(expression, name="1001", **options):
+    rule = Rule.parse_expression(expression).optimize()
+    rule.name = name
+    return rule.get_table("Eligibility", **options)
+
+def random_expression(rng, depth=0):
+    if depth > 2 or rng.random() < 0.3:
+        return ("NOT " if rng.random() < 0.3 else "") + rng.choice(CODES)
+    operator = rng.choice([" AND ", " OR "])
+    return "(" + operator.join(random_expression(rng, depth + 1) for _ in range(rng.randint(2, 3))) + ")"
+
+def apply(stored_rows, upserts, deletes):
+    rows = { row["RuleName"]: row for row in stored_rows if row["RuleName"] not in set(deletes) }
+    rows.update((row["RuleName"], row) for row in upserts)
+    return list(rows.values())
+
+def shape(rows, name):
+    # the tree without its names: content and unordered children
+    row = next(row for row in rows if row["RuleName"] == name)
+    children = sorted(shape(rows, child["RuleName"]) for child in rows if child["RuleNameFK"] == name)
+    return repr((row["Operator"], row["Expression"], children))
+
+def test_unchanged_tree_keeps_its_rows():
+    stored = table_of("(97126 OR 97350) AND NOT 97838", deterministic=False)
+    # random names: only the content can match the rows
+    upserts, deletes = diff_rules("1001", stored, table_of("(97126 OR 97350) AND NOT 97838", deterministic=False))
+    assert upserts == [] and deletes == []
+
+def test_changed_leaf_replaces_only_that_leaf():
+    stored = table_of("(97126 OR 97350) AND NOT 97838", deterministic=False)
+    upserts, deletes = diff_rules("1001", stored, table_of("(97126 OR 80118) AND NOT 97838", deterministic=False))
+
+    assert [row["Expression"] for row in upserts] == ['input1.Contains("80118")']
+    assert deletes == [next(row["RuleName"] for row in stored if row["Expression"] == 'input1.Contains("97350")')]
+    # the new leaf hangs from the stored parent
+    assert upserts[0]["RuleNameFK"] in { row["RuleName"] for row in stored }
+
+def test_renames_are_stable():
+    rng = random.Random(11)
+    stored = table_of(random_expression(rng), deterministic=False)
+    for _ in range(40):
+        expression = random_expression(rng)
+        new_rows = table_of(expression, deterministic=False)
+        upserts, deletes = diff_rules("1001", stored, new_rows)
+
+        assert not { row["RuleName"] for row in upserts } & set(deletes)
+        stored = apply(stored, upserts, deletes)
+        assert shape(stored, "1001") == shape(new_rows, "1001")
+        # every parent of the stored tree still exists
+        names = { row["RuleName"] for row in stored }
+        assert all(row["RuleNameFK"] is None or row["RuleNameFK"] in names for row in stored)
+
+        # written again with other names, nothing changes
+        assert diff_rules("1001", stored, table_of(expression, deterministic=False)) == ([], [])
+
+def test_split_shared():
+    table = table_of("(97126 OR 97350 OR 97838) AND (80118 OR (97126 OR 97350 OR 97838))", shared=True, min_shared_size=4)
+    tree_rows, shared_rows = split_shared("1001", table)
+
+    assert all(row["RuleName"].startswith(SHARED_RULE_PREFIX) or row["RuleNameFK"] is not None for row in shared_rows)
+    assert not any(row["RuleName"].startswith(SHARED_RULE_PREFIX) for row in tree_rows)
+    assert len(tree_rows) + len(shared_rows) == len(table)
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.fast_executemany = False
+        self.rowcount = 0
+
+    def execute(self, command, *parameters):
+        self.connection.commands.append((command, parameters))
+        if command == constants.LOAD_RULES_TREES_COMMAND_TEXT:
+            return iter(self.connection.stored)
+        return self
+
+    def executemany(self, command, parameters):
+        self.connection.commands.append((command, list(parameters)))
+
+    def fetchval(self):
+        return 0
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    def __init__(self, stored=None):
+        # rows of LOAD_RULES_TREES: the root name, then the Rules columns
+        self.stored = [(root_name,) + tuple(row[column] for column in COLUMNS) for root_name, rows in (stored or {}).items() for row in rows]
+        self.commands = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def texts(self):
+        return [command for command, _ in self.commands]
+
+def test_write_statement_order():
+    old_table = table_of("(97126 OR 97350 OR 97838) AND 80118", shared=True, min_shared_size=4)
+    connection = FakeConnection({ "1001": split_shared("1001", old_table)[0] })
+    result = RuleStore(connection).write({ 1001: table_of("(97126 OR 97350 OR 97838) AND 97029", shared=True, min_shared_size=4) }, "Eligibility")
+
+    assert connection.texts() == [
+        constants.GET_RULES_LOCK_COMMAND_TEXT,
+        constants.CREATE_RULES_ROOTS_COMMAND_TEXT,
+        constants.INSERT_RULES_ROOTS_COMMAND_TEXT,
+        constants.LOAD_RULES_TREES_COMMAND_TEXT,
+        constants.DROP_RULES_ROOTS_COMMAND_TEXT,
+        constants.MERGE_WORKFLOW_COMMAND_TEXT,
+        constants.CREATE_RULES_STAGE_COMMAND_TEXT,
+        constants.INSERT_RULES_STAGE_COMMAND_TEXT,
+        constants.INSERT_MISSING_RULES_STAGE_COMMAND_TEXT,
+        constants.DROP_RULES_STAGE_COMMAND_TEXT,
+        constants.CREATE_RULES_STAGE_COMMAND_TEXT,
+        constants.INSERT_RULES_STAGE_COMMAND_TEXT,
+        constants.MERGE_RULES_STAGE_COMMAND_TEXT,
+        constants.DROP_RULES_STAGE_COMMAND_TEXT,
+        constants.CREATE_RULES_DELETE_COMMAND_TEXT,
+        constants.INSERT_RULES_DELETE_COMMAND_TEXT,
+        constants.DELETE_RULES_COMMAND_TEXT,
+        constants.DROP_RULES_DELETE_COMMAND_TEXT
+    ]
+    assert connection.commands[0][1][1] == constants.RULES_LOCK_SHARED
+    assert result == { "upserted": 1, "deleted": 1, "unchanged": 2, "shared": 4 }
+
+def test_shared_rows_are_inserted_before_referencing_rows():
+    connection = FakeConnection()
+    RuleStore(connection).write({ "1001": table_of("(97126 OR 97350 OR 97838) AND 80118", shared=True, min_shared_size=4) }, "Eligibility")
+
+    staged = [rows for command, rows in connection.commands if command == constants.INSERT_RULES_STAGE_COMMAND_TEXT]
+    shared_names = { row[0] for row in staged[0] }
+    references = [row for row in staged[1] if row[7] and "Ref" in row[7]]
+    assert references and all(SHARED_RULE_PREFIX + row[7].split(SHARED_RULE_PREFIX)[1].split('"')[0] in shared_names for row in references)
+
+    texts = connection.texts()
+    assert texts.index(constants.INSERT_MISSING_RULES_STAGE_COMMAND_TEXT) < texts.index(constants.MERGE_RULES_STAGE_COMMAND_TEXT)
+
+def test_deleted_product_removes_only_unshared_rows():
+    tree_rows = split_shared("1001", table_of("(97126 OR 97350 OR 97838) AND 80118", shared=True, min_shared_size=4))[0]
+    connection = FakeConnection({ "1001": tree_rows })
+    result = RuleStore(connection).write({ "1001": None }, "Eligibility")
+
+    deleted = next(rows for command, rows in connection.commands if command == constants.INSERT_RULES_DELETE_COMMAND_TEXT)
+    assert sorted(name for name, in deleted) == sorted(row["RuleName"] for row in tree_rows)
+    assert not any(name.startswith(SHARED_RULE_PREFIX) for name, in deleted)
+    assert constants.MERGE_RULES_STAGE_COMMAND_TEXT not in connection.texts()
+    assert constants.INSERT_MISSING_RULES_STAGE_COMMAND_TEXT not in connection.texts()
+    assert result == { "upserted": 0, "deleted": len(tree_rows), "unchanged": 0, "shared": 0 }
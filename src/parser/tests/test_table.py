@@ -0,0 +1,46 @@
+import importlib.util, os
+
+import pytest
+
+from utils.rule import Rule
+
+from expressions import EXPRESSIONS, codes_of, truth_table
+
+# the tables are read back with the reader of the backend, which evaluates them (src/backend/common/rule_tree.py)
+spec = importlib.util.spec_from_file_location("backend_rule_tree", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "backend", "common", "rule_tree.py"))
+rule_tree = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(rule_tree)
+
+@pytest.mark.parametrize("expression", EXPRESSIONS)
+def test_table_round_trip(expression):
+    rule = Rule.parse_expression(expression)
+    rule.name = "1"
+    codes = codes_of(expression)
+    expected = truth_table(rule, codes)
+
+    for shared in (False, True):
+        table = rule.optimize().get_table("Eligibility", shared=shared, min_shared_size=2)
+        assert sum(1 for row in table if row["RuleNameFK"] is None and not row["Properties"]) == 1
+        roots = rule_tree.rules_from_table(table)
+        assert list(roots) == ["1"]
+        assert truth_table(roots["1"], codes) == expected
+
+def test_table_is_deterministic():
+    expression = EXPRESSIONS[5]
+    first = Rule.parse_expression(expression)
+    second = Rule.parse_expression(expression)
+    first.name = second.name = "1"
+    assert first.get_table("Eligibility") == second.get_table("Eligibility")
+
+def test_shared_subtrees_are_stored_once():
+    rule = Rule.parse_expression("((1 OR 2 OR 3) AND 4) OR ((1 OR 2 OR 3) AND 5)")
+    rule.name = "1"
+    table = rule.optimize().get_table("Eligibility", shared=True, min_shared_size=3)
+    names = [row["RuleName"] for row in table]
+    assert len(names) == len(set(names))
+    # the (1 OR 2 OR 3) subtree is stored once and referenced from both AND groups (themselves shared rules)
+    shared_or = [row for row in table if row["Properties"] and "Shared" in row["Properties"] and row["Operator"] == "Or"]
+    assert len(shared_or) == 1
+    references = [row for row in table if row["Properties"] and shared_or[0]["RuleName"] in row["Properties"]]
+    assert len(references) == 2
+    assert truth_table(rule_tree.rules_from_table(table)["1"], ["1", "2", "3", "4", "5"]) == truth_table(rule, ["1", "2", "3", "4", "5"])
@@ -0,0 +1,63 @@
+from utils import constants
+from utils.translation_cache import SqliteTranslationStore, TranslationCache
+
+class FailingStore:
+    def get(self, key):
+        raise ConnectionError("store down")
+
+    def put(self, key, translation, created_at):
+        raise ConnectionError("store down")
+
+def test_key_depends_on_inputs_template_and_namespace():
+    cache = TranslationCache(namespace="gpt-4o|2024-02-01")
+    key = cache.key({ "expression": "1 AND 2" }, constants.TRANSLATE_TEMPLATE)
+
+    assert key == TranslationCache(namespace="gpt-4o|2024-02-01").key({ "expression": "1 AND 2" }, constants.TRANSLATE_TEMPLATE)
+    assert key != cache.key({ "expression": "1 OR 2" }, constants.TRANSLATE_TEMPLATE)
+    assert key != cache.key({ "expression": "1 AND 2" }, constants.TRANSLATE_BATCH_TEMPLATE)
+    assert key != TranslationCache(namespace="gpt-4o|2024-06-01").key({ "expression": "1 AND 2" }, constants.TRANSLATE_TEMPLATE)
+
+def test_lru_evicts_the_least_recently_used_entry():
+    cache = TranslationCache(maxsize=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A" # a is now more recent than b
+    cache.put("c", "C")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+    stats = cache.stats()
+    assert stats["size"] == 2 and stats["lru_hits"] == 3 and stats["misses"] == 1
+
+def test_store_round_trip():
+    store = SqliteTranslationStore()
+    TranslationCache(store, maxsize=1).put("a", "A")
+
+    # a new worker finds the translation in the store and keeps it in its LRU
+    cache = TranslationCache(store, maxsize=1)
+    assert cache.get("a") == "A"
+    assert cache.get("a") == "A"
+    stats = cache.stats()
+    assert stats["store_hits"] == 1 and stats["lru_hits"] == 1
+    assert store.get("a")[0] == "A"
+
+def test_evicted_entries_are_read_back_from_the_store():
+    cache = TranslationCache(SqliteTranslationStore(), maxsize=1)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    assert cache.stats()["store_hits"] == 1
+
+def test_expired_entries_are_misses():
+    store = SqliteTranslationStore()
+    store.put("a", "A", 0)
+    cache = TranslationCache(store, ttl=60)
+    assert cache.get("a") is None
+    assert cache.stats()["expired"] == 1
+
+def test_store_failures_only_lose_the_persistence():
+    cache = TranslationCache(FailingStore())
+    cache.put("a", "A")
+    assert cache.get("a") == "A"
+    assert cache.get("b") is None
+    assert cache.stats()["errors"] == 2
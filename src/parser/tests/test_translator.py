@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+# the translator module builds langchain chains over httpx
+pytest.importorskip("httpx")
+pytest.importorskip("langchain_openai")
+
+from utils.translator import Translator, parse_batch_translations
+
+class FakeChain:
+    def __init__(self, output):
+        self.output = output
+        self.calls = []
+
+    def invoke(self, inputs):
+        self.calls.append(inputs)
+        if isinstance(self.output, Exception):
+            raise self.output
+        return self.output
+
+def answer(*entries):
+    return json.dumps({ "translations": [{ "id": id, "translation": translation } for id, translation in entries] })
+
+def test_valid_answer():
+    assert parse_batch_translations(answer(("1", "one"), ("2", "two")), [1, 2]) == { 1: "one", 2: "two" }
+
+@pytest.mark.parametrize("output", ["", "not json", '{"translations": ', "[]", '{"items": []}', '{"translations": {}}'])
+def test_malformed_answers_raise(output):
+    with pytest.raises(ValueError):
+        parse_batch_translations(output, [1])
+
+def test_missing_unknown_and_invalid_entries_are_dropped():
+    output = json.dumps({ "translations": [
+        { "id": "1", "translation": "one" },
+        { "id": "9", "translation": "unknown id" },
+        { "id": "2", "translation": "   " },
+        { "id": "3" },
+        "not an entry",
+    ] })
+    assert parse_batch_translations(output, [1, 2, 3, 4]) == { 1: "one" }
+
+def test_duplicate_ids_are_dropped():
+    assert parse_batch_translations(answer(("1", "one"), ("1", "uno"), ("2", "two")), [1, 2]) == { 2: "two" }
+
+def batch_translator(output):
+    translator = Translator("https://example.openai.azure.com", "deployment", "2024-02-01")
+    translator._chain = FakeChain("single")
+    translator._batch_chain = FakeChain(output)
+    return translator
+
+def test_missing_items_fall_back_to_single_translations():
+    translator = batch_translator(answer(("1", "one")))
+    items = { 1: { "expression": "97126" }, 2: { "expression": "97350" } }
+    assert translator.translate_batch(items) == ({ 1: "one", 2: "single" }, { 2 })
+    assert translator._chain.calls == [items[2]]
+
+def test_failed_batch_falls_back_for_every_item():
+    translator = batch_translator("not json")
+    items = { 1: { "expression": "97126" }, 2: { "expression": "97350" } }
+    assert translator.translate_batch(items) == ({ 1: "single", 2: "single" }, { 1, 2 })
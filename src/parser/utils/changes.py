@@ -0,0 +1,45 @@
+import logging
+
+from . import constants
+
+def latest_changes(changes):
+    """
+    Keep only the last change of each product id in a batch of SQL trigger changes.
+
+    Parameters:
+    changes: a list of changes, each one a dictionary with "Operation" and "Item" keys
+
+    Returns:
+    A dictionary of the last change of each id, in the order of those last changes
+    """
+    latest = {}
+    for change in changes:
+        id = change["Item"]["id"]
+        latest.pop(id, None) # re-insert so the dictionary keeps the order of the last change
+        latest[id] = change
+    return latest
+
+def collapse_changes(changes):
+    """
+    Split a batch of SQL trigger changes into upserts and deletes, keeping only the last change of each product id.
+
+    Returns:
+    A tuple with the list of items to upsert and the list of ids to delete
+    """
+    upserts = []
+    deletes = []
+    for id, change in latest_changes(changes).items():
+        if (change["Operation"] == constants.SQL_INSERT) or (change["Operation"] == constants.SQL_UPDATE):
+            upserts.append(change["Item"])
+        elif change["Operation"] == constants.SQL_DELETE:
+            deletes.append(id)
+        else:
+            logging.warning("collapse_changes received an unsupported change type")
+
+    return upserts, deletes
+
+def join_ids(ids):
+    """
+    Join ids into a single SQL binding parameter; binding parameters cannot contain commas, hence the separator
+    """
+    return constants.ID_SEPARATOR.join(str(id) for id in ids)
@@ -1,26 +1,115 @@
+import json
+
 SQL_INSERT = 0
 SQL_UPDATE = 1
 SQL_DELETE = 2
 
-GET_MAPS_TYPE_1_COMMAND_TEXT = "SELECT [Code], [Mapping_ID], [Short_Descr], [Long_Descr] FROM [dbo].[fieldMapping] WHERE [Mapping_ID] LIKE 'Affiliate' ORDER BY LEN([Code]) DESC"
-GET_MAPS_TYPE_2_COMMAND_TEXT = "SELECT [Code], [Mapping_ID], [Short_Descr], [Long_Descr] FROM [dbo].[fieldMapping] WHERE [Mapping_ID] LIKE 'LOB' ORDER BY LEN([Code]) DESC"
-GET_MAPS_TYPE_3_COMMAND_TEXT = "SELECT [Code], [Mapping_ID], [Short_Descr], [Long_Descr] FROM [dbo].[fieldMapping] WHERE [Mapping_ID] LIKE 'CustomField' ORDER BY LEN([Code]) DESC"
+ORCHESTRATION_MODE_SERIAL = "serial"
+ORCHESTRATION_MODE_BATCH = "batch"
+DEFAULT_TRANSLATION_CONCURRENCY = 8
+DEFAULT_TRANSLATION_BATCH_SIZE = 1
+DEFAULT_DEBOUNCE_SECONDS = 0
+DEFAULT_TRANSLATION_CACHE_SIZE = 1024
+DEFAULT_OPENAI_MAX_CONNECTIONS = 16
+DEFAULT_OPENAI_MAX_CONCURRENCY = 8
+DEFAULT_OPENAI_MAX_RETRIES = 6
+DEFAULT_MIN_SHARED_RULE_SIZE = 3
+DEFAULT_PARSE_CACHE_SIZE = 4096
+
+TRANSLATION_CACHE_SQL = "sql"
+TRANSLATION_CACHE_SQLITE = "sqlite"
+TRANSLATION_CACHE_MEMORY = "memory"
+TRANSLATION_CACHE_NONE = "none"
+
+DEBOUNCE_INSTANCE_PREFIX = "product-"
+DEBOUNCE_EVENT_NAME = "ProductChanged"
+
+ID_SEPARATOR = "|"
+
+MAPPING_IDS = ["Affiliate", "LOB", "CustomField"]
+
+GET_MAPS_VERSION_COMMAND_TEXT = "SELECT [Version] FROM [dbo].[fieldMappingVersion] WHERE [Id] = 1"
+GET_MAPS_COMMAND_TEXT = "SELECT [Code], [Mapping_ID], [Short_Descr], [Long_Descr] FROM [dbo].[fieldMapping] WHERE [Mapping_ID] IN ('Affiliate', 'LOB', 'CustomField') ORDER BY LEN([Code]) DESC"
+GET_TRANSLATION_CACHE_COMMAND_TEXT = "SELECT [Translation], DATEDIFF_BIG(second, '1970-01-01', [CreatedAt]) FROM [dbo].[translationCache] WHERE [CacheKey] = ?"
+PUT_TRANSLATION_CACHE_COMMAND_TEXT = "MERGE [dbo].[translationCache] WITH (HOLDLOCK) AS t USING (SELECT ? AS [CacheKey], ? AS [Translation], DATEADD(second, ?, '1970-01-01') AS [CreatedAt]) AS s ON t.[CacheKey] = s.[CacheKey] WHEN MATCHED THEN UPDATE SET t.[Translation] = s.[Translation], t.[CreatedAt] = s.[CreatedAt] WHEN NOT MATCHED THEN INSERT ([CacheKey], [Translation], [CreatedAt]) VALUES (s.[CacheKey], s.[Translation], s.[CreatedAt]);"
+
 PROCESS_DELETE_COMMAND_TEXT = "DELETE FROM [dbo].[enhancedProductMapping] WHERE [id] = @id"
+PROCESS_DELETE_BATCH_COMMAND_TEXT = "DELETE FROM [dbo].[enhancedProductMapping] WHERE [id] IN (SELECT CAST([value] AS bigint) FROM STRING_SPLIT(@ids, '|'))"
+
+# offline backfill, see backfill.py
+DEFAULT_BACKFILL_BATCH_SIZE = 500
+ENHANCED_PRODUCT_MAPPING_COLUMNS = ["name", "id", "state", "value", "enhanced_value", "translated_value", "cat1_codes", "cat2_codes", "cat3_codes"]
+READ_PRODUCT_MAPPING_COMMAND_TEXT = "SELECT [name], [id], [state], [value] FROM [dbo].[productMapping] WHERE [id] > ? ORDER BY [id]"
+CREATE_ENHANCED_STAGE_COMMAND_TEXT = "CREATE TABLE #EnhancedStage ([name] nvarchar(150) NULL, [id] bigint NOT NULL PRIMARY KEY, [state] nvarchar(50) NOT NULL, [value] nvarchar(950) NOT NULL, [enhanced_value] nvarchar(max) NULL, [translated_value] nvarchar(max) NULL, [cat1_codes] nvarchar(max) NULL, [cat2_codes] nvarchar(max) NULL, [cat3_codes] nvarchar(max) NULL)"
+INSERT_ENHANCED_STAGE_COMMAND_TEXT = "INSERT INTO #EnhancedStage ([name], [id], [state], [value], [enhanced_value], [translated_value], [cat1_codes], [cat2_codes], [cat3_codes]) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+MERGE_ENHANCED_STAGE_COMMAND_TEXT = "MERGE [dbo].[enhancedProductMapping] AS t USING #EnhancedStage AS s ON t.[id] = s.[id] WHEN MATCHED THEN UPDATE SET t.[name] = s.[name], t.[state] = s.[state], t.[value] = s.[value], t.[enhanced_value] = s.[enhanced_value], t.[translated_value] = s.[translated_value], t.[cat1_codes] = s.[cat1_codes], t.[cat2_codes] = s.[cat2_codes], t.[cat3_codes] = s.[cat3_codes] WHEN NOT MATCHED THEN INSERT ([name], [id], [state], [value], [enhanced_value], [translated_value], [cat1_codes], [cat2_codes], [cat3_codes]) VALUES (s.[name], s.[id], s.[state], s.[value], s.[enhanced_value], s.[translated_value], s.[cat1_codes], s.[cat2_codes], s.[cat3_codes]);"
+MERGE_ENHANCED_STAGE_KEEP_TRANSLATION_COMMAND_TEXT = "MERGE [dbo].[enhancedProductMapping] AS t USING #EnhancedStage AS s ON t.[id] = s.[id] WHEN MATCHED THEN UPDATE SET t.[name] = s.[name], t.[state] = s.[state], t.[value] = s.[value], t.[enhanced_value] = s.[enhanced_value], t.[cat1_codes] = s.[cat1_codes], t.[cat2_codes] = s.[cat2_codes], t.[cat3_codes] = s.[cat3_codes] WHEN NOT MATCHED THEN INSERT ([name], [id], [state], [value], [enhanced_value], [translated_value], [cat1_codes], [cat2_codes], [cat3_codes]) VALUES (s.[name], s.[id], s.[state], s.[value], s.[enhanced_value], s.[translated_value], s.[cat1_codes], s.[cat2_codes], s.[cat3_codes]);"
+DROP_ENHANCED_STAGE_COMMAND_TEXT = "DROP TABLE #EnhancedStage"
+READ_PRODUCT_MAPPING_IDS_COMMAND_TEXT = "SELECT [id] FROM [dbo].[productMapping]"
+DELETE_VANISHED_ENHANCED_COMMAND_TEXT = "DELETE e FROM [dbo].[enhancedProductMapping] e WHERE NOT EXISTS (SELECT 1 FROM [dbo].[productMapping] p WHERE p.[id] = e.[id])"
+READ_RULES_ROOT_NAMES_COMMAND_TEXT = "SELECT [RuleName] FROM [dbo].[Rules] WHERE [RuleNameFK] IS NULL AND [WorkflowName] = ? AND [RuleName] NOT LIKE 'shared-%'"
 
 CLEAN_RULES_DATA_COMMAND_TEXT = "WITH RecursiveDelete AS (SELECT [RuleName] FROM [dbo].[Rules] WHERE [RuleName] = @RuleName UNION ALL SELECT r.[RuleName] from [dbo].[Rules] r INNER JOIN RecursiveDelete rd ON r.[RuleNameFK] = rd.[RuleName]) DELETE FROM [dbo].[Rules] WHERE [RuleName] IN (SELECT [RuleName] FROM RecursiveDelete);"
 
+CREATE_RULES_ROOTS_COMMAND_TEXT = "CREATE TABLE #RulesRoots ([RuleName] nvarchar(450) NOT NULL PRIMARY KEY)"
+INSERT_RULES_ROOTS_COMMAND_TEXT = "INSERT INTO #RulesRoots ([RuleName]) VALUES (?)"
+DROP_RULES_ROOTS_COMMAND_TEXT = "DROP TABLE #RulesRoots"
+LOAD_RULES_TREES_COMMAND_TEXT = "WITH RuleTree AS (SELECT r.[RuleName], r.[RuleName] AS [RootName] FROM [dbo].[Rules] r INNER JOIN #RulesRoots rr ON r.[RuleName] = rr.[RuleName] UNION ALL SELECT c.[RuleName], t.[RootName] FROM [dbo].[Rules] c INNER JOIN RuleTree t ON c.[RuleNameFK] = t.[RuleName]) SELECT t.[RootName], r.[RuleName], r.[Operator], r.[Enabled], r.[RuleExpressionType], r.[Expression], r.[RuleNameFK], r.[WorkflowName], r.[Properties] FROM RuleTree t INNER JOIN [dbo].[Rules] r ON r.[RuleName] = t.[RuleName] OPTION (MAXRECURSION 0);"
+
+CREATE_RULES_STAGE_COMMAND_TEXT = "CREATE TABLE #RulesStage ([RuleName] nvarchar(450) NOT NULL PRIMARY KEY, [Operator] nvarchar(max) NULL, [Enabled] bit NOT NULL, [RuleExpressionType] int NOT NULL, [Expression] nvarchar(max) NULL, [RuleNameFK] nvarchar(450) NULL, [WorkflowName] nvarchar(450) NULL, [Properties] nvarchar(max) NULL)"
+INSERT_RULES_STAGE_COMMAND_TEXT = "INSERT INTO #RulesStage ([RuleName], [Operator], [Enabled], [RuleExpressionType], [Expression], [RuleNameFK], [WorkflowName], [Properties]) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+MERGE_RULES_STAGE_COMMAND_TEXT = "MERGE [dbo].[Rules] AS t USING #RulesStage AS s ON t.[RuleName] = s.[RuleName] WHEN MATCHED THEN UPDATE SET t.[Operator] = s.[Operator], t.[Enabled] = s.[Enabled], t.[RuleExpressionType] = s.[RuleExpressionType], t.[Expression] = s.[Expression], t.[RuleNameFK] = s.[RuleNameFK], t.[WorkflowName] = s.[WorkflowName], t.[Properties] = s.[Properties] WHEN NOT MATCHED THEN INSERT ([RuleName], [Operator], [Enabled], [RuleExpressionType], [Expression], [RuleNameFK], [WorkflowName], [Properties]) VALUES (s.[RuleName], s.[Operator], s.[Enabled], s.[RuleExpressionType], s.[Expression], s.[RuleNameFK], s.[WorkflowName], s.[Properties]);"
+INSERT_MISSING_RULES_STAGE_COMMAND_TEXT = "INSERT INTO [dbo].[Rules] ([RuleName], [Operator], [Enabled], [RuleExpressionType], [Expression], [RuleNameFK], [WorkflowName], [Properties]) SELECT s.[RuleName], s.[Operator], s.[Enabled], s.[RuleExpressionType], s.[Expression], s.[RuleNameFK], s.[WorkflowName], s.[Properties] FROM #RulesStage s WHERE NOT EXISTS (SELECT 1 FROM [dbo].[Rules] r WITH (UPDLOCK, HOLDLOCK) WHERE r.[RuleName] = s.[RuleName]);"
+DROP_RULES_STAGE_COMMAND_TEXT = "DROP TABLE #RulesStage"
+
+CREATE_RULES_DELETE_COMMAND_TEXT = "CREATE TABLE #RulesDelete ([RuleName] nvarchar(450) NOT NULL PRIMARY KEY)"
+INSERT_RULES_DELETE_COMMAND_TEXT = "INSERT INTO #RulesDelete ([RuleName]) VALUES (?)"
+DELETE_RULES_COMMAND_TEXT = "DELETE r FROM [dbo].[Rules] r INNER JOIN #RulesDelete d ON r.[RuleName] = d.[RuleName]"
+DROP_RULES_DELETE_COMMAND_TEXT = "DROP TABLE #RulesDelete"
+# writers of [dbo].[Rules] hold this application lock shared until they commit, collect_shared holds it exclusively,
+# so an unreferenced shared rule is never deleted while another transaction is linking to it (RCSI hides uncommitted references)
+RULES_LOCK_RESOURCE = "dbo.Rules"
+RULES_LOCK_SHARED = "Shared"
+RULES_LOCK_EXCLUSIVE = "Exclusive"
+GET_RULES_LOCK_COMMAND_TEXT = "SET NOCOUNT ON; IF @@TRANCOUNT = 0 BEGIN TRANSACTION; DECLARE @result int; EXEC @result = sp_getapplock @Resource = ?, @LockMode = ?, @LockOwner = 'Transaction', @LockTimeout = ?; SET NOCOUNT OFF; SELECT @result;"
+CLEAN_SHARED_RULES_COMMAND_TEXT = "WITH RecursiveDelete AS (SELECT s.[RuleName] FROM [dbo].[Rules] s WHERE s.[RuleName] LIKE 'shared-%' AND s.[RuleNameFK] IS NULL AND NOT EXISTS (SELECT 1 FROM [dbo].[Rules] r WHERE JSON_VALUE(r.[Properties], '$.Ref') = s.[RuleName]) UNION ALL SELECT r.[RuleName] from [dbo].[Rules] r INNER JOIN RecursiveDelete rd ON r.[RuleNameFK] = rd.[RuleName]) DELETE FROM [dbo].[Rules] WHERE [RuleName] IN (SELECT [RuleName] FROM RecursiveDelete) OPTION (MAXRECURSION 0);"
+
+MERGE_WORKFLOW_COMMAND_TEXT = "MERGE [dbo].[Workflows] AS t USING (SELECT ? AS [WorkflowName], ? AS [RuleExpressionType]) AS s ON t.[WorkflowName] = s.[WorkflowName] WHEN NOT MATCHED THEN INSERT ([WorkflowName], [RuleExpressionType]) VALUES (s.[WorkflowName], s.[RuleExpressionType]);"
+
+TRANSLATE_EXAMPLE_INPUT = """((("General Market" AND ("Internet Essentials " OR "Xfinity Home Only" OR "Choice & Internet (TV,Internet) at $70" OR "Choice & Internet (TV,Internet) at $80" OR "Choice TP (TV,Internet,Phone) at $90" OR "Select TP (TV,Internet,Phone) at Everyday Pricing" OR "Sig Plus More (TV, Internet, Phone) at $165" OR "Standard Plus More (TV, Internet, Phone) at Every Day Price" OR "Basic TV & Fast at $90")) OR (((97028 OR 97029 OR 97170 OR 97172) AND (NOT 97180)) AND ("Select Plus More (TV, Internet, Phone) at Every Day Price" OR "Sig Plus (TV & Internet) at Every Day Price" OR "Sig Plus More (TV, Internet, Phone) at $175" OR "Super Plus More (TV, Internet, Phone) at $185" OR "Basic TV & SuperFast at $90" OR "Basic TV & GIG at $90" OR "Basic TV & Gig Extra at $90")) OR ("Dot Com" AND ("Choice & Internet (TV,Internet) at $70" OR "Choice & Internet (TV,Internet) at $80" OR "Choice TP (TV,Internet,Phone) at $90" OR "Standard Plus More (TV, Internet, Phone) at Every Day Price" OR "Select Plus More (TV, Internet, Phone) at Every Day Price" OR "Select TP (TV,Internet,Phone) at Everyday Pricing"))) AND (NOT 82118) AND (NOT 103086))"""
+
+TRANSLATE_EXAMPLE_OUTPUT = """This offer is available through the General Market to Internet Essentials, Xfinity Home Only, Choice & Internet, Choice TP, Select TP, Sig Plus More, Standard Plus More and Basic TV & Fast customers.  It is also available through Dot Com to Choice & Internet, Choice TP, Standard Plus More, Select Plus More, and Select TP customers."""
+
 TRANSLATE_TEMPLATE = """
 You will receive logical expressions that describe customer eligibility criteria for select products. 
 Your mission is to translate these expressions into plain English.
 
 Example Input:
 
-((("General Market" AND ("Internet Essentials " OR "Xfinity Home Only" OR "Choice & Internet (TV,Internet) at $70" OR "Choice & Internet (TV,Internet) at $80" OR "Choice TP (TV,Internet,Phone) at $90" OR "Select TP (TV,Internet,Phone) at Everyday Pricing" OR "Sig Plus More (TV, Internet, Phone) at $165" OR "Standard Plus More (TV, Internet, Phone) at Every Day Price" OR "Basic TV & Fast at $90")) OR (((97028 OR 97029 OR 97170 OR 97172) AND (NOT 97180)) AND ("Select Plus More (TV, Internet, Phone) at Every Day Price" OR "Sig Plus (TV & Internet) at Every Day Price" OR "Sig Plus More (TV, Internet, Phone) at $175" OR "Super Plus More (TV, Internet, Phone) at $185" OR "Basic TV & SuperFast at $90" OR "Basic TV & GIG at $90" OR "Basic TV & Gig Extra at $90")) OR ("Dot Com" AND ("Choice & Internet (TV,Internet) at $70" OR "Choice & Internet (TV,Internet) at $80" OR "Choice TP (TV,Internet,Phone) at $90" OR "Standard Plus More (TV, Internet, Phone) at Every Day Price" OR "Select Plus More (TV, Internet, Phone) at Every Day Price" OR "Select TP (TV,Internet,Phone) at Everyday Pricing"))) AND (NOT 82118) AND (NOT 103086))
+""" + TRANSLATE_EXAMPLE_INPUT + """
 
 Example Output:
 
-This offer is available through the General Market to Internet Essentials, Xfinity Home Only, Choice & Internet, Choice TP, Select TP, Sig Plus More, Standard Plus More and Basic TV & Fast customers.  It is also available through Dot Com to Choice & Internet, Choice TP, Standard Plus More, Select Plus More, and Select TP customers.
+""" + TRANSLATE_EXAMPLE_OUTPUT + """
 
 User:
 {expression}
-"""
\ No newline at end of file
+"""
+
+# literal braces are doubled, the JSON examples are part of a PromptTemplate
+TRANSLATE_BATCH_TEMPLATE = """
+You will receive a JSON list of logical expressions that describe customer eligibility criteria for select products, each one with an id. 
+Your mission is to translate each of these expressions into plain English.
+Answer with a JSON object with a single "translations" key: a list with exactly one {{"id": ..., "translation": ...}} object per input id.
+
+Example Input:
+
+""" + json.dumps([{ "id": "1", "expression": TRANSLATE_EXAMPLE_INPUT }]).replace("{", "{{").replace("}", "}}") + """
+
+Example Output:
+
+""" + json.dumps({ "translations": [{ "id": "1", "translation": TRANSLATE_EXAMPLE_OUTPUT }] }).replace("{", "{{").replace("}", "}}") + """
+
+User:
+{items}
+"""
@@ -0,0 +1,30 @@
+import os
+import pyodbc
+from contextlib import contextmanager
+
+@contextmanager
+def connection(setting, autocommit=False):
+    """
+    Open a pyodbc connection using the ODBC connection string stored in the specified app setting.
+    The SQL bindings use ADO.NET connection strings, so direct connections need their own setting.
+    The transaction is committed when the block succeeds, rolled back otherwise, and the connection is always closed.
+    """
+    conn = pyodbc.connect(os.environ[setting], autocommit=autocommit)
+    try:
+        yield conn
+        if not autocommit:
+            conn.commit()
+    except Exception:
+        if not autocommit:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def connect(setting, autocommit=False):
+    """
+    Open a pyodbc connection using the ODBC connection string stored in the specified app setting, for callers that
+    keep it open across calls (see connection for a connection scoped to a block); the caller closes it
+    """
+    return pyodbc.connect(os.environ[setting], autocommit=autocommit)
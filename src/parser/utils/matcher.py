@@ -0,0 +1,137 @@
+BOUNDARY_CHARS = frozenset(" \t\r\n()\"")
+
+class CodeMatcher:
+    """
+    Aho-Corasick automaton over the codes of the field mapping tables.
+    Built once from the maps, it substitutes every code in an expression with its description in a single scan.
+
+    Matching follows the original replace loop: longer codes win over shorter ones and, when a code is listed
+    in more than one map, the first map wins. Codes only match whole tokens, so a code that is a substring of
+    another token (e.g. "9702" inside "97028") is never replaced.
+    """
+
+    def __init__(self, maps):
+        """
+        Parameters:
+        maps: a list of mapping tables, each one a list of rows with "Code", "Short_Descr" and "Long_Descr" keys
+        """
+        self.map_count = len(maps)
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+        self._patterns = []
+
+        for map_index, rows in enumerate(maps):
+            for row in rows:
+                self._add(map_index, row)
+
+        self._build_links()
+
+    def _add(self, map_index, row):
+        code = str(row["Code"])
+        if not code:
+            return
+
+        state = 0
+        for char in code:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+            state = next_state
+
+        if self._output[state] is not None:
+            return # first map (and first row) wins, as in the original replace loop
+
+        description = row["Long_Descr"] if row["Long_Descr"] else row["Short_Descr"]
+        self._output[state] = len(self._patterns)
+        self._patterns.append({
+            "map": map_index,
+            "length": len(code),
+            "replacement": "\"" + (description or "") + "\"",
+            "match": {
+                "Code": row["Code"],
+                "Short_Descr": row["Short_Descr"],
+                "Long_Descr": row["Long_Descr"]
+            }
+        })
+
+    def _build_links(self):
+        # dictionary suffix links: the closest state reachable through failure links that ends a pattern
+        self._dict_link = [0] * len(self._goto)
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail
+                self._dict_link[next_state] = fail if self._output[fail] is not None else self._dict_link[fail]
+                queue.append(next_state)
+
+    def find(self, expression):
+        """
+        Find the whole-token code occurrences in an expression.
+
+        Returns:
+        A list of (start, end, pattern_id) tuples, non overlapping and sorted by position
+        """
+        goto, fail, output, dict_link, patterns = self._goto, self._fail, self._output, self._dict_link, self._patterns
+        length = len(expression)
+        candidates = []
+
+        state = 0
+        for index, char in enumerate(expression):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            match_state = state if output[state] is not None else dict_link[state]
+            while match_state:
+                pattern_id = output[match_state]
+                start = index - patterns[pattern_id]["length"] + 1
+                if (start == 0 or expression[start - 1] in BOUNDARY_CHARS) and (index + 1 == length or expression[index + 1] in BOUNDARY_CHARS):
+                    candidates.append((start, index + 1, pattern_id))
+                match_state = dict_link[match_state]
+
+        if len(candidates) < 2:
+            return candidates
+
+        # longest code first, then leftmost, skipping anything that overlaps an accepted match
+        taken = bytearray(length)
+        matches = []
+        for start, end, pattern_id in sorted(candidates, key=lambda c: (c[0] - c[1], c[0])):
+            if not any(taken[start:end]):
+                taken[start:end] = b"\x01" * (end - start)
+                matches.append((start, end, pattern_id))
+
+        matches.sort()
+        return matches
+
+    def substitute(self, expression):
+        """
+        Replace every code in the expression with its (quoted) description.
+
+        Returns:
+        A tuple with the enhanced expression and, for each map, the list of codes that were replaced
+        """
+        patterns = self._patterns
+        parts = []
+        found = set()
+        position = 0
+        for start, end, pattern_id in self.find(expression):
+            parts.append(expression[position:start])
+            parts.append(patterns[pattern_id]["replacement"])
+            found.add(pattern_id)
+            position = end
+        parts.append(expression[position:])
+
+        matches = [[] for _ in range(self.map_count)]
+        for pattern_id in sorted(found):
+            matches[patterns[pattern_id]["map"]].append(patterns[pattern_id]["match"])
+
+        return "".join(parts), matches
@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+from .rule import Rule
+
+# frozen trees (see Rule.freeze) of an expression, as parsed and after Rule.optimize, with their node counts
+ParsedExpression = namedtuple("ParsedExpression", ["tree", "optimized", "nodes", "optimized_nodes"])
+
+class ParseCache:
+    """
+    Bounded LRU cache of parsed (and optimized) expressions.
+    Keys are the expression's token sequence, so expressions that only differ by the whitespace between tokens share an
+    entry (case is significant: lowercase and/or are codes, and quoted descriptions are compared as written). Entries
+    are immutable; Rule.thaw turns them into new Rule trees, free to be renamed.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = { "hits": 0, "misses": 0, "evictions": 0 }
+
+    def get(self, expression):
+        """
+        Return the ParsedExpression of an expression, parsing and optimizing it on a miss
+
+        Raises:
+        RuleSyntaxError: see Rule.iter_parse; invalid expressions are not cached
+        """
+        # the tokenizer only splits on spaces, a token may start with the tab or newline before it
+        key = tuple(token.strip() for token, _ in Rule.tokenize(expression))
+        with self._lock:
+            parsed = self._lru.get(key)
+            if parsed is not None:
+                self._lru.move_to_end(key)
+                self._stats["hits"] += 1
+                return parsed
+
+        tree = Rule.parse_expression(expression)
+        optimized = tree.optimize()
+        parsed = ParsedExpression(tree.freeze(), optimized.freeze(), tree.stats()["nodes"], optimized.stats()["nodes"])
+        with self._lock:
+            self._stats["misses"] += 1
+            self._lru[key] = parsed
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+                self._stats["evictions"] += 1
+        return parsed
+
+    def parse(self, expression):
+        """
+        A new tree of the expression, as returned by Rule.parse_expression
+        """
+        return Rule.thaw(self.get(expression).tree)
+
+    def parse_optimized(self, expression):
+        """
+        A new tree of the expression, as returned by Rule.parse_expression(...).optimize()
+        """
+        return Rule.thaw(self.get(expression).optimized)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._lru)
+            stats["maxsize"] = self.maxsize
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
@@ -1,28 +1,193 @@
-import re, uuid
+import hashlib, json, re, uuid
+
+SHARED_RULE_PREFIX = "shared-"
+TOKEN_PATTERN = re.compile(r'"[^"]*"|NOT\s+(?:[0-9]+|"[^"]+")|\(|\)|AND|OR|\b[^ )(]+')
+PRECEDENCES = {"AND": 2, "OR": 1}
+UNQUOTED_WHITESPACE_PATTERN = re.compile(r'("[^"]*")|\s+')
+
+def normalize_leaf(value):
+    """
+    Collapse the runs of whitespace of a leaf value (e.g. between NOT and its operand) into single spaces, leaving quoted
+    codes and descriptions untouched
+    """
+    return UNQUOTED_WHITESPACE_PATTERN.sub(lambda match: match.group(1) or " ", value.strip())
 
 class Rule:
-    def __init__(self, name=None, value=None, left=None, right=None, enabled = True, expression_type = 0):
+    __slots__ = ("name", "value", "left", "right", "enabled", "expression_type", "rules")
+
+    def __init__(self, name=None, value=None, left=None, right=None, enabled = True, expression_type = 0, rules = None):
         self.name = name
         self.value = value
         self.left = left
         self.right = right
         self.enabled = enabled
         self.expression_type = expression_type
+        self.rules = rules # n-ary operands, see optimize; takes precedence over left/right
 
     def __is_operator__(self, val):
         if val and val.upper() in ["AND", "OR"]:
             return True
         else:
             return False
-        
-    def get_table(self, workflow_name = "Eligibilty"):
-        table = []
 
-        def traverse(node, parent_name):
+    def children(self):
+        if self.rules is not None:
+            return self.rules
+        return [child for child in (self.left, self.right) if child is not None]
+
+    def optimize(self):
+        """
+        Return a canonical, n-ary copy of the tree:
+        associative AND/OR chains are flattened into a single node, operands are sorted (leaves first) and deduplicated,
+        and groups left with a single operand are replaced by that operand. Leaf values are whitespace-normalized outside
+        quotes (see normalize_leaf).
+        The root keeps its name; the original tree is not modified.
+        """
+        optimized = {}
+        hashes = {}
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if not expanded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children())
+                continue
+
+            if not node.__is_operator__(node.value):
+                value = normalize_leaf(node.value)
+                new = Rule(value=value, enabled=node.enabled, expression_type=node.expression_type)
+                hashes[id(new)] = hashlib.sha1(("'" + value + "'").encode("utf-8")).hexdigest()
+            else:
+                operator = node.value.upper()
+                operands = []
+                for child in node.children():
+                    child = optimized[id(child)]
+                    if child.__is_operator__(child.value) and child.value.upper() == operator:
+                        operands.extend(child.children())
+                    else:
+                        operands.append(child)
+
+                unique = {}
+                for operand in operands:
+                    unique.setdefault(hashes[id(operand)], operand)
+                operands = sorted(unique.values(), key=lambda operand: (1, hashes[id(operand)]) if operand.__is_operator__(operand.value) else (0, operand.value))
+
+                if len(operands) == 1:
+                    new = operands[0]
+                else:
+                    new = Rule(value=operator, enabled=node.enabled, expression_type=node.expression_type, rules=operands)
+                    key = operator + "(" + ",".join(sorted(hashes[id(operand)] for operand in operands)) + ")"
+                    hashes[id(new)] = hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+            optimized[id(node)] = new
+
+        root = optimized[id(self)]
+        root.name = self.name
+        return root
+
+    def stats(self):
+        """
+        Node, leaf and depth counts of the tree
+        """
+        nodes = 0
+        leaves = 0
+        depth = 0
+        stack = [(self, 1)]
+        while stack:
+            node, level = stack.pop()
+            children = node.children()
+            nodes += 1
+            leaves += 0 if children else 1
+            depth = max(depth, level)
+            stack.extend((child, level + 1) for child in children)
+        return { "nodes": nodes, "leaves": leaves, "depth": depth }
+
+    def structural_hash(self):
+        """
+        Canonical hash of the subtree: operands are unordered and leaf values are whitespace-normalized outside quotes,
+        so two subtrees with the same hash evaluate the same way.
+        """
+        return self.__subtree_info__()[0][id(self)]
+
+    def __subtree_info__(self):
+        # iterative post-order, returns the hash and node count of every subtree by node id
+        hashes = {}
+        sizes = {}
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            children = node.children()
+            if expanded:
+                if node.__is_operator__(node.value):
+                    key = node.value.upper() + "(" + ",".join(sorted(hashes[id(child)] for child in children)) + ")"
+                else:
+                    key = "'" + normalize_leaf(node.value) + "'"
+                hashes[id(node)] = hashlib.sha1(key.encode("utf-8")).hexdigest()
+                sizes[id(node)] = 1 + sum(sizes[id(child)] for child in children)
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in children)
+        return hashes, sizes
+
+    def get_table(self, workflow_name = "Eligibilty", deterministic = True, shared = False, min_shared_size = 3):
+        """
+        Flatten the tree into rows of the rules engine Rules table (see iter_table).
+
+        Parameters:
+        workflow_name: the workflow the rules belong to
+        deterministic: name non-root nodes after their parent and the structural hash of their subtree instead of a random uuid,
+            so rebuilding an unchanged expression produces the same rows
+        shared: store operator subtrees of at least min_shared_size nodes once, as "shared-<hash>" rules without parent,
+            and reference them from their position with a row whose Properties are {"Ref": "shared-<hash>"}
+        """
+        return list(self.iter_table(workflow_name, deterministic, shared, min_shared_size))
+
+    def iter_table(self, workflow_name = "Eligibilty", deterministic = True, shared = False, min_shared_size = 3):
+        """
+        Generate the rows of get_table one at a time, parents before their children, without recursion
+        """
+        hashes, sizes = self.__subtree_info__() if (deterministic or shared) else ({}, {})
+        emitted = set()
+
+        def child_names(node, parent_name):
+            names = []
+            seen = {}
+            for child in node.children():
+                if deterministic:
+                    occurrence = seen.get(hashes[id(child)], 0)
+                    seen[hashes[id(child)]] = occurrence + 1
+                    names.append(hashlib.sha1(f"{parent_name}|{hashes[id(child)]}|{occurrence}".encode("utf-8")).hexdigest()[:32])
+                else:
+                    names.append(str(uuid.uuid4()))
+            return names
+
+        def row(name, operator, expression, parent_name, properties = None, node = None):
+            return {
+                "RuleName": name,
+                "Operator": operator,
+                "Enabled": node.enabled if node else True,
+                "RuleExpressionType": node.expression_type if node else 0,
+                "Expression": expression,
+                "RuleNameFK": parent_name,
+                "WorkflowName": workflow_name,
+                "Properties": properties
+            }
+
+        stack = [(self, self.name if self.name else str(uuid.uuid4()), None, None)]
+        while stack:
+            node, name, parent_name, properties = stack.pop()
             if node is None:
-                return
-            
-            node.name = node.name if node.name else str(uuid.uuid4())
+                continue
+
+            if shared and parent_name is not None and properties is None and node.__is_operator__(node.value) and sizes[id(node)] >= min_shared_size:
+                shared_name = SHARED_RULE_PREFIX + hashes[id(node)][:32]
+                yield row(name, None, None, parent_name, json.dumps({ "Ref": shared_name }))
+                if shared_name not in emitted:
+                    emitted.add(shared_name)
+                    stack.append((node, shared_name, None, json.dumps({ "Shared": True })))
+                continue
+
+            node.name = name
             if (node.__is_operator__(node.value)):
                 expression = None
                 operator = "And" if node.value.upper() == "AND" else "Or"
@@ -33,63 +198,137 @@ class Rule:
                     expression = f'input1.Contains("{node.value.strip()}")'
                 operator = None
 
-            row = {
-                "RuleName": node.name,
-                "Operator": operator,
-                "Enabled": node.enabled,
-                "RuleExpressionType": node.expression_type,
-                "Expression": expression,
-                "RuleNameFK": parent_name,
-                "WorkflowName": workflow_name
-            }
+            yield row(node.name, operator, expression, parent_name, properties, node)
+            children = list(zip(node.children(), child_names(node, node.name)))
+            stack.extend((child, child_name, node.name, None) for child, child_name in reversed(children))
 
-            table.append(row)
-            traverse(node.left, node.name)
-            traverse(node.right, node.name)
+    def freeze(self):
+        """
+        Immutable copy of the tree as nested tuples: a leaf is its value, an operator is (value, operand, ...).
+        Names and flags are not kept; see thaw.
+        """
+        frozen = {}
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            children = node.children()
+            if not children:
+                frozen[id(node)] = node.value
+            elif expanded:
+                frozen[id(node)] = (node.value,) + tuple(frozen[id(child)] for child in children)
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in children)
+        return frozen[id(self)]
 
-        traverse(self, None)
-        return table
+    @staticmethod
+    def thaw(frozen):
+        """
+        Build a new tree from its frozen form (see freeze); operators with two operands get left/right, like parsed trees
+        """
+        built = []
+        stack = [(frozen, False)]
+        while stack:
+            item, expanded = stack.pop()
+            if not isinstance(item, tuple):
+                built.append(Rule(value=item))
+            elif expanded:
+                operands = built[len(built) - len(item) + 1:]
+                del built[len(built) - len(item) + 1:]
+                if len(operands) == 2:
+                    built.append(Rule(value=item[0], left=operands[0], right=operands[1]))
+                else:
+                    built.append(Rule(value=item[0], rules=operands))
+            else:
+                stack.append((item, True))
+                stack.extend((operand, False) for operand in reversed(item[1:]))
+        return built[0]
+
+    @staticmethod
+    def tokenize(expression):
+        """
+        Generate the (token, position) pairs of an expression
+        """
+        for match in TOKEN_PATTERN.finditer(expression):
+            yield match.group(0), match.start()
+
+    @staticmethod
+    def iter_parse(expression):
+        """
+        Parse an expression in a single pass (shunting-yard over the token stream, with explicit stacks), generating the
+        Rule nodes as they are built, children before their parent. The generator returns the root rule.
+        AND takes precedence over OR and both are left associative.
+
+        Raises:
+        RuleSyntaxError: on unbalanced parentheses, missing operands or missing operators (adjacent operands), with the
+        position of the offending token
+        """
+        operators = [] # (token, position)
+        operands = []
+        expect_operand = True # an operand or "(" must come next, an operator or ")" otherwise
+
+        def reduce(operator, position):
+            if len(operands) < 2:
+                raise RuleSyntaxError(f"Missing operand for {operator}", expression, position)
+            right = operands.pop()
+            left = operands.pop()
+            node = Rule(value=operator, left=left, right=right)
+            operands.append(node)
+            return node
+
+        for token, position in Rule.tokenize(expression):
+            if token in ["AND", "OR"]:
+                if expect_operand:
+                    raise RuleSyntaxError(f"Missing operand for {token}", expression, position)
+                expect_operand = True
+                while operators and operators[-1][0] != "(" and PRECEDENCES[operators[-1][0]] >= PRECEDENCES[token]:
+                    yield reduce(*operators.pop())
+                operators.append((token, position))
+            elif token == "(":
+                if not expect_operand:
+                    raise RuleSyntaxError("Missing operator before (", expression, position)
+                operators.append((token, position))
+            elif token == ")":
+                if expect_operand:
+                    raise RuleSyntaxError("Missing operand before )", expression, position)
+                while operators and operators[-1][0] != "(":
+                    yield reduce(*operators.pop())
+                if not operators:
+                    raise RuleSyntaxError("Unbalanced closing parenthesis", expression, position)
+                operators.pop()
+            else:
+                if not expect_operand:
+                    raise RuleSyntaxError(f"Missing operator before {token}", expression, position)
+                expect_operand = False
+                node = Rule(value=token)
+                operands.append(node)
+                yield node
+
+        while operators:
+            operator, position = operators.pop()
+            if operator == "(":
+                raise RuleSyntaxError("Unbalanced opening parenthesis", expression, position)
+            yield reduce(operator, position)
+
+        if not operands:
+            raise RuleSyntaxError("Empty expression", expression, 0)
+        return operands[0]
 
     @staticmethod
     def parse_expression(expression):
-        def tokenize(param):
-            return re.findall(r'"[^"]*"|NOT\s+(?:[0-9]+|"[^"]+")|\(|\)|AND|OR|\b[^ )(]+', param)
-        
-        def precedence(op):
-            precedences = {"AND": 2, "OR": 1} 
-            return precedences.get(op.upper(), 0)
-        
-        def to_postfix(tokens):
-            stack = []
-            postfix = []
-            for token in tokens:
-                if token in ["AND", "OR"]:
-                    while (stack and precedence(stack[-1]) >= precedence(token)):
-                        postfix.append(stack.pop())
-                    stack.append(token)
-                elif token == "(":
-                    stack.append(token)
-                elif token == ")":
-                    while stack and stack[-1] != "(":
-                        postfix.append(stack.pop())
-                    stack.pop()  # Pop '('
-                else:
-                    postfix.append(token)
-            while stack:
-                postfix.append(stack.pop())
-            return postfix
-        
-        def build_tree(postfix):
-            stack = []
-            for token in postfix:
-                if token in ["AND", "OR"]:
-                    right = stack.pop()
-                    left = stack.pop()
-                    stack.append(Rule(value=token, left=left, right=right))
-                else:
-                    stack.append(Rule(value=token))
-            return stack[0]
+        parser = Rule.iter_parse(expression)
+        while True:
+            try:
+                next(parser)
+            except StopIteration as stop:
+                return stop.value
+
+class RuleSyntaxError(ValueError):
+    """
+    An expression that cannot be parsed; position is the offset of the offending token in the expression
+    """
 
-        tokens = tokenize(expression)
-        postfix = to_postfix(tokens)
-        return build_tree(postfix)
+    def __init__(self, message, expression, position):
+        super().__init__(f"{message} at position {position}: {expression[max(0, position - 20):position + 20]!r}")
+        self.expression = expression
+        self.position = position
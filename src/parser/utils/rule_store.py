@@ -0,0 +1,248 @@
+import hashlib, logging
+from collections import defaultdict
+
+from . import constants
+
+COLUMNS = ["RuleName", "Operator", "Enabled", "RuleExpressionType", "Expression", "RuleNameFK", "WorkflowName", "Properties"]
+
+class RuleStore:
+    """
+    Set-based writer for the [dbo].[Rules] table.
+    New rule tables are diffed against the stored trees; only the rows that changed are merged and only the rows that
+    disappeared are deleted, all in the transaction of the connection it is given.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def lock(self, mode, timeout=-1):
+        """
+        Take the Rules application lock (see constants.GET_RULES_LOCK_COMMAND_TEXT) until the transaction ends
+
+        Parameters:
+        mode: constants.RULES_LOCK_SHARED for writers, constants.RULES_LOCK_EXCLUSIVE for collect_shared
+        timeout: the maximum wait in milliseconds, -1 waits as long as needed
+
+        Returns:
+        True if the lock was granted
+        """
+        cursor = self.connection.cursor()
+        result = cursor.execute(constants.GET_RULES_LOCK_COMMAND_TEXT, constants.RULES_LOCK_RESOURCE, mode, timeout).fetchval()
+        cursor.close()
+        return result >= 0
+
+    def load(self, root_names):
+        """
+        Load the stored rows of the specified root rules and all their descendants
+
+        Returns:
+        A dictionary of row lists by root name
+        """
+        cursor = self.connection.cursor()
+        cursor.fast_executemany = True
+        cursor.execute(constants.CREATE_RULES_ROOTS_COMMAND_TEXT)
+        cursor.executemany(constants.INSERT_RULES_ROOTS_COMMAND_TEXT, [(name,) for name in root_names])
+
+        stored = { name: [] for name in root_names }
+        for row in cursor.execute(constants.LOAD_RULES_TREES_COMMAND_TEXT):
+            stored[row[0]].append(dict(zip(COLUMNS, row[1:])))
+
+        cursor.execute(constants.DROP_RULES_ROOTS_COMMAND_TEXT)
+        cursor.close()
+        return stored
+
+    def write(self, tables, workflow_name):
+        """
+        Replace the stored trees of the specified root rules
+
+        Parameters:
+        tables: a dictionary of rule tables (see Rule.get_table) by root name; None deletes the root rule and its descendants
+        workflow_name: the workflow the rules belong to, created if it does not exist
+
+        Returns:
+        A dictionary with the number of upserted, deleted and unchanged rows, and of shared rules referenced
+        """
+        tables = { str(name): table for name, table in tables.items() }
+        self.lock(constants.RULES_LOCK_SHARED)
+        stored = self.load(list(tables.keys()))
+
+        upserts = []
+        deletes = []
+        shared = {}
+        unchanged = 0
+        for name, table in tables.items():
+            tree_rows, shared_rows = split_shared(name, table or [])
+            tree_upserts, tree_deletes = diff_rules(name, stored[name], tree_rows)
+            upserts.extend(tree_upserts)
+            deletes.extend(tree_deletes)
+            unchanged += len(tree_rows) - len(tree_upserts)
+            shared.update((row["RuleName"], row) for row in shared_rows)
+
+        cursor = self.connection.cursor()
+        cursor.fast_executemany = True
+
+        if upserts or shared:
+            cursor.execute(constants.MERGE_WORKFLOW_COMMAND_TEXT, workflow_name, 0)
+
+        if shared:
+            # shared rules are named after their content, existing ones are never rewritten; they are inserted
+            # before the rows referencing them
+            cursor.execute(constants.CREATE_RULES_STAGE_COMMAND_TEXT)
+            cursor.executemany(constants.INSERT_RULES_STAGE_COMMAND_TEXT, [tuple(row[column] for column in COLUMNS) for row in shared.values()])
+            cursor.execute(constants.INSERT_MISSING_RULES_STAGE_COMMAND_TEXT)
+            cursor.execute(constants.DROP_RULES_STAGE_COMMAND_TEXT)
+
+        if upserts:
+            cursor.execute(constants.CREATE_RULES_STAGE_COMMAND_TEXT)
+            cursor.executemany(constants.INSERT_RULES_STAGE_COMMAND_TEXT, [tuple(row[column] for column in COLUMNS) for row in upserts])
+            cursor.execute(constants.MERGE_RULES_STAGE_COMMAND_TEXT)
+            cursor.execute(constants.DROP_RULES_STAGE_COMMAND_TEXT)
+
+        if deletes:
+            cursor.execute(constants.CREATE_RULES_DELETE_COMMAND_TEXT)
+            cursor.executemany(constants.INSERT_RULES_DELETE_COMMAND_TEXT, [(name,) for name in deletes])
+            cursor.execute(constants.DELETE_RULES_COMMAND_TEXT)
+            cursor.execute(constants.DROP_RULES_DELETE_COMMAND_TEXT)
+
+        cursor.close()
+        return { "upserted": len(upserts), "deleted": len(deletes), "unchanged": unchanged, "shared": len(shared) }
+
+    def collect_shared(self, lock_timeout=0):
+        """
+        Delete the shared rules (and their descendants) that are no longer referenced by any rule.
+        Run it in its own transaction, never in the one of a write: it waits for the exclusive Rules lock, i.e. for
+        every transaction writing rules to commit, so a reference that is not committed yet cannot be missed.
+
+        Parameters:
+        lock_timeout: the maximum wait for the lock in milliseconds (0, the default, skips the collection when rules
+        are being written; the next one deletes what this one left), -1 waits as long as needed
+
+        Returns:
+        The number of deleted rows
+        """
+        if not self.lock(constants.RULES_LOCK_EXCLUSIVE, lock_timeout):
+            logging.info("collect_shared: rules are being written, the collection is skipped")
+            return 0
+
+        cursor = self.connection.cursor()
+        deleted = cursor.execute(constants.CLEAN_SHARED_RULES_COMMAND_TEXT).rowcount
+        cursor.close()
+        return deleted
+
+def split_shared(root_name, rows):
+    """
+    Split a rule table into the rows of the root rule's tree and the shared rules it references (see Rule.get_table)
+    """
+    root_name = str(root_name)
+    children = defaultdict(list)
+    for row in rows:
+        if row["RuleNameFK"] is not None:
+            children[str(row["RuleNameFK"])].append(str(row["RuleName"]))
+
+    reachable = set()
+    stack = [root_name]
+    while stack:
+        name = stack.pop()
+        reachable.add(name)
+        stack.extend(children[name])
+
+    tree_rows = [row for row in rows if str(row["RuleName"]) in reachable]
+    shared_rows = [_normalize(row) for row in rows if str(row["RuleName"]) not in reachable]
+    return tree_rows, shared_rows
+
+def diff_rules(root_name, stored_rows, new_rows):
+    """
+    Diff a new rule table against the stored rows of the same root rule.
+    Nodes of the new tree that match a stored node (same content and, for whole subtrees, same structure) take the
+    stored node's name, so unchanged subtrees keep their rows untouched.
+
+    Returns:
+    A tuple with the rows to upsert (renamed to the stored names) and the names of the stored rows to delete
+    """
+    root_name = str(root_name)
+    new_rows = [_normalize(row) for row in new_rows]
+    stored_rows = [_normalize(row) for row in stored_rows]
+    stored_by_name, stored_children = _link(stored_rows)
+    new_by_name, new_children = _link(new_rows)
+
+    renames = {}
+    if root_name in stored_by_name and root_name in new_by_name:
+        stored_signatures = _signatures(root_name, stored_by_name, stored_children)
+        new_signatures = _signatures(root_name, new_by_name, new_children)
+
+        pairs = [(root_name, root_name)]
+        while pairs:
+            new_name, stored_name = pairs.pop()
+            renames[new_name] = stored_name
+
+            available = defaultdict(list)
+            for child in stored_children[stored_name]:
+                available[stored_signatures[child]].append(child)
+
+            unmatched = []
+            for child in new_children[new_name]:
+                if available[new_signatures[child]]:
+                    pairs.append((child, available[new_signatures[child]].pop()))
+                else:
+                    unmatched.append(child)
+
+            # changed children are matched with a leftover stored child of the same kind so their own children can be reused
+            leftovers = [child for children in available.values() for child in children]
+            for child in unmatched:
+                operator = new_by_name[child]["Operator"]
+                match = next((candidate for candidate in leftovers if operator is not None and stored_by_name[candidate]["Operator"] == operator), None)
+                if match is not None:
+                    leftovers.remove(match)
+                    pairs.append((child, match))
+
+    upserts = []
+    kept = set()
+    for row in new_rows:
+        row = dict(row)
+        row["RuleName"] = renames.get(row["RuleName"], row["RuleName"])
+        row["RuleNameFK"] = renames.get(row["RuleNameFK"], row["RuleNameFK"])
+        kept.add(row["RuleName"])
+        if stored_by_name.get(row["RuleName"]) != row:
+            upserts.append(row)
+
+    deletes = [row["RuleName"] for row in stored_rows if row["RuleName"] not in kept]
+    return upserts, deletes
+
+def _normalize(row):
+    return {
+        "RuleName": str(row["RuleName"]),
+        "Operator": row["Operator"],
+        "Enabled": bool(row["Enabled"]),
+        "RuleExpressionType": int(row["RuleExpressionType"]),
+        "Expression": row["Expression"],
+        "RuleNameFK": str(row["RuleNameFK"]) if row["RuleNameFK"] is not None else None,
+        "WorkflowName": row["WorkflowName"],
+        "Properties": row.get("Properties")
+    }
+
+def _link(rows):
+    by_name = {}
+    children = defaultdict(list)
+    for row in rows:
+        by_name[row["RuleName"]] = row
+        if row["RuleNameFK"] is not None:
+            children[row["RuleNameFK"]].append(row["RuleName"])
+    return by_name, children
+
+def _signatures(root_name, by_name, children):
+    """
+    Hash every subtree bottom-up from its content and the (unordered) hashes of its children
+    """
+    signatures = {}
+    stack = [(root_name, False)]
+    while stack:
+        name, expanded = stack.pop()
+        if expanded:
+            row = by_name[name]
+            content = (row["Operator"], row["Expression"], row["Enabled"], row["RuleExpressionType"], row["WorkflowName"], row["Properties"])
+            child_signatures = sorted(signatures[child] for child in children[name])
+            signatures[name] = hashlib.sha1(repr((content, child_signatures)).encode("utf-8")).hexdigest()
+        else:
+            stack.append((name, True))
+            stack.extend((child, False) for child in children[name])
+    return signatures
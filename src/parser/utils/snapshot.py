@@ -0,0 +1,86 @@
+import json, threading
+
+from . import constants
+from .matcher import CodeMatcher
+
+class MapSnapshot:
+    """
+    An immutable copy of the field mapping tables at a given version, with its compiled code matcher
+    """
+
+    def __init__(self, version, maps):
+        self.version = version
+        self.maps = maps
+        self.matcher = CodeMatcher(maps)
+
+    def enrich(self, item):
+        """
+        Replace the codes of a product mapping item's value with their descriptions (see CodeMatcher.substitute)
+
+        Returns:
+        The item with its enhanced value and the lists of codes that were replaced, one JSON list per map
+        """
+        expression, (map1_matches, map2_matches, map3_matches) = self.matcher.substitute(item["value"])
+
+        item["cat1_codes"] = json.dumps(map1_matches)
+        item["cat2_codes"] = json.dumps(map2_matches)
+        item["cat3_codes"] = json.dumps(map3_matches)
+        item["enhanced_value"] = expression
+
+        return item
+
+class MapSnapshotCache:
+    """
+    Per-worker cache of the field mapping tables.
+    Activities ask for the version the orchestration saw; the tables are only reloaded when the cached copy is older.
+    """
+
+    def __init__(self, loader):
+        """
+        Parameters:
+        loader: a callable returning a (version, maps) tuple, maps being one list of rows per mapping id
+        """
+        self._loader = loader
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def get(self, version=None):
+        """
+        Return a snapshot that is at least as recent as the specified version (or the cached one if no version is given)
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and (version is None or snapshot.version >= version):
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or (version is not None and snapshot.version < version):
+                loaded_version, maps = self._loader()
+                snapshot = MapSnapshot(loaded_version, maps)
+                self._snapshot = snapshot
+            return snapshot
+
+    def invalidate(self):
+        self._snapshot = None
+
+def load_maps(connection):
+    """
+    Read the current field mapping version and the Affiliate/LOB/CustomField rows.
+    The version is read first, so a concurrent change can only make the rows newer than the version, never older.
+
+    Returns:
+    A (version, maps) tuple, maps being a list with the rows of each mapping id in constants.MAPPING_IDS order
+    """
+    cursor = connection.cursor()
+    version = cursor.execute(constants.GET_MAPS_VERSION_COMMAND_TEXT).fetchval()
+
+    maps = {mapping_id.upper(): [] for mapping_id in constants.MAPPING_IDS}
+    for code, mapping_id, short_descr, long_descr in cursor.execute(constants.GET_MAPS_COMMAND_TEXT):
+        maps[mapping_id.strip().upper()].append({
+            "Code": code,
+            "Short_Descr": short_descr,
+            "Long_Descr": long_descr
+        })
+
+    cursor.close()
+    return version or 0, [maps[mapping_id.upper()] for mapping_id in constants.MAPPING_IDS]
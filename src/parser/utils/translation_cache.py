@@ -0,0 +1,211 @@
+import hashlib, json, logging, os, sqlite3, threading, time
+from collections import OrderedDict
+
+from . import constants
+
+class TranslationCache:
+    """
+    Content-addressed cache of LLM translations.
+    Keys are a hash of the prompt inputs, of the prompt template and of a namespace (deployment, model version), so
+    changing any of them invalidates the cached entries. An in-process LRU sits in front of a persistent store.
+    """
+
+    def __init__(self, store=None, namespace="", maxsize=1024, ttl=None):
+        """
+        Parameters:
+        store: the persistent store (see SqlTranslationStore and SqliteTranslationStore), or None for an in-process only cache
+        namespace: anything but the prompt that changes the translation for identical inputs (deployment, model version...)
+        maxsize: the number of entries kept in the in-process LRU
+        ttl: the maximum age of an entry in seconds, or None for entries that never expire
+        """
+        self.store = store
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = { "hits": 0, "lru_hits": 0, "store_hits": 0, "misses": 0, "expired": 0, "puts": 0, "errors": 0 }
+
+    def key(self, inputs, template):
+        """
+        Parameters:
+        inputs: the prompt inputs
+        template: the prompt template the translation is produced with (constants.TRANSLATE_TEMPLATE or
+            constants.TRANSLATE_BATCH_TEMPLATE), so translations of different prompts never share a key
+        """
+        payload = json.dumps({ "namespace": self.namespace, "template": hashlib.sha256(template.encode("utf-8")).hexdigest(), "inputs": inputs }, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Return the cached translation for the key, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                if self._is_fresh(entry[1], now):
+                    self._lru.move_to_end(key)
+                    self._stats["hits"] += 1
+                    self._stats["lru_hits"] += 1
+                    return entry[0]
+                del self._lru[key]
+                self._stats["expired"] += 1
+
+        entry = None
+        if self.store is not None:
+            try:
+                entry = self.store.get(key)
+            except Exception as e:
+                logging.warning(f"Translation cache store lookup failed: {e}")
+                self._count("errors")
+
+        if entry is not None and not self._is_fresh(entry[1], now):
+            self._count("expired")
+            entry = None
+
+        if entry is None:
+            self._count("misses")
+            return None
+
+        self._count("hits")
+        self._count("store_hits")
+        self._remember(key, entry)
+        return entry[0]
+
+    def put(self, key, translation):
+        entry = (translation, time.time())
+        self._remember(key, entry)
+        self._count("puts")
+
+        if self.store is not None:
+            try:
+                self.store.put(key, translation, entry[1])
+            except Exception as e:
+                logging.warning(f"Translation cache store update failed: {e}")
+                self._count("errors")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._lru)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _is_fresh(self, created_at, now):
+        return not self.ttl or now - created_at <= self.ttl
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._lru[key] = entry
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+class SqlTranslationStore:
+    """
+    Translation store backed by the [dbo].[translationCache] table (see src/data/referencedata/translationCache.sql).
+    A single connection is opened on first use and shared by every lookup and update of the worker, behind a lock; it
+    is reopened on the next call after a failure.
+    """
+
+    def __init__(self, connect):
+        """
+        Parameters:
+        connect: a callable returning a new pyodbc connection in autocommit mode (e.g. a partial of db.connect)
+        """
+        self._connect = connect
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        row = self._execute(constants.GET_TRANSLATION_CACHE_COMMAND_TEXT, key)
+        return (row[0], float(row[1])) if row else None
+
+    def put(self, key, translation, created_at):
+        self._execute(constants.PUT_TRANSLATION_CACHE_COMMAND_TEXT, key, translation, int(created_at))
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+            self._connection = None
+
+    def _execute(self, command_text, *params):
+        with self._lock:
+            if self._connection is None:
+                self._connection = self._connect()
+            try:
+                cursor = self._connection.cursor()
+                cursor.execute(command_text, *params)
+                row = cursor.fetchone() if cursor.description else None
+                cursor.close()
+                return row
+            except Exception:
+                # the connection may be broken, the next call opens a new one
+                try:
+                    self._connection.close()
+                except Exception:
+                    pass
+                self._connection = None
+                raise
+
+class SqliteTranslationStore:
+    """
+    Local SQLite stand-in for SqlTranslationStore, for tests and local runs (defaults to an in-memory database)
+    """
+
+    def __init__(self, path=":memory:"):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS translationCache (CacheKey TEXT PRIMARY KEY, Translation TEXT NOT NULL, CreatedAt REAL NOT NULL)")
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection.execute("SELECT Translation, CreatedAt FROM translationCache WHERE CacheKey = ?", (key,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def put(self, key, translation, created_at):
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO translationCache (CacheKey, Translation, CreatedAt) VALUES (?, ?, ?)", (key, translation, created_at))
+
+def create_translation_cache(connect):
+    """
+    Create the translation cache configured by the TRANSLATION_CACHE* app settings
+
+    Parameters:
+    connect: a callable returning a new pyodbc connection in autocommit mode, for the sql store (see SqlTranslationStore)
+
+    Returns:
+    The TranslationCache, or None when caching is disabled
+    """
+    kind = os.environ.get("TRANSLATION_CACHE", constants.TRANSLATION_CACHE_MEMORY)
+    if kind == constants.TRANSLATION_CACHE_NONE:
+        return None
+    elif kind == constants.TRANSLATION_CACHE_SQLITE:
+        store = SqliteTranslationStore(os.environ.get("TRANSLATION_CACHE_SQLITE_PATH", ":memory:"))
+    elif kind == constants.TRANSLATION_CACHE_SQL:
+        store = SqlTranslationStore(connect)
+    else:
+        store = None
+
+    # anything but the prompt template (see TranslationCache.key) that changes the translation of identical inputs
+    namespace = "|".join([
+        os.environ["AZURE_OPENAI_DEPLOYMENT_NAME"],
+        os.environ["AZURE_OPENAI_API_VERSION"],
+        os.environ.get("AZURE_OPENAI_MODEL_VERSION", ""),
+        os.environ.get("TRANSLATION_CACHE_VERSION", "")
+    ])
+
+    return TranslationCache(
+        store,
+        namespace=namespace,
+        maxsize=int(os.environ.get("TRANSLATION_CACHE_SIZE", constants.DEFAULT_TRANSLATION_CACHE_SIZE)),
+        ttl=int(os.environ.get("TRANSLATION_CACHE_TTL_SECONDS", 0)) or None
+    )
@@ -0,0 +1,245 @@
+import json, logging, os, threading
+import httpx
+
+from langchain_openai import AzureChatOpenAI
+from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+
+from . import constants
+
+class Translator:
+    """
+    Process-wide translation chain.
+    The model client, prompt and parser are built on first use and shared by every activity, over a single pooled
+    HTTP client, so connections and TLS sessions are reused between calls. A semaphore bounds the number of
+    concurrent requests and the OpenAI client retries 429/5xx responses with exponential backoff, honoring Retry-After.
+    """
+
+    def __init__(self, endpoint, deployment, api_version, max_connections=16, max_concurrency=8, max_retries=6, timeout=120.0, temperature=0.5, max_tokens=2048):
+        self.endpoint = endpoint
+        self.deployment = deployment
+        self.api_version = api_version
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._http_client = None
+        self._model = None
+        self._chain = None
+        self._batch_chain = None
+
+    @property
+    def chain(self):
+        if self._chain is None:
+            with self._lock:
+                if self._chain is None:
+                    self._chain = self._build_chain()
+        return self._chain
+
+    @property
+    def batch_chain(self):
+        if self._batch_chain is None:
+            self.chain # the batch chain shares the model (and its connection pool) with the single item chain
+            with self._lock:
+                if self._batch_chain is None:
+                    prompt = PromptTemplate(input_variables=["items"], template=constants.TRANSLATE_BATCH_TEMPLATE)
+                    self._batch_chain = prompt | self._model.bind(response_format={ "type": "json_object" }) | StrOutputParser()
+        return self._batch_chain
+
+    def _build_chain(self):
+        self._http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            timeout=httpx.Timeout(self.timeout)
+        )
+
+        self._model = model = AzureChatOpenAI(
+            azure_endpoint=self.endpoint,
+            azure_deployment=self.deployment,
+            openai_api_version=self.api_version,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            max_retries=self.max_retries,
+            timeout=self.timeout,
+            http_client=self._http_client
+        )
+
+        prompt = PromptTemplate(
+            input_variables=["cat1_codes", "cat2_codes", "cat3_codes", "expression"],
+            template = constants.TRANSLATE_TEMPLATE
+        )
+
+        return prompt | model | StrOutputParser()
+
+    def translate(self, inputs):
+        """
+        Translate an enhanced expression into plain english
+
+        Parameters:
+        inputs: a dictionary with the "cat1_codes", "cat2_codes", "cat3_codes" and "expression" prompt variables
+        """
+        chain = self.chain
+        with self._semaphore:
+            return chain.invoke(inputs)
+
+    def translate_batch(self, items):
+        """
+        Translate several enhanced expressions with a single JSON-mode request.
+        Items missing from the answer, or whose translation does not validate, are translated one by one.
+
+        Parameters:
+        items: a dictionary of prompt inputs (see translate) by id
+
+        Returns:
+        A tuple with the dictionary of translations by id and the ids of the items translated one by one
+        """
+        payload = json.dumps([{ "id": str(id), "expression": inputs["expression"] } for id, inputs in items.items()])
+
+        translations = {}
+        try:
+            chain = self.batch_chain
+            with self._semaphore:
+                translations = parse_batch_translations(chain.invoke({ "items": payload }), items.keys())
+        except Exception as e:
+            logging.warning(f"Batch translation of {len(items)} items failed: {e}")
+
+        missing = [id for id in items if id not in translations]
+        if missing:
+            logging.warning(f"Batch translation fell back to single translations for {len(missing)} of {len(items)} items")
+        for id in missing:
+            translations[id] = self.translate(items[id])
+
+        return translations, set(missing)
+
+    def close(self):
+        with self._lock:
+            if self._http_client is not None:
+                self._http_client.close()
+            self._http_client = None
+            self._model = None
+            self._chain = None
+            self._batch_chain = None
+
+def create_translator():
+    """
+    Create the translator configured by the AZURE_OPENAI_* app settings
+    """
+    return Translator(
+        endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
+        deployment=os.environ["AZURE_OPENAI_DEPLOYMENT_NAME"],
+        api_version=os.environ["AZURE_OPENAI_API_VERSION"],
+        max_connections=int(os.environ.get("AZURE_OPENAI_MAX_CONNECTIONS", constants.DEFAULT_OPENAI_MAX_CONNECTIONS)),
+        max_concurrency=int(os.environ.get("AZURE_OPENAI_MAX_CONCURRENCY", constants.DEFAULT_OPENAI_MAX_CONCURRENCY)),
+        max_retries=int(os.environ.get("AZURE_OPENAI_MAX_RETRIES", constants.DEFAULT_OPENAI_MAX_RETRIES))
+    )
+
+def translation_inputs(item):
+    """
+    The prompt inputs of an enriched item (see MapSnapshot.enrich)
+    """
+    return {
+        "cat1_codes": item["cat1_codes"],
+        "cat2_codes": item["cat2_codes"],
+        "cat3_codes": item["cat3_codes"],
+        "expression": item["enhanced_value"]
+    }
+
+def translate_item(translator, cache, item):
+    """
+    Translate an enriched item with the single item prompt, reusing its cached translation if any
+
+    Parameters:
+    cache: the TranslationCache, or None
+
+    Returns:
+    The item with a new key, "translated_value", containing the translated value
+    """
+    inputs = translation_inputs(item)
+
+    if cache is not None:
+        key = cache.key(inputs, constants.TRANSLATE_TEMPLATE)
+        translation = cache.get(key)
+        if translation is not None:
+            item["translated_value"] = translation
+            return item
+
+    translation = translator.translate(inputs)
+
+    if cache is not None:
+        cache.put(key, translation)
+        logging.info(f"Translation cache stats: {cache.stats()}")
+
+    item["translated_value"] = translation
+    return item
+
+def translate_items(translator, cache, items):
+    """
+    Translate a batch of enriched items with a single request (see Translator.translate_batch).
+    Cached translations, of either prompt, are reused and only the remaining items are sent to the model.
+
+    Parameters:
+    cache: the TranslationCache, or None
+
+    Returns:
+    The items, each one with a new key, "translated_value", containing the translated value
+    """
+    pending = {}
+    for item in items:
+        inputs = translation_inputs(item)
+        translation = None
+        if cache is not None:
+            translation = cache.get(cache.key(inputs, constants.TRANSLATE_BATCH_TEMPLATE))
+            if translation is None:
+                translation = cache.get(cache.key(inputs, constants.TRANSLATE_TEMPLATE))
+        if translation is not None:
+            item["translated_value"] = translation
+        else:
+            pending[item["id"]] = inputs
+
+    if pending:
+        translations, single = translator.translate_batch(pending)
+        for item in items:
+            if item["id"] in pending:
+                item["translated_value"] = translations[item["id"]]
+                if cache is not None:
+                    template = constants.TRANSLATE_TEMPLATE if item["id"] in single else constants.TRANSLATE_BATCH_TEMPLATE
+                    cache.put(cache.key(pending[item["id"]], template), item["translated_value"])
+
+        if cache is not None:
+            logging.info(f"Translation cache stats: {cache.stats()}")
+
+    return items
+
+def parse_batch_translations(output, ids):
+    """
+    Validate and split the JSON answer to a batch translation prompt.
+    Entries with an unknown id, a duplicate id or an empty translation are dropped.
+
+    Returns:
+    A dictionary of translations by id, for the valid entries only
+    """
+    expected = { str(id): id for id in ids }
+    answer = json.loads(output)
+    entries = answer.get("translations") if isinstance(answer, dict) else None
+    if not isinstance(entries, list):
+        raise ValueError("the answer has no \"translations\" list")
+
+    translations = {}
+    duplicates = set()
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        id = expected.get(str(entry.get("id")))
+        translation = entry.get("translation")
+        if id is None or not isinstance(translation, str) or not translation.strip():
+            continue
+        if id in translations:
+            duplicates.add(id)
+        translations[id] = translation
+
+    for id in duplicates:
+        del translations[id]
+    return translations